@@ -0,0 +1,51 @@
+"""本地离线星历吞吐基准：逐个计算 vs 整批向量化计算，单位 星盘/秒。
+
+在 backend 目录下运行：
+
+    python -m benchmarks.bench_ephemeris --charts 2000
+"""
+import argparse
+import random
+import time
+
+from services import ephemeris
+from services.astrology_service import AstrologyService
+
+SAMPLE_CITIES = ["北京", "上海", "广州", "成都", "哈尔滨", "乌鲁木齐", "香港", "台北", "Tokyo", "London"]
+
+
+def _random_params(n: int, h_sys: str):
+    rng = random.Random(42)
+    cities = [AstrologyService.get_city_coordinates(name) for name in SAMPLE_CITIES]
+    params = []
+    for _ in range(n):
+        city = rng.choice(cities)
+        params.append({
+            "birthday": f"{rng.randint(1940, 2040)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} "
+                        f"{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00",
+            "tz": city["tz"], "latitude": city["latitude"], "longitude": city["longitude"], "h_sys": h_sys,
+            "planets": AstrologyService.STANDARD_PLANETS, "virtual": AstrologyService.VIRTUAL_POINTS,
+        })
+    return params
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--charts", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"星盘数={args.charts}")
+    for h_sys in ("A", "P"):
+        params = _random_params(args.charts, h_sys)
+        start = time.perf_counter()
+        for p in params:
+            ephemeris.natal_chart(p)
+        single = time.perf_counter() - start
+        start = time.perf_counter()
+        ephemeris.natal_charts(params)
+        batch = time.perf_counter() - start
+        print(f"  宫位制={h_sys}  逐个 {args.charts / single:9.0f} 盘/秒  整批 {args.charts / batch:9.0f} 盘/秒")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""内置城市库基准：加载耗时、常驻内存、前缀补全与城市解析延迟。
+
+在 backend 目录下运行：
+
+    python -m benchmarks.bench_gazetteer --rounds 5
+
+对照项「dict 版」把同样的数据放进 {key: [城市 dict, ...]} 的常规结构，
+用来说明列式存储 + 有序 key 表的内存收益。
+"""
+import argparse
+import gc
+import statistics
+import time
+import tracemalloc
+
+import config
+from services.gazetteer import Gazetteer
+
+QUERIES = ["b", "bei", "北", "北京", "chaoyang", "广东省深", "new y", "東京", "sz", "乌鲁"]
+RESOLVE = ["北京", "朝阳", "北京朝阳", "上海浦东", "台北", "Tokyo", "São Paulo", "北京市朝阳区望京"]
+
+
+def _measure_memory(build):
+    gc.collect()
+    tracemalloc.start()
+    obj = build()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return obj, retained, peak
+
+
+def _load() -> Gazetteer:
+    g = Gazetteer(config.GAZETTEER_FILE)
+    g._ensure_loaded()
+    return g
+
+
+def _dict_version(g: Gazetteer):
+    index = {}
+    for i in range(len(g._keys)):
+        city = g._city(g._key_ids[i])
+        index.setdefault(g._keys[i], []).append(city)
+    return index
+
+
+def _per_call_us(fn, args, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for a in args:
+            fn(a)
+    return (time.perf_counter() - start) / (repeat * len(args)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    Gazetteer(config.GAZETTEER_FILE)
+    print(f"构造（懒加载，未读文件）: {(time.perf_counter() - start) * 1e6:.0f}µs")
+
+    timings = []
+    for _ in range(args.rounds):
+        start = time.perf_counter()
+        _load()
+        timings.append((time.perf_counter() - start) * 1000)
+    print(f"首次加载: 中位数 {statistics.median(timings):.0f}ms (共 {args.rounds} 次)")
+
+    g, retained, peak = _measure_memory(_load)
+    print(f"城市 {len(g)} 个, 索引项 {len(g._keys)} 个")
+    print(f"常驻内存: {retained / 1024:.0f}KB  (加载峰值 {peak / 1024:.0f}KB)")
+    _, dict_retained, _ = _measure_memory(lambda: _dict_version(g))
+    print(f"对照 dict 版常驻内存: {dict_retained / 1024:.0f}KB")
+
+    print(f"前缀补全 search: {_per_call_us(g.search, QUERIES, args.repeat):.1f}µs/次")
+    print(f"城市解析 resolve: {_per_call_us(g.resolve, RESOLVE, args.repeat):.1f}µs/次")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""每请求模型准备开销基准：每次新建 GenerativeModel vs 从 model_pool 复用。
+
+只测到 start_chat 为止（不发网络请求）。在 backend 目录下运行：
+
+    python -m benchmarks.bench_model_setup --requests 2000
+"""
+import argparse
+import time
+
+import google.generativeai as genai
+
+from config import GEMINI_MODEL
+from services.gemini_service import GeminiService
+from services.model_pool import ModelPool
+
+HISTORY = [
+    {"role": "user", "parts": [{"text": "系统提示"}]},
+    {"role": "model", "parts": [{"text": "我明白了。"}]},
+]
+
+
+def _fresh(service: GeminiService):
+    model = genai.GenerativeModel(
+        model_name=GEMINI_MODEL,
+        generation_config=service.generation_config,
+        tools=service.tarot_tools,
+    )
+    return model.start_chat(history=HISTORY)
+
+
+def _pooled(service: GeminiService, pool: ModelPool):
+    model = pool.get(GEMINI_MODEL, service.tarot_tools, service.generation_config)
+    return model.start_chat(history=HISTORY)
+
+
+def _measure(fn, requests: int) -> float:
+    start = time.perf_counter()
+    for _ in range(requests):
+        fn()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    service = GeminiService()
+    pool = ModelPool()
+    pool.get(GEMINI_MODEL, service.tarot_tools, service.generation_config)  # 对应启动时预构建
+
+    print(f"模型={GEMINI_MODEL} 请求数={args.requests}")
+    for name, fn in (("每次新建", lambda: _fresh(service)), ("模型池复用", lambda: _pooled(service, pool))):
+        elapsed = _measure(fn, args.requests)
+        print(f"  {name:<6} {elapsed:7.3f}s  {elapsed / args.requests * 1e6:9.1f} µs/请求")
+
+
+if __name__ == "__main__":
+    main()
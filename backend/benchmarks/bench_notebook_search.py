@@ -0,0 +1,76 @@
+"""占卜笔记检索基准：单用户 1k 条笔记的建索引、检索、增量更新耗时，以及工具返回内容的 token 量。
+
+在 backend 目录下运行：
+
+    python -m benchmarks.bench_notebook_search --entries 1000
+
+对照项「全量」是改造前 read_divination_notebook 的做法：把整本笔记原样拼进工具结果。
+"""
+import argparse
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from services.history_window import estimate_tokens
+from services.notebook_service import NotebookEntry, NotebookService
+
+TOPICS = ["工作", "跳槽", "感情", "复合", "考试", "财运", "搬家", "健康", "家人", "朋友", "创业", "签证"]
+CARDS = ["愚者", "魔术师", "女祭司", "恋人", "战车", "隐士", "命运之轮", "高塔", "星星", "月亮", "太阳", "宝剑八", "星币十", "圣杯二"]
+QUERIES = ["最近想跳槽，工作会顺利吗", "他还会回来吗，复合有希望吗", "这次考试能过吗", "又抽到了高塔", "创业的财运怎么样"]
+
+
+def _entries(n: int, rng: random.Random):
+    for i in range(n):
+        topic, other = rng.sample(TOPICS, 2)
+        cards = rng.sample(CARDS, 3)
+        question = f"关于{topic}的问题，{other}方面也有些担心，第{i}次来问"
+        summary = f"我问了{topic}，抽到了{'、'.join(cards)}。" + f"牌面提示{topic}上需要耐心，{other}会慢慢好起来。" * 3
+        yield NotebookEntry(f"conv-{i}", f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}T10:00:00", question, cards, summary)
+
+
+def _timed_ms(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        NotebookService.NOTEBOOK_DIR = Path(tmp)
+        service = NotebookService()
+        entries = list(_entries(args.entries, random.Random(0)))
+        service._save_notebook("bench", entries)
+
+        def rebuild():
+            service._indexes.clear()
+            service._get_index("bench")
+
+        print(f"笔记 {args.entries} 条")
+        print(f"建索引（含读文件）: {_timed_ms(rebuild, 5):.1f}ms")
+
+        search_ms = [_timed_ms(lambda q=q: service.search_entries("bench", q), args.repeat) for q in QUERIES]
+        print(f"检索 search_entries: 中位数 {statistics.median(search_ms):.2f}ms")
+        tool_ms = [_timed_ms(lambda q=q: service.read_for_tool("bench", q), args.repeat) for q in QUERIES]
+        print(f"工具结果 read_for_tool: 中位数 {statistics.median(tool_ms):.2f}ms")
+
+        index, _ = service._get_index("bench")
+        extra = next(_entries(1, random.Random(1)))
+        print(f"单条增量 upsert: {_timed_ms(lambda: index.upsert(extra.conversation_id, service._index_fields(extra)), args.repeat) * 1000:.0f}µs")
+
+        full = "".join(service._format_entry(i, e) for i, e in enumerate(entries, 1))
+        top_k = [estimate_tokens(service.read_for_tool("bench", q)["notebook_content"]) for q in QUERIES]
+        print(f"工具结果 token: 全量 {estimate_tokens(full)}  →  top-k 平均 {statistics.mean(top_k):.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""钱包并发基准：N 个用户同时购买牌组 / 应用牌组 / 充值入账，对比全局锁与按用户加锁的吞吐。
+
+数据写到临时目录，不触碰 backend/data。在 backend 目录下运行：
+
+    python -m benchmarks.bench_wallet_locks --users 50 --ops 20
+    python -m benchmarks.bench_wallet_locks --backend sqlite
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+from pathlib import Path
+
+import config
+import services.store_storage as store_module
+from services.json_file_cache import JsonFileCache
+from services.keyed_lock import KeyedLock
+from services.sqlite_backend import close_sqlite_backend
+from services.store_storage import StoreStorage
+from services.wallet_service import WalletService
+
+
+def _setup(tmp: Path, backend: str):
+    config.STORAGE_BACKEND = backend
+    config.SQLITE_DB_FILE = tmp / "bench.db"
+    store_module.WALLETS_FILE = tmp / "wallets.json"
+    store_module.WALLET_LEDGER_DIR = tmp / "wallet_ledgers"
+    store_module.PAYMENT_ORDERS_FILE = tmp / "payment_orders.json"
+    store_module._cache = JsonFileCache()
+
+
+async def _user_session(user_id: str, ops: int):
+    await WalletService.get_or_create_wallet(user_id)
+    await WalletService.purchase_deck(user_id, "lunar-mirage")
+    for i in range(ops):
+        if i % 2:
+            await WalletService.credit_stardust(user_id, 10)
+        else:
+            await WalletService.set_active_deck(user_id, "lunar-mirage" if i % 4 else "classic-rws")
+
+
+async def _run(users: int, ops: int) -> float:
+    start = time.perf_counter()
+    await asyncio.gather(*(_user_session(f"bench_{u}", ops) for u in range(users)))
+    return time.perf_counter() - start
+
+
+async def _compare(args):
+    total = args.users * args.ops
+    print(f"后端={args.backend} 用户={args.users} 每用户操作={args.ops} 共 {total} 次")
+    for name, locks in (("全局锁", None), ("按用户加锁", KeyedLock())):
+        with tempfile.TemporaryDirectory() as tmp:
+            _setup(Path(tmp), args.backend)
+            if locks is None:
+                global_lock = asyncio.Lock()
+                StoreStorage.wallet_lock = lambda key: global_lock
+            else:
+                StoreStorage.wallet_lock = locks
+            elapsed = await _run(args.users, args.ops)
+            close_sqlite_backend()
+        print(f"  {name:<6} {elapsed:7.3f}s  {total / elapsed:9.1f} ops/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--ops", type=int, default=20, help="每个用户的应用牌组+入账次数")
+    parser.add_argument("--backend", choices=["json", "sqlite"], default="json")
+    asyncio.run(_compare(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
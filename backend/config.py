@@ -10,16 +10,41 @@ DATA_DIR.mkdir(exist_ok=True)
 
 # 数据文件路径
 USERS_FILE = DATA_DIR / "users.json"
+# 用户名索引 username -> user_id（登录/注册查重直接查表；缺失时启动重建）
+USERNAME_INDEX_FILE = DATA_DIR / "username_index.json"
+# 旧版单文件对话存储（仅用于一次性迁移到分片目录）
 CONVERSATIONS_FILE = DATA_DIR / "conversations.json"
+# 对话分片目录：每个对话一个文件，按 id 哈希前缀分桶 conversations/<ab>/<conversation_id>.json
+CONVERSATIONS_DIR = DATA_DIR / "conversations"
+# 对话二级索引：每个用户一个文件，conversation_id -> {updated_at, title, session_type}，
+# 侧边栏列表只读索引、不加载消息；目录缺失时启动自动重建
+CONVERSATION_INDEX_DIR = DATA_DIR / "conversation_index"
+# 对话消息追加日志（<conversation_id>.jsonl）累计多少条后压实进快照
+CONVERSATION_JOURNAL_COMPACT_EVERY = int(os.getenv("CONVERSATION_JOURNAL_COMPACT_EVERY", "50"))
 # 用量计数（按 token 身份 / 天）
 USAGE_FILE = DATA_DIR / "usage.json"
 # 牌组商城：钱包（星尘余额/已拥有牌组/当前应用牌组）与支付订单
+# wallets.json 为旧版整表钱包，首次访问时按用户导入账本
 WALLETS_FILE = DATA_DIR / "wallets.json"
 PAYMENT_ORDERS_FILE = DATA_DIR / "payment_orders.json"
+# 星尘账本：每个用户一个追加式账本 <md5(user_id)>.jsonl + 余额快照 .json（wallets.json 仅用于迁移）
+WALLET_LEDGER_DIR = DATA_DIR / "wallet_ledgers"
+# 账本每追加多少条写一次余额快照（读取 = 快照 + 其后的账本尾部）
+WALLET_SNAPSHOT_EVERY = int(os.getenv("WALLET_SNAPSHOT_EVERY", "100"))
 # 每日一签:日运记录(牌面/反馈/旅程缓存)
 DAILY_DRAWS_FILE = DATA_DIR / "daily_draws.json"
+# 本命盘缓存：出生数据不变星盘就不变，按 (生日, 经纬度, 时区, 宫位制, 星体) 哈希分片存
+# natal_charts/<ab>/<key>.json，内容为星盘 API 原始数据 + 格式化文本
+CHART_CACHE_DIR = DATA_DIR / "natal_charts"
+# 存储后端：json（默认，开发期可直接看/改数据文件）| sqlite（WAL，适合大数据量）
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json").lower()
+SQLITE_DB_FILE = Path(os.getenv("SQLITE_DB_FILE", str(DATA_DIR / "tarot.db")))
+# SQLite 查询线程池大小（SQL 在线程池中执行，不阻塞事件循环）
+SQLITE_MAX_WORKERS = int(os.getenv("SQLITE_MAX_WORKERS", "4"))
 # 提示词模板目录(每次请求实时读取,编辑后无需重启)
 PROMPTS_DIR = BASE_DIR / "backend" / "prompts"
+# 内置城市库（出生城市 → 经纬度/时区），由 geodata/build_cities.py 生成
+GAZETTEER_FILE = BASE_DIR / "backend" / "geodata" / "cities.tsv.gz"
 
 # ── 支付配置 ────────────────────────────────────────────────────────────────
 # 当真实支付凭证缺失时，是否允许回退到「模拟支付」provider（开发期默认开启）。
@@ -51,11 +76,41 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
 # 换模型只需改环境变量 GEMINI_MODEL，无需改代码
 # 备选：gemini-2.5-flash / gemini-3.1-flash-lite / gemini-3-pro
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-3.1-flash-lite")
+# 历史窗口：发给模型的历史消息估算 token 超过预算时，只原样保留最近 N 轮
+# （一轮 = 一条用户消息及其后的回复）与最新的抽牌/星盘数据块，更早的对话折叠成滚动摘要
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "12000"))
+HISTORY_RECENT_TURNS = int(os.getenv("HISTORY_RECENT_TURNS", "6"))
+# 滚动摘要总长上限（字符，超出丢弃最早的部分）与每条消息摘录长度
+HISTORY_SUMMARY_MAX_CHARS = int(os.getenv("HISTORY_SUMMARY_MAX_CHARS", "1500"))
+HISTORY_SUMMARY_LINE_CHARS = int(os.getenv("HISTORY_SUMMARY_LINE_CHARS", "80"))
+# Agent Loop 中单个工具执行的默认超时（秒）；同一轮的多个工具并发执行
+TOOL_TIMEOUT_SECONDS = float(os.getenv("TOOL_TIMEOUT_SECONDS", "20"))
+# read_divination_notebook：按与当前问题的相关度（BM25）最多返回几条笔记，及笔记内容的 token 上限
+NOTEBOOK_SEARCH_TOP_K = int(os.getenv("NOTEBOOK_SEARCH_TOP_K", "5"))
+NOTEBOOK_SEARCH_TOKEN_CAP = int(os.getenv("NOTEBOOK_SEARCH_TOKEN_CAP", "1500"))
+# 占卜笔记定时生成任务（services/notebook_task_scheduler.py）
+NOTEBOOK_TASK_CONCURRENCY = int(os.getenv("NOTEBOOK_TASK_CONCURRENCY", "4"))  # 同时生成笔记的任务数
+NOTEBOOK_TASK_TIMEOUT_SECONDS = float(os.getenv("NOTEBOOK_TASK_TIMEOUT_SECONDS", "120"))  # 单个任务超时（秒）
+NOTEBOOK_TASK_MAX_ATTEMPTS = int(os.getenv("NOTEBOOK_TASK_MAX_ATTEMPTS", "3"))  # 最多尝试次数，最后一次失败时写入默认摘要
+NOTEBOOK_TASK_RETRY_BACKOFF = float(os.getenv("NOTEBOOK_TASK_RETRY_BACKOFF", "60"))  # 首次重试等待（秒），之后翻倍
+NOTEBOOK_TASK_JOURNAL_COMPACT_EVERY = int(os.getenv("NOTEBOOK_TASK_JOURNAL_COMPACT_EVERY", "200"))  # 任务日志满多少条压实成快照
+# 多进程部署时认领任务的租约时长（秒）：须长于单个任务超时，进程崩溃后租约过期由其他进程接手
+NOTEBOOK_TASK_LEASE_SECONDS = float(os.getenv("NOTEBOOK_TASK_LEASE_SECONDS", str(NOTEBOOK_TASK_TIMEOUT_SECONDS + 60)))
 
 # 星盘API配置 https://api.xingpan.vip/astrology/Apiinterface.html
 # https://docs.qq.com/doc/DQUxhSUpjdkpqYmhH
 ASTROLOGY_API_URL = "http://www.xingpan.vip/astrology/chart/natal"
 ASTROLOGY_ACCESS_TOKEN = os.getenv("ASTROLOGY_ACCESS_TOKEN", "")  # 需要从环境变量设置
+# 星盘数据来源：remote（星盘API）| local（本地离线星历 services/ephemeris.py，需 numpy）
+ASTROLOGY_PROVIDER = os.getenv("ASTROLOGY_PROVIDER", "remote").lower()
+
+# 出站 HTTP（星盘API等）共享连接池，见 services/http_client.py
+OUTBOUND_HTTP_TIMEOUT = float(os.getenv("OUTBOUND_HTTP_TIMEOUT", "30"))  # 单次请求超时（秒）
+OUTBOUND_HTTP_RETRIES = int(os.getenv("OUTBOUND_HTTP_RETRIES", "2"))  # 连接错误/超时/5xx 的重试次数
+OUTBOUND_HTTP_RETRY_BACKOFF = float(os.getenv("OUTBOUND_HTTP_RETRY_BACKOFF", "0.5"))  # 首次重试等待（秒），之后翻倍
+OUTBOUND_HTTP_MAX_CONCURRENCY = int(os.getenv("OUTBOUND_HTTP_MAX_CONCURRENCY", "10"))  # 同时进行的出站请求上限
+OUTBOUND_HTTP_MAX_KEEPALIVE = int(os.getenv("OUTBOUND_HTTP_MAX_KEEPALIVE", "10"))  # 保持的空闲连接数
+OUTBOUND_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("OUTBOUND_HTTP_KEEPALIVE_EXPIRY", "30"))  # 空闲连接保留（秒）
 
 # JWT配置
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
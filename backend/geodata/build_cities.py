@@ -0,0 +1,249 @@
+"""生成内置城市库 geodata/cities.tsv.gz（离线构建，运行时不需要这里的依赖）。
+
+数据来源：
+- 中国大陆：cpca 包 resources/adcodes.csv（行政区划代码 + 经纬度，MIT）
+- 港澳台及海外：geonamescache 包 data/cities15000.json（GeoNames，CC BY 4.0，https://www.geonames.org/）
+- 拼音：pypinyin
+- 海外城市中文译名：cities15000.json 自带的汉字别名，geodata/zh_exonyms.tsv 补充其中缺失的常用译名；
+  另可用 --alternate-names 传入 GeoNames 的 alternateNamesV2.txt，导入其中全部 zh 译名
+
+用法（在 backend 目录下；先 pip download 上述包并解压，或直接安装）：
+
+    python -m geodata.build_cities --adcodes adcodes.csv --geonames cities15000.json
+
+文件分两段，均为制表符分隔：
+- 城市段（"#cities\t<数量>" 之后）每行一个城市：
+      label  name  country  latitude  longitude  tz  std_offset_min  rank
+  label 唯一，作为用户资料里的 birth_city 保存；rank 越小规模越大。
+  行按 (rank, 人口降序, label 长度, label) 排序，行号越小越靠前（自动补全/同名消歧直接比较行号）。
+- 索引段（"#index\t<数量>" 之后）每行 "规范化 key  城市行号"，已按 key 排序。
+  key 包括 label、名称、简称、拼音等，规范化规则见 services.gazetteer.normalise_key；
+  规范化与排序都在构建时完成，运行时加载只需顺序读入。
+"""
+import argparse
+import csv
+import gzip
+import json
+import re
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+from pypinyin import Style, lazy_pinyin, pinyin
+
+from services.gazetteer import normalise_key
+
+MIN_FOREIGN_POPULATION = 100_000
+SPECIAL_REGIONS = {"HK": ("香港", "Asia/Hong_Kong"), "MO": ("澳门", "Asia/Macau"), "TW": ("台湾", "Asia/Taipei")}
+SUFFIXES = ("特别行政区", "维吾尔自治区", "壮族自治区", "回族自治区", "自治区", "自治州", "自治县", "自治旗",
+            "林区", "特区", "新区", "矿区", "省", "市", "区", "县", "旗")
+MAX_READINGS = 8  # 多音字组合出的拼音别名上限
+PLACEHOLDERS = {"市辖区", "县", "省直辖县级行政区划", "自治区直辖县级行政区划", "城区", "郊区", "矿区"}
+CJK = re.compile(r"^[一-鿿]+$")
+EXONYMS_FILE = Path(__file__).with_name("zh_exonyms.tsv")
+
+
+def _stem(name: str) -> str:
+    for suffix in SUFFIXES:
+        if name.endswith(suffix) and len(name) - len(suffix) >= 2:
+            return name[: -len(suffix)]
+    return name
+
+
+def _combinations(choices_per_char, limit: int = MAX_READINGS):
+    combos = [""]
+    for choices in choices_per_char:
+        combos = [c + choice for c in combos for choice in dict.fromkeys(choices)][:limit]
+    return combos
+
+
+def _pinyin_aliases(name: str):
+    """全拼 + 首字母；多音字（朝阳 chaoyang/zhaoyang、重庆）的各读音组合都收录，常用读音优先。"""
+    common = lazy_pinyin(name, errors="ignore")
+    aliases = {"".join(common), "".join(s[0] for s in common)}
+    aliases.update(_combinations(pinyin(name, style=Style.NORMAL, heteronym=True, errors="ignore")))
+    aliases.update(_combinations(pinyin(name, style=Style.FIRST_LETTER, heteronym=True, errors="ignore")))
+    return sorted(a for a in aliases if a)
+
+
+def _std_offset_minutes(tz: str) -> int:
+    zone = ZoneInfo(tz)
+    for month in (1, 7):
+        moment = datetime(2024, month, 15, 12, tzinfo=zone)
+        if not moment.dst():
+            return int(moment.utcoffset().total_seconds() // 60)
+    return int(datetime(2024, 1, 15, tzinfo=zone).utcoffset().total_seconds() // 60)
+
+
+def _rank_by_population(population: int) -> int:
+    return 1 if population >= 1_000_000 else 2 if population >= 300_000 else 3
+
+
+def china_populations(geonames_path: str):
+    """GeoNames 中国城市的中文名 → 人口，用于地级市排序。"""
+    populations = {}
+    for c in json.load(open(geonames_path, encoding="utf-8")).values():
+        if c["countrycode"] == "CN":
+            for alias in c["alternatenames"]:
+                if CJK.match(alias):
+                    populations[alias] = max(populations.get(alias, 0), c["population"])
+    return populations
+
+
+def china_rows(adcodes_path: str, populations):
+    rows = list(csv.DictReader(open(adcodes_path, encoding="utf-8")))
+    by_code = {r["adcode"]: r for r in rows}
+    for r in rows:
+        code, name = r["adcode"], r["name"]
+        if not r["longitude"] or name in PLACEHOLDERS or code[:2] in ("71", "81", "82"):
+            continue
+        province = by_code.get(code[:2] + "0" * 10, {}).get("name", "")
+        municipality = province.endswith("市")
+        if code[2:] == "0" * 10:
+            if not municipality:
+                continue  # 省/自治区本身不是城市；直辖市保留
+            label, rank, parent = name, 1, ""
+        elif code[4:] == "0" * 8:
+            label, rank, parent = province + name, 1, ""
+        elif code[6:] == "0" * 6:
+            city = by_code.get(code[:4] + "0" * 8, {}).get("name", "")
+            if city in PLACEHOLDERS or not city:
+                city = ""
+            parent = province if municipality else (city or province)
+            label = (province if municipality else province + city) + name
+            rank = 3
+        else:
+            continue
+        population = 0
+        if rank == 1:
+            population = max(populations.get(name, 0), populations.get(_stem(name), 0))
+        aliases = {name, _stem(name)}
+        if parent:
+            aliases.add(_stem(parent) + _stem(name))
+        aliases.update(_pinyin_aliases(_stem(name)))
+        yield [label, name, "CN", r["latitude"], r["longitude"], "Asia/Shanghai", rank, population, aliases]
+
+
+def _chinese_name(alternates):
+    for candidate in alternates:
+        if CJK.match(candidate):
+            try:
+                candidate.encode("gb2312")  # 粗略筛出简体写法
+                return candidate
+            except UnicodeEncodeError:
+                continue
+    return None
+
+
+def load_exonyms(paths):
+    """geonameid → 中文译名集合。
+
+    zh_exonyms.tsv 每行 "geonameid  译名,译名"；GeoNames alternateNamesV2.txt 取 isolanguage 为 zh* 的行。
+    繁简写法都可以收，key 规范化时会折叠为简体。
+    """
+    exonyms = {}
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip() or line.startswith("#"):
+                    continue
+                cols = line.rstrip("\n").split("\t")
+                if len(cols) == 2:
+                    geoname_id, names = cols[0], cols[1].split(",")
+                elif len(cols) >= 4 and cols[2].startswith("zh"):
+                    geoname_id, names = cols[1], [cols[3]]
+                else:
+                    continue
+                exonyms.setdefault(int(geoname_id), set()).update(n for n in names if CJK.match(n))
+    return exonyms
+
+
+def _zh_aliases(names):
+    """汉字别名再收一份去掉「市」的写法（纽约市 → 纽约、罗马市 → 罗马）。"""
+    aliases = set(names)
+    aliases.update(_stem(n) for n in names if n.endswith("市"))
+    return aliases
+
+
+def foreign_rows(geonames_path: str, exonyms):
+    cities = json.load(open(geonames_path, encoding="utf-8")).values()
+    chosen = []
+    for c in cities:
+        cc = c["countrycode"]
+        if cc == "CN":
+            continue
+        if cc not in SPECIAL_REGIONS and c["population"] < MIN_FOREIGN_POPULATION:
+            continue
+        chosen.append(c)
+    chosen.sort(key=lambda c: -c["population"])
+
+    labels = Counter()
+    for c in chosen:
+        cc = c["countrycode"]
+        cjk_names = [a for a in c["alternatenames"] if CJK.match(a)]
+        aliases = {c["name"], *_zh_aliases([*cjk_names, *exonyms.get(c["geonameid"], ())])}
+        if cc in SPECIAL_REGIONS:
+            region, tz = SPECIAL_REGIONS[cc]
+            name = _chinese_name(cjk_names)
+            if name:
+                label = name if name == region else region + name
+                aliases.update(_pinyin_aliases(name))
+            else:
+                name = c["name"]
+                label = f"{name}, {cc}"
+        else:
+            tz = c["timezone"]
+            name = c["name"]
+            label = f"{name}, {cc}"
+            if name.endswith(" City"):
+                aliases.add(name[: -len(" City")])
+        labels[label] += 1
+        if labels[label] > 1:
+            label = f"{label} ({c['admin1code']})"
+            labels[label] += 1
+            if labels[label] > 1:
+                continue
+        yield [label, name, cc, f"{c['latitude']:.6f}", f"{c['longitude']:.6f}", tz,
+               _rank_by_population(c["population"]), c["population"], aliases]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--adcodes", required=True)
+    parser.add_argument("--geonames", required=True)
+    parser.add_argument("--alternate-names", help="GeoNames alternateNamesV2.txt（可选）")
+    parser.add_argument("--out", default="geodata/cities.tsv.gz")
+    args = parser.parse_args()
+
+    cities, seen = [], set()
+    populations = china_populations(args.geonames)
+    exonyms = load_exonyms([EXONYMS_FILE, *filter(None, [args.alternate_names])])
+    for city in [*china_rows(args.adcodes, populations), *foreign_rows(args.geonames, exonyms)]:
+        if city[0] not in seen:
+            seen.add(city[0])
+            cities.append(city)
+    # 行号即排序权重：rank 小、人口多、名字短的在前，运行时取前 k 个只需比较行号
+    cities.sort(key=lambda c: (c[6], -c[7], len(c[0]), c[0]))
+
+    rows, index = [], set()
+    for label, name, cc, lat, lon, tz, rank, _, aliases in cities:
+        city_id = len(rows)
+        rows.append("\t".join([
+            label, name, cc, f"{float(lat):.4f}", f"{float(lon):.4f}", tz, str(_std_offset_minutes(tz)), str(rank),
+        ]))
+        for key in {label, name, *aliases}:
+            key = normalise_key(key)
+            if key:
+                index.add((key, city_id))
+    index = sorted(index)
+    lines = [f"#cities\t{len(rows)}", *rows, f"#index\t{len(index)}", *(f"{k}\t{i}" for k, i in index)]
+
+    # mtime=0：内容不变时重新生成的文件逐字节相同
+    with gzip.GzipFile(args.out, "wb", mtime=0) as f:
+        f.write(("\n".join(lines) + "\n").encode("utf-8"))
+    print(f"{len(rows)} 个城市, {len(index)} 个索引项 -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
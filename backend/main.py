@@ -12,8 +12,23 @@ from routers import users, conversations, tarot, astrology, decks, wallet, payme
 async def lifespan(app: FastAPI):
     """应用生命周期管理"""
     from services.notebook_task_scheduler import task_scheduler
+    from services.storage_service import StorageService
+    
+    # 启动时执行：旧版 conversations.json 一次性拆分为分片目录；对话/用户名索引缺失则重建
+    await StorageService.migrate_legacy_conversations()
+    await StorageService.ensure_conversation_index()
+    await StorageService.ensure_username_index()
+    
+    # 预构建 Gemini 模型实例（按 模型名+工具集+配置 放入模型池，各 router 共享）
+    from services.gemini_service import gemini_service
+    from services.notebook_service import notebook_service
+    gemini_service.warm_up()
+    notebook_service.warm_up()
+    
+    # 出站 HTTP 共享连接池（星盘API 等复用连接）
+    from services.http_client import start_http_client, close_http_client
+    await start_http_client()
     
-    # 启动时执行
     print("=" * 60)
     print("启动占卜笔记任务调度器")
     print("=" * 60)
@@ -39,6 +54,10 @@ async def lifespan(app: FastAPI):
     print("停止占卜笔记任务调度器")
     print("=" * 60)
     await task_scheduler.stop_worker()
+    await close_http_client()
+    
+    from services.sqlite_backend import close_sqlite_backend
+    close_sqlite_backend()
 
 
 app = FastAPI(
@@ -82,6 +101,13 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/metrics")
+async def get_metrics():
+    """进程内耗时指标（如 gemini_ttft_ms），仅供调试/监控"""
+    from services.metrics import metrics
+    return metrics.snapshot()
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -106,6 +106,19 @@ class Conversation(BaseModel):
     has_drawn_cards: bool = False  # 是否已抽过牌
 
 
+class ConversationSummary(BaseModel):
+    """对话列表项（不含消息），来自 user_id -> 对话 的二级索引"""
+    conversation_id: str
+    session_type: SessionType
+    title: str
+    updated_at: str
+
+
+class ConversationPage(BaseModel):
+    items: List[ConversationSummary]
+    next_cursor: Optional[str] = None  # 为空表示没有更多
+
+
 class SendMessageRequest(BaseModel):
     conversation_id: str
     content: str
@@ -3,22 +3,23 @@ from fastapi.responses import StreamingResponse
 from typing import List
 from models import (
     SendMessageRequest, DrawCardsRequest, DrawCardsResponse,
-    TarotCard, MessageRole, SessionType, User,
+    TarotCard, MessageRole, SessionType, User, Conversation,
 )
-from services.conversation_service import ConversationService
-from services.gemini_service import GeminiService
+from services.conversation_service import ConversationService, ConversationUnitOfWork
+from services.gemini_service import gemini_service
 from services.astrology_service import AstrologyService
+from services.gazetteer import gazetteer
 from services.tarot_service import TarotService
 from services.user_service import UserService
 from services.notebook_service import notebook_service
 from services.rate_limit_service import RateLimitService
 from dependencies import get_current_user, ensure_owner
+import asyncio
 import json
 import random
 
 router = APIRouter(prefix="/api/astrology", tags=["astrology"])
 
-gemini_service = GeminiService()
 
 # 预设的开场白模板
 GREETING_TEMPLATES = [
@@ -28,13 +29,12 @@ GREETING_TEMPLATES = [
 ]
 
 
-async def should_attach_tarot_cards(conversation_id: str) -> bool:
+def should_attach_tarot_cards(conversation: Conversation) -> bool:
     """
     检查当前是否应该在AI回复中附加抽牌结果
     规则：如果用户最后一条消息是"请根据抽牌结果进行解读"，则附加
     """
-    conversation = await ConversationService.get_conversation(conversation_id)
-    if not conversation or not conversation.messages:
+    if not conversation.messages:
         return False
     
     # 找到最后一条用户消息
@@ -52,10 +52,11 @@ async def send_message(
 ):
     """发送消息并获取AI流式回复（星座咨询，支持Function Calling）"""
     try:
-        # 获取对话
-        conversation = await ConversationService.get_conversation(request.conversation_id)
-        if not conversation:
+        # 获取对话：整个请求只读这一次，之后的改动记在工作单元里，流结束时一次落盘
+        uow = await ConversationUnitOfWork.load(request.conversation_id)
+        if not uow:
             raise HTTPException(status_code=404, detail="对话不存在")
+        conversation = uow.conversation
         ensure_owner(current_user, conversation.user_id)
 
         # 用户即当前登录身份（对话归属已校验）
@@ -90,11 +91,8 @@ async def send_message(
                 yield "data: [DONE]\n\n"
             
             # 保存开场白到对话
-            await ConversationService.add_message(
-                request.conversation_id,
-                MessageRole.ASSISTANT,
-                greeting_message
-            )
+            uow.add_message(MessageRole.ASSISTANT, greeting_message)
+            await uow.flush()
             
             return StreamingResponse(
                 generate_greeting(),
@@ -104,13 +102,9 @@ async def send_message(
         # 用量控制：真正触发 LLM 解读前按身份扣减额度（开场白分支已提前返回，不计）
         await RateLimitService.check_and_consume(current_user)
 
-        # 只有当用户发送了内容时才添加用户消息
+        # 只有当用户发送了内容时才添加用户消息（与AI回复一起在流结束时落盘）
         if request.content:
-            conversation = await ConversationService.add_message(
-                request.conversation_id,
-                MessageRole.USER,
-                request.content
-            )
+            uow.add_message(MessageRole.USER, request.content)
 
         # 流式生成AI回复（使用Agent Loop）
         async def generate():
@@ -162,7 +156,17 @@ async def send_message(
                     
                     # 调用星盘API
                     print(f"[Function Executor] 用户信息完整，开始获取星盘数据")
-                    chart_data = await AstrologyService.fetch_natal_chart(
+                    if not AstrologyService.get_city_coordinates(profile.birth_city):
+                        # 城市库里找不到：不能拿别的城市顶替，请用户重新选择出生城市
+                        return {
+                            "success": False,
+                            "error": f"无法识别出生城市「{profile.birth_city}」",
+                            "missing_fields": ["birth_city"],
+                            "required_action": "你必须先调用 request_user_profile 工具，请用户重新填写出生城市（required_fields 指定 birth_city）。"
+                        }
+                    
+                    # 星盘数据 + 格式化文本（本命盘缓存命中则不调用星盘API）
+                    chart = await AstrologyService.get_natal_chart_text(
                         birth_year=profile.birth_year,
                         birth_month=profile.birth_month,
                         birth_day=profile.birth_day,
@@ -171,30 +175,17 @@ async def send_message(
                         city=profile.birth_city
                     )
                     
-                    if not chart_data:
+                    if not chart:
                         return {
                             "success": False,
                             "error": "获取星盘数据失败，请稍后重试"
                         }
+                    _, chart_text = chart
                     
-                    # 格式化星盘数据为文字
-                    user_info = {
-                        "birth_year": profile.birth_year,
-                        "birth_month": profile.birth_month,
-                        "birth_day": profile.birth_day,
-                        "birth_hour": profile.birth_hour,
-                        "birth_minute": profile.birth_minute,
-                        "city": profile.birth_city
-                    }
-                    chart_text = AstrologyService.format_chart_data_to_text(chart_data, user_info)
-                    
-                    # 保存星盘数据到对话
+                    # 保存星盘数据到对话（检查点：连同此前的待写消息立即落盘）
                     chart_message = f"[星盘数据]\n{chart_text}"
-                    await ConversationService.add_message(
-                        request.conversation_id,
-                        MessageRole.SYSTEM,
-                        chart_message
-                    )
+                    uow.add_message(MessageRole.SYSTEM, chart_message)
+                    await asyncio.shield(uow.flush())  # 工具超时取消时写入照常完成
                     
                     return {
                         "success": True,
@@ -216,41 +207,9 @@ async def send_message(
                     }
                 
                 elif func_name == "read_divination_notebook":
-                    # 读取占卜笔记本
-                    notebook_entries = notebook_service.get_notebook(conversation.user_id)
-                    
-                    if not notebook_entries or len(notebook_entries) == 0:
-                        return {
-                            "success": True,
-                            "notebook_count": 0,
-                            "message": "笔记本中暂时还没有记录。当你完成占卜并退出对话后，系统会自动生成占卜记录保存在笔记本中。"
-                        }
-                    
-                    # 格式化笔记本内容
-                    notebook_text = f"用户的占卜笔记本（共 {len(notebook_entries)} 条记录）：\n\n"
-                    for i, entry in enumerate(notebook_entries, 1):
-                        from datetime import datetime
-                        try:
-                            start_time = datetime.fromisoformat(entry['start_time']).strftime("%Y年%m月%d日")
-                        except:
-                            start_time = entry.get('start_time', '未知时间')
-                        
-                        cards_str = "、".join(entry.get('cards_drawn', [])) if entry.get('cards_drawn') else "无"
-                        
-                        notebook_text += f"【记录 {i}】\n"
-                        notebook_text += f"时间：{start_time}\n"
-                        notebook_text += f"问题：{entry.get('question', '无')}\n"
-                        notebook_text += f"抽到的牌：{cards_str}\n"
-                        notebook_text += f"记录：{entry.get('summary', '无')}\n"
-                        if entry.get('user_feedback'):
-                            notebook_text += f"用户反馈：{entry.get('user_feedback')}\n"
-                        notebook_text += "\n"
-                    
-                    return {
-                        "success": True,
-                        "notebook_count": len(notebook_entries),
-                        "notebook_content": notebook_text
-                    }
+                    # 读取占卜笔记本：只返回与当前问题最相关的几条（有 token 上限）
+                    query = notebook_service.tool_query(conversation, func_args)
+                    return notebook_service.read_for_tool(conversation.user_id, query)
                 
                 else:
                     return {
@@ -263,7 +222,8 @@ async def send_message(
                 conversation.messages, 
                 user,
                 session_type=SessionType.ASTROLOGY,
-                function_executor=execute_function
+                function_executor=execute_function,
+                conversation_id=conversation.conversation_id
             ):
                 if "content" in event:
                     # 流式输出文本内容
@@ -311,22 +271,31 @@ async def send_message(
                         # 检查是否需要附加抽牌结果
                         tarot_cards_to_attach = None
                         draw_request_to_attach = None
-                        if await should_attach_tarot_cards(request.conversation_id):
-                            latest_conv = await ConversationService.get_conversation(request.conversation_id)
-                            tarot_cards_to_attach, draw_request_to_attach = ConversationService.get_latest_tarot_cards(latest_conv)
+                        if should_attach_tarot_cards(conversation):
+                            tarot_cards_to_attach, draw_request_to_attach = ConversationService.get_latest_tarot_cards(conversation)
                         
-                        await ConversationService.add_message(
-                            request.conversation_id,
+                        uow.add_message(
                             MessageRole.ASSISTANT,
                             full_text_response,
                             tarot_cards=tarot_cards_to_attach,
                             draw_request=draw_request_to_attach
                         )
             
+            # 本次请求的消息（用户消息 + AI回复）一次落盘，再通知前端完成
+            await uow.flush()
             yield "data: [DONE]\n\n"
         
+        async def generate_and_flush():
+            # 流异常中断或客户端断开时，也把已产生的改动落盘
+            try:
+                async for chunk in generate():
+                    yield chunk
+            finally:
+                # shield：客户端断开导致的取消不打断落盘
+                await asyncio.shield(uow.flush())
+        
         return StreamingResponse(
-            generate(),
+            generate_and_flush(),
             media_type="text/event-stream"
         )
     
@@ -378,8 +347,11 @@ async def fetch_chart(
         ]):
             raise HTTPException(status_code=400, detail="出生信息不完整，请补充完整的出生日期、时间和地点")
         
-        # 调用星盘API
-        chart_data = await AstrologyService.fetch_natal_chart(
+        if not AstrologyService.get_city_coordinates(profile.birth_city):
+            raise HTTPException(status_code=400, detail=f"无法识别出生城市「{profile.birth_city}」，请重新选择出生城市")
+        
+        # 星盘数据 + 格式化文本（本命盘缓存命中则不调用星盘API）
+        chart = await AstrologyService.get_natal_chart_text(
             birth_year=profile.birth_year,
             birth_month=profile.birth_month,
             birth_day=profile.birth_day,
@@ -388,19 +360,9 @@ async def fetch_chart(
             city=profile.birth_city
         )
         
-        if not chart_data:
+        if not chart:
             raise HTTPException(status_code=500, detail="获取星盘数据失败")
-        
-        # 格式化星盘数据为文字
-        user_info = {
-            "birth_year": profile.birth_year,
-            "birth_month": profile.birth_month,
-            "birth_day": profile.birth_day,
-            "birth_hour": profile.birth_hour,
-            "birth_minute": profile.birth_minute,
-            "city": profile.birth_city
-        }
-        chart_text = AstrologyService.format_chart_data_to_text(chart_data, user_info)
+        _, chart_text = chart
         
         # 打印格式化后的星盘数据（用于调试）
         print("\n" + "="*60)
@@ -492,6 +454,22 @@ async def check_user_profile(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/cities")
+async def search_cities(
+    prefix: str = Query(..., min_length=1, max_length=50, description="城市名/拼音前缀"),
+    limit: int = Query(10, ge=1, le=50),
+):
+    """
+    出生城市自动补全（内置城市库，支持中文、拼音、首字母与海外城市）
+
+    Returns:
+        候选城市列表；前端应把所选城市的 label 保存为 birth_city
+    """
+    return {
+        "cities": gazetteer.search(prefix, limit)
+    }
+
+
 @router.get("/current-zodiac")
 async def get_current_zodiac():
     """获取当前时间对应的星座"""
@@ -517,10 +495,10 @@ async def draw_cards(
         print(f"[Astrology Draw] draw_request.positions: {draw_request.positions}")
 
         # 检查对话是否存在
-        conversation = await ConversationService.get_conversation(conversation_id)
-        if not conversation:
+        uow = await ConversationUnitOfWork.load(conversation_id)
+        if not uow:
             raise HTTPException(status_code=404, detail="对话不存在")
-        ensure_owner(current_user, conversation.user_id)
+        ensure_owner(current_user, uow.conversation.user_id)
 
         # 注意：移除has_drawn_cards的严格检查，允许用户多次抽牌（追问）
         # 系统提示词会引导AI避免不必要的重复抽牌
@@ -528,16 +506,16 @@ async def draw_cards(
         cards = TarotService.draw_cards(draw_request)
         
         # 保存抽牌结果
-        await ConversationService.add_message(
-            conversation_id,
+        uow.add_message(
             MessageRole.SYSTEM,
             "用户已完成抽牌",
             tarot_cards=cards,
             draw_request=draw_request
         )
         
-        # 标记已抽牌（但这不会阻止后续抽牌）
-        await ConversationService.mark_cards_drawn(conversation_id)
+        # 标记已抽牌（但这不会阻止后续抽牌）；与抽牌消息一次落盘
+        uow.mark_cards_drawn()
+        await uow.flush()
         
         return DrawCardsResponse(
             cards=cards,
@@ -1,7 +1,7 @@
-from fastapi import APIRouter, HTTPException, Depends
-from typing import List
+from fastapi import APIRouter, HTTPException, Depends, Query
+from typing import List, Optional
 from models import (
-    Conversation, CreateConversationRequest,
+    Conversation, ConversationPage, CreateConversationRequest,
     UpdateConversationTitleRequest, User,
 )
 from services.conversation_service import ConversationService
@@ -28,6 +28,22 @@ async def create_conversation(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("", response_model=ConversationPage)
+async def list_conversations(
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+):
+    """分页列出当前身份的对话摘要（不含消息，侧边栏用）；next_cursor 传回即取下一页"""
+    try:
+        items, next_cursor = await StorageService.list_user_conversation_summaries(
+            current_user.user_id, limit=limit, cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return ConversationPage(items=items, next_cursor=next_cursor)
+
+
 @router.get("/{conversation_id}", response_model=Conversation)
 async def get_conversation(
     conversation_id: str,
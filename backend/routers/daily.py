@@ -11,7 +11,7 @@ from models import (
 )
 from services.conversation_service import ConversationService
 from services.daily_service import CALENDAR_DAYS, DailyService, compute_streak, extract_tagline
-from services.gemini_service import GeminiService
+from services.gemini_service import gemini_service
 from services.notebook_service import notebook_service
 from services.tarot_service import TarotService
 from services.user_service import UserService
@@ -20,7 +20,6 @@ from dependencies import get_current_user, ensure_owner
 
 router = APIRouter(prefix="/api/daily", tags=["daily"])
 
-gemini_service = GeminiService()
 
 
 def _parse_date(value: str) -> date:
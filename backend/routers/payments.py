@@ -3,6 +3,8 @@
 货币模型：人民币 —充值→ 星尘。下单成功后前端拉起支付（二维码/跳转），
 真实渠道支付完成由渠道回调 notify 入账；模拟渠道由 /mock/pay 直接入账。
 """
+from typing import List
+
 from fastapi import APIRouter, HTTPException, Request, Depends
 from fastapi.responses import PlainTextResponse
 
@@ -12,6 +14,7 @@ from store_models import (
     TopUpRequest, TopUpResponse, PayInstructionModel, PaymentOrder,
 )
 from services.payment_service import PaymentService
+from services.store_storage import StoreStorage
 from dependencies import get_current_user, ensure_owner
 
 router = APIRouter(prefix="/api/payments", tags=["payments"])
@@ -50,10 +53,15 @@ async def create_topup(body: TopUpRequest, current_user: User = Depends(get_curr
     )
 
 
+@router.get("/orders", response_model=List[PaymentOrder])
+async def list_my_orders(current_user: User = Depends(get_current_user)):
+    """我的订单（仅当前身份），按创建时间倒序。"""
+    return await StoreStorage.list_user_orders(current_user.user_id)
+
+
 @router.get("/order/{order_id}", response_model=PaymentOrder)
 async def get_order(order_id: str):
     """查询订单状态（前端下单后轮询，直到 status=paid）。"""
-    from services.store_storage import StoreStorage
     order = await StoreStorage.get_order(order_id)
     if order is None:
         raise HTTPException(status_code=404, detail="订单不存在")
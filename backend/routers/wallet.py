@@ -1,13 +1,15 @@
 """钱包 / 商城目录接口。
 
-- 钱包：星尘余额、已拥有牌组、当前应用牌组；用星尘解锁牌组、应用牌组到实际占卜。
+- 钱包：星尘余额、已拥有牌组、当前应用牌组；用星尘解锁牌组、应用牌组到实际占卜；星尘流水。
 - 目录：牌组与星尘套餐的权威数据（价格/状态由服务端裁定，前端可改为读这里）。
 """
-from fastapi import APIRouter, HTTPException, Depends
+from typing import List
+
+from fastapi import APIRouter, HTTPException, Depends, Query
 
 from models import User
 from store_models import (
-    Wallet, PurchaseDeckRequest, SetActiveDeckRequest, PurchaseResult,
+    Wallet, WalletLedgerEntry, PurchaseDeckRequest, SetActiveDeckRequest, PurchaseResult,
 )
 from store_catalog import STORE_DECKS, STARDUST_PACKAGES
 from services.wallet_service import WalletService
@@ -23,6 +25,17 @@ async def get_wallet(user_id: str, current_user: User = Depends(get_current_user
     return await WalletService.get_or_create_wallet(user_id)
 
 
+@router.get("/wallet/{user_id}/ledger", response_model=List[WalletLedgerEntry])
+async def get_ledger(
+    user_id: str,
+    limit: int = Query(50, ge=1, le=500),
+    current_user: User = Depends(get_current_user),
+):
+    """星尘流水（仅本人），新的在前。"""
+    ensure_owner(current_user, user_id)
+    return await WalletService.get_ledger(user_id, limit)
+
+
 @router.post("/wallet/{user_id}/purchase", response_model=PurchaseResult)
 async def purchase_deck(
     user_id: str,
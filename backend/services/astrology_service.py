@@ -1,35 +1,19 @@
-import httpx
 import json
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 from datetime import datetime
-from config import ASTROLOGY_API_URL, ASTROLOGY_ACCESS_TOKEN
+from config import ASTROLOGY_API_URL, ASTROLOGY_ACCESS_TOKEN, ASTROLOGY_PROVIDER
+from services import http_client
+from services.chart_cache import ChartCache, make_chart_key
+from services.gazetteer import gazetteer
+from services.single_flight import SingleFlight
+
+# 在途的星盘获取（按本命盘缓存 key 合并）
+chart_fetch_flights = SingleFlight()
 
 
 class AstrologyService:
     """星盘服务"""
     
-    # 主要城市的经纬度数据（简化版，实际应用应该使用完整的地理编码服务）
-    CITY_COORDINATES = {
-        "北京": {"latitude": "39.9042", "longitude": "116.4074", "tz": "+8"},
-        "上海": {"latitude": "31.2304", "longitude": "121.4737", "tz": "+8"},
-        "广州": {"latitude": "23.1291", "longitude": "113.2644", "tz": "+8"},
-        "深圳": {"latitude": "22.5431", "longitude": "114.0579", "tz": "+8"},
-        "成都": {"latitude": "30.5728", "longitude": "104.0668", "tz": "+8"},
-        "杭州": {"latitude": "30.2741", "longitude": "120.1551", "tz": "+8"},
-        "重庆": {"latitude": "29.4316", "longitude": "106.9123", "tz": "+8"},
-        "西安": {"latitude": "34.3416", "longitude": "108.9398", "tz": "+8"},
-        "武汉": {"latitude": "30.5928", "longitude": "114.3055", "tz": "+8"},
-        "南京": {"latitude": "32.0603", "longitude": "118.7969", "tz": "+8"},
-        "天津": {"latitude": "39.3434", "longitude": "117.3616", "tz": "+8"},
-        "苏州": {"latitude": "31.2989", "longitude": "120.5853", "tz": "+8"},
-        "郑州": {"latitude": "34.7466", "longitude": "113.6253", "tz": "+8"},
-        "长沙": {"latitude": "28.2282", "longitude": "112.9388", "tz": "+8"},
-        "沈阳": {"latitude": "41.8057", "longitude": "123.4328", "tz": "+8"},
-        "青岛": {"latitude": "36.0671", "longitude": "120.3826", "tz": "+8"},
-        "香港": {"latitude": "22.3193", "longitude": "114.1694", "tz": "+8"},
-        "台北": {"latitude": "25.0330", "longitude": "121.5654", "tz": "+8"},
-    }
-    
     # 标准星体ID列表（根据星盘API文档）
     # 包含10大行星 + 婚神星(H) + 北交点(m)
     STANDARD_PLANETS = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, "H", "m"]
@@ -42,12 +26,30 @@ class AstrologyService:
     ASTEROIDS = []
     
     @staticmethod
-    def get_city_coordinates(city: str) -> Optional[Dict[str, str]]:
-        """获取城市经纬度"""
-        return AstrologyService.CITY_COORDINATES.get(city)
+    def get_city_coordinates(city: str, local_time: Optional[datetime] = None) -> Optional[Dict[str, str]]:
+        """
+        获取城市经纬度与时区（内置城市库，支持中文名/简称/拼音/海外城市）
+        
+        Args:
+            city: 出生城市
+            local_time: 出生时刻（当地时间），用于按出生日期计算时区偏移（夏令时等）；默认当前时间
+            
+        Returns:
+            {"latitude", "longitude", "tz", "label"}，无法识别返回 None
+        """
+        place = gazetteer.resolve(city)
+        if not place:
+            return None
+        offset = gazetteer.utc_offset_hours(place, local_time or datetime.now())
+        return {
+            "latitude": f"{place['latitude']:.4f}",
+            "longitude": f"{place['longitude']:.4f}",
+            "tz": f"{round(offset, 4):+g}",
+            "label": place["label"],
+        }
     
     @staticmethod
-    async def fetch_natal_chart(
+    def _build_chart_params(
         birth_year: int,
         birth_month: int,
         birth_day: int,
@@ -55,31 +57,19 @@ class AstrologyService:
         birth_minute: int,
         city: str
     ) -> Optional[Dict[str, Any]]:
-        """
-        获取本命盘数据
-        
-        Args:
-            birth_year: 出生年份
-            birth_month: 出生月份
-            birth_day: 出生日期
-            birth_hour: 出生小时
-            birth_minute: 出生分钟
-            city: 出生城市
-            
-        Returns:
-            星盘数据字典，如果失败返回 None
-        """
-        # 获取城市经纬度
-        coordinates = AstrologyService.get_city_coordinates(city)
+        """构造星盘API请求参数；出生城市无法识别返回 None"""
+        # 获取城市经纬度与出生时刻的时区偏移
+        local_time = datetime(birth_year, birth_month, birth_day, birth_hour, birth_minute)
+        coordinates = AstrologyService.get_city_coordinates(city, local_time)
         if not coordinates:
-            # 如果城市不在列表中，使用北京作为默认值
-            coordinates = AstrologyService.CITY_COORDINATES["北京"]
+            print(f"[星盘API] ❌ 无法识别出生城市: {city}")
+            return None
         
         # 构造生日字符串
         birthday = f"{birth_year}-{birth_month:02d}-{birth_day:02d} {birth_hour:02d}:{birth_minute:02d}:00"
         
         # 构造请求参数
-        params = {
+        return {
             "access_token": ASTROLOGY_ACCESS_TOKEN,
             "planets": AstrologyService.STANDARD_PLANETS,
             "planet_xs": AstrologyService.ASTEROIDS,  # 小行星
@@ -92,79 +82,195 @@ class AstrologyService:
             # "svg_type": "0",  # 不返回SVG图片
             # "is_corpus": "1",  # 返回语料
         }
+    
+    @staticmethod
+    async def fetch_natal_chart(
+        birth_year: int,
+        birth_month: int,
+        birth_day: int,
+        birth_hour: int,
+        birth_minute: int,
+        city: str
+    ) -> Optional[Dict[str, Any]]:
+        """
+        获取本命盘数据（优先读本命盘缓存，未命中才调用星盘API）
+        
+        Args:
+            birth_year: 出生年份
+            birth_month: 出生月份
+            birth_day: 出生日期
+            birth_hour: 出生小时
+            birth_minute: 出生分钟
+            city: 出生城市
+            
+        Returns:
+            星盘数据字典，如果失败返回 None
+        """
+        params = AstrologyService._build_chart_params(
+            birth_year, birth_month, birth_day, birth_hour, birth_minute, city
+        )
+        if not params:
+            return None
+        chart_key = make_chart_key(params, ASTROLOGY_PROVIDER)
+        entry = await ChartCache.get(chart_key)
+        if entry is not None:
+            print(f"[星盘API] 命中本命盘缓存: {params['birthday']} @ {city}")
+            return entry["chart_data"]
+        
+        return await AstrologyService._fetch_and_store(params, city, chart_key)
+    
+    @staticmethod
+    async def get_natal_chart_text(
+        birth_year: int,
+        birth_month: int,
+        birth_day: int,
+        birth_hour: int,
+        birth_minute: int,
+        city: str
+    ) -> Optional[Tuple[Dict[str, Any], str]]:
+        """
+        获取本命盘数据及其格式化文本（两者都走本命盘缓存）
+        
+        Returns:
+            (chart_data, chart_text)，获取失败返回 None
+        """
+        params = AstrologyService._build_chart_params(
+            birth_year, birth_month, birth_day, birth_hour, birth_minute, city
+        )
+        if not params:
+            return None
+        chart_key = make_chart_key(params, ASTROLOGY_PROVIDER)
+        entry = await ChartCache.get(chart_key)
+        if entry is not None and city in entry["texts"]:
+            print(f"[星盘API] 命中本命盘缓存: {params['birthday']} @ {city}")
+            return entry["chart_data"], entry["texts"][city]
+        
+        if entry is not None:
+            chart_data = entry["chart_data"]
+        else:
+            chart_data = await AstrologyService._fetch_and_store(params, city, chart_key)
+            if not chart_data:
+                return None
+        
+        user_info = {
+            "birth_year": birth_year,
+            "birth_month": birth_month,
+            "birth_day": birth_day,
+            "birth_hour": birth_hour,
+            "birth_minute": birth_minute,
+            "city": city
+        }
+        chart_text = AstrologyService.format_chart_data_to_text(chart_data, user_info)
+        # 重新取一次条目：并发的其他城市可能刚写入了它们的文本
+        entry = await ChartCache.get(chart_key)
+        texts = dict(entry["texts"]) if entry is not None else {}
+        texts[city] = chart_text
+        await ChartCache.put(chart_key, {"chart_data": chart_data, "texts": texts})
+        return chart_data, chart_text
+    
+    @staticmethod
+    async def _fetch_and_store(params: Dict[str, Any], city: str, chart_key: str) -> Optional[Dict[str, Any]]:
+        """
+        缓存未命中时获取星盘并写入缓存
+        
+        同一出生数据的并发请求（用户重复发送、模型同一轮两次调用 get_astrology_chart）
+        合并为一次星盘API调用，所有等待者拿到同一结果；失败（None 或异常）同样
+        交给所有等待者，且不写缓存，下次请求会重新调用。
+        """
+        async def fetch():
+            chart_data = await AstrologyService._request_chart(params, city)
+            if chart_data:
+                await ChartCache.put(chart_key, {"chart_data": chart_data, "texts": {}})
+            return chart_data
+        
+        return await chart_fetch_flights.do(chart_key, fetch)
+    
+    @staticmethod
+    async def _request_chart(params: Dict[str, Any], city: str) -> Optional[Dict[str, Any]]:
+        """调用星盘API（或本地星历），成功返回 chart_data，失败返回 None"""
+        birthday = params["birthday"]
+        if ASTROLOGY_PROVIDER == "local":
+            # 本地离线星历：返回结构与星盘API一致，可直接交给 format_chart_data_to_text
+            from services import ephemeris
+            try:
+                chart_data = ephemeris.natal_chart(params)
+            except Exception as e:
+                print(f"\n[星盘API] ❌ 本地星历计算失败: {str(e)}")
+                return None
+            print(f"[星盘API] 本地星历计算完成: {birthday} @ {city}")
+            return chart_data
         
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                # 打印请求信息
-                print(f"\n[星盘API] 正在调用星盘API...")
-                print(f"[星盘API] 出生信息: {birthday} @ {city}")
+            # 打印请求信息
+            print(f"\n[星盘API] 正在调用星盘API...")
+            print(f"[星盘API] 出生信息: {birthday} @ {city}")
+            
+            # 🆕 打印请求的JSON数据
+            print(f"\n[星盘API] 📤 请求JSON数据：")
+            print("-" * 60)
+            print(json.dumps(params, indent=2, ensure_ascii=False))
+            print("-" * 60)
+            
+            response = await http_client.post_json(ASTROLOGY_API_URL, params)
+            response.raise_for_status()
+            
+            data = response.json()
+            if data.get("code") == 0:
+                print(f"\n[星盘API] ✅ API调用成功")
+                chart_data = data.get("data")
+                
+                # 打印关键数据摘要
+                planets = chart_data.get("planet", [])
+                houses = chart_data.get("house", [])
+                planet_xs = chart_data.get("planet_xs", [])
+                virtual = chart_data.get("virtual", [])
+                
+                print(f"[星盘API] 📊 数据摘要：")
+                print(f"  - 主要行星: {len(planets)} 个")
+                print(f"  - 小行星: {len(planet_xs)} 个")
+                print(f"  - 虚星: {len(virtual)} 个")
+                print(f"  - 宫位: {len(houses)} 个")
                 
-                # 🆕 打印请求的JSON数据
-                print(f"\n[星盘API] 📤 请求JSON数据：")
-                print("-" * 60)
-                print(json.dumps(params, indent=2, ensure_ascii=False))
-                print("-" * 60)
+                # 打印行星数据
+                if planets:
+                    print(f"\n[星盘API] 行星数据：")
+                    for planet in planets:
+                        planet_name = planet.get("planet_chinese", "未知")
+                        sign_name = planet.get("sign", {}).get("sign_chinese", "未知")
+                        house_id = planet.get("house_id", "未知")
+                        print(f"  - {planet_name}: {sign_name}座，第{house_id}宫")
                 
-                response = await client.post(ASTROLOGY_API_URL, json=params)
-                response.raise_for_status()
+                # 打印小行星数据
+                if planet_xs:
+                    print(f"\n[星盘API] 小行星数据：")
+                    for asteroid in planet_xs:
+                        asteroid_name = asteroid.get("planet_chinese", "未知")
+                        sign_name = asteroid.get("sign", {}).get("sign_chinese", "未知")
+                        house_id = asteroid.get("house_id", "未知")
+                        code_name = asteroid.get("code_name", "未知")
+                        print(f"  - {asteroid_name} (ID:{code_name}): {sign_name}座，第{house_id}宫")
                 
-                data = response.json()
-                if data.get("code") == 0:
-                    print(f"\n[星盘API] ✅ API调用成功")
-                    chart_data = data.get("data")
-                    
-                    # 打印关键数据摘要
-                    planets = chart_data.get("planet", [])
-                    houses = chart_data.get("house", [])
-                    planet_xs = chart_data.get("planet_xs", [])
-                    virtual = chart_data.get("virtual", [])
-                    
-                    print(f"[星盘API] 📊 数据摘要：")
-                    print(f"  - 主要行星: {len(planets)} 个")
-                    print(f"  - 小行星: {len(planet_xs)} 个")
-                    print(f"  - 虚星: {len(virtual)} 个")
-                    print(f"  - 宫位: {len(houses)} 个")
-                    
-                    # 打印行星数据
-                    if planets:
-                        print(f"\n[星盘API] 行星数据：")
-                        for planet in planets:
-                            planet_name = planet.get("planet_chinese", "未知")
-                            sign_name = planet.get("sign", {}).get("sign_chinese", "未知")
-                            house_id = planet.get("house_id", "未知")
-                            print(f"  - {planet_name}: {sign_name}座，第{house_id}宫")
-                    
-                    # 打印小行星数据
-                    if planet_xs:
-                        print(f"\n[星盘API] 小行星数据：")
-                        for asteroid in planet_xs:
-                            asteroid_name = asteroid.get("planet_chinese", "未知")
-                            sign_name = asteroid.get("sign", {}).get("sign_chinese", "未知")
-                            house_id = asteroid.get("house_id", "未知")
-                            code_name = asteroid.get("code_name", "未知")
-                            print(f"  - {asteroid_name} (ID:{code_name}): {sign_name}座，第{house_id}宫")
-                    
-                    # 打印虚星数据
-                    print(f"\n[星盘API] 🔍 调试虚星数据：")
-                    print(f"  - 虚星数组长度: {len(virtual)}")
-                    print(f"  - 请求参数 virtual={params.get('virtual')}")
-                    
-                    if virtual:
-                        print(f"\n[星盘API] 🌟 虚星数据（共{len(virtual)}个）：")
-                        for idx, virt in enumerate(virtual):
-                            virt_name = virt.get("planet_chinese", "未知")
-                            sign_name = virt.get("sign", {}).get("sign_chinese", "未知")
-                            house_id = virt.get("house_id", "未知")
-                            code_name = virt.get("code_name", "未知")
-                            print(f"  [{idx}] {virt_name} (code={code_name}, 类型={type(code_name).__name__}): {sign_name}座，第{house_id}宫")
-                    else:
-                        print(f"\n[星盘API] ⚠️ 虚星数据为空")
-                        print(f"[星盘API] 说明：API没有返回virtual字段或返回空数组")
-                    
-                    return chart_data
+                # 打印虚星数据
+                print(f"\n[星盘API] 🔍 调试虚星数据：")
+                print(f"  - 虚星数组长度: {len(virtual)}")
+                print(f"  - 请求参数 virtual={params.get('virtual')}")
+                
+                if virtual:
+                    print(f"\n[星盘API] 🌟 虚星数据（共{len(virtual)}个）：")
+                    for idx, virt in enumerate(virtual):
+                        virt_name = virt.get("planet_chinese", "未知")
+                        sign_name = virt.get("sign", {}).get("sign_chinese", "未知")
+                        house_id = virt.get("house_id", "未知")
+                        code_name = virt.get("code_name", "未知")
+                        print(f"  [{idx}] {virt_name} (code={code_name}, 类型={type(code_name).__name__}): {sign_name}座，第{house_id}宫")
                 else:
-                    print(f"\n[星盘API] ❌ API返回错误: {data.get('msg')}")
-                    return None
+                    print(f"\n[星盘API] ⚠️ 虚星数据为空")
+                    print(f"[星盘API] 说明：API没有返回virtual字段或返回空数组")
+                
+                return chart_data
+            else:
+                print(f"\n[星盘API] ❌ API返回错误: {data.get('msg')}")
+                return None
         except Exception as e:
             print(f"\n[星盘API] ❌ 调用失败: {str(e)}")
             return None
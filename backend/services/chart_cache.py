@@ -0,0 +1,107 @@
+"""本命盘持久缓存。
+
+同一组出生数据的本命盘永远不变：按规范化后的 (生日, 经纬度, 时区, 宫位制, 星体列表)
+取哈希作 key，缓存星盘 API 原始数据 chart_data 与格式化文本。用户改了资料，
+出生数据变了 key 自然不同，无需失效。
+
+条目结构：{"chart_data": {...}, "texts": {出生城市: 格式化文本}}
+（文本里带城市名，未收录的城市会落到同一坐标，故文本按城市分别存）。
+进程内 LRU 命中直接返回（微秒级），未命中再读磁盘 / SQLite。
+"""
+import hashlib
+import json
+import os
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import aiofiles
+
+import config
+from services.sqlite_backend import get_sqlite_backend
+
+_MEMORY_MAX_ENTRIES = 2048
+_memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+
+def _normalise_number(value) -> str:
+    return f"{float(value):.4f}"
+
+
+def make_chart_key(params: Dict[str, Any], provider: str = "remote") -> str:
+    """星盘请求参数 → 缓存 key（规范化后 sha256 前 32 位；access_token 等与星盘内容无关的参数不参与）。
+    非默认数据来源（如本地星历）的结果与星盘 API 略有出入，单独成 key。"""
+    normalised = {
+        "birthday": str(params["birthday"]).strip(),
+        "latitude": _normalise_number(params["latitude"]),
+        "longitude": _normalise_number(params["longitude"]),
+        "tz": _normalise_number(params["tz"]),
+        "h_sys": str(params.get("h_sys", "")).upper(),
+    }
+    for field in ("planets", "planet_xs", "virtual"):
+        normalised[field] = sorted(str(p) for p in params.get(field) or [])
+    if provider != "remote":
+        normalised["provider"] = provider
+    raw = json.dumps(normalised, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+class ChartCache:
+    """本命盘缓存读写（JSON 分片文件 / SQLite）"""
+
+    @staticmethod
+    def _path(chart_key: str):
+        return config.CHART_CACHE_DIR / chart_key[:2] / f"{chart_key}.json"
+
+    @staticmethod
+    def _remember(chart_key: str, entry: Dict[str, Any]):
+        _memory[chart_key] = entry
+        _memory.move_to_end(chart_key)
+        while len(_memory) > _MEMORY_MAX_ENTRIES:
+            _memory.popitem(last=False)
+
+    @staticmethod
+    async def get(chart_key: str) -> Optional[Dict[str, Any]]:
+        """取缓存条目；返回值与内存缓存共享，只读使用（更新请 put 新条目）。"""
+        entry = _memory.get(chart_key)
+        if entry is not None:
+            _memory.move_to_end(chart_key)
+            return entry
+
+        db = get_sqlite_backend()
+        if db:
+            entry = await db.get_natal_chart(chart_key)
+        else:
+            path = ChartCache._path(chart_key)
+            if not path.exists():
+                return None
+            try:
+                async with aiofiles.open(path, "r", encoding="utf-8") as f:
+                    entry = json.loads(await f.read())
+            except (OSError, ValueError) as e:
+                print(f"[ChartCache] 读取缓存失败，忽略: {chart_key} {e}")
+                return None
+        if entry is not None:
+            ChartCache._remember(chart_key, entry)
+        return entry
+
+    @staticmethod
+    async def put(chart_key: str, entry: Dict[str, Any]):
+        """写入缓存条目（先写临时文件再原子替换，读者不会读到半个文件）。"""
+        db = get_sqlite_backend()
+        if db:
+            await db.save_natal_chart(chart_key, entry)
+        else:
+            path = ChartCache._path(chart_key)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # 同一 key 可能被并发写入（不同城市各自补文本），临时文件名各不相同
+            tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+            async with aiofiles.open(tmp, "w", encoding="utf-8") as f:
+                await f.write(json.dumps(entry, ensure_ascii=False))
+            os.replace(tmp, path)
+        ChartCache._remember(chart_key, entry)
+
+    @staticmethod
+    def clear_memory():
+        """清空进程内缓存（测试/基准用）。"""
+        _memory.clear()
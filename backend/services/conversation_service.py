@@ -1,3 +1,4 @@
+import asyncio
 import uuid
 from datetime import datetime
 from typing import List, Optional
@@ -63,20 +64,28 @@ class ConversationService:
             tarot_cards=tarot_cards,
             draw_request=draw_request
         )
+        changed_fields = ConversationService._apply_message(conversation, message)
         
+        # 只追加这一条消息到对话日志，不重写整个对话
+        await StorageService.append_message(conversation_id, message, **changed_fields)
+        return conversation
+    
+    @staticmethod
+    def _apply_message(conversation: Conversation, message: Message) -> dict:
+        """把消息追加到内存中的对话，返回随之变化的对话字段（updated_at，首条用户消息时还有 title）"""
         conversation.messages.append(message)
         conversation.updated_at = datetime.utcnow().isoformat()
+        changed_fields = {"updated_at": conversation.updated_at}
         
         # 如果是用户的第一条消息，根据内容更新标题（daily 对话标题固定为日期，不覆盖）
         if (
-            role == MessageRole.USER
+            message.role == MessageRole.USER
             and conversation.session_type != SessionType.DAILY
             and len([m for m in conversation.messages if m.role == MessageRole.USER]) == 1
         ):
-            conversation.title = ConversationService._generate_title_from_message(content)
-        
-        await StorageService.save_conversation(conversation)
-        return conversation
+            conversation.title = ConversationService._generate_title_from_message(message.content)
+            changed_fields["title"] = conversation.title
+        return changed_fields
     
     @staticmethod
     def _generate_title_from_message(content: str) -> str:
@@ -141,3 +150,67 @@ class ConversationService:
 
 
 
+
+
+class ConversationUnitOfWork:
+    """请求级的对话工作单元。
+
+    一次请求只从存储读一次对话；之后的追加消息、标记抽牌等改动都只作用在内存里的
+    conversation 上并记为待写，flush() 时一次性追加到对话日志。请求结束（SSE 流结束）
+    或显式检查点（例如星盘数据插入）时调用 flush()。
+    """
+    
+    def __init__(self, conversation: Conversation):
+        self.conversation = conversation
+        self._pending: List[Message] = []
+        self._changed_fields: dict = {}
+        self._flush_lock = asyncio.Lock()
+    
+    @classmethod
+    async def load(cls, conversation_id: str) -> Optional["ConversationUnitOfWork"]:
+        """读取对话；不存在返回 None"""
+        conversation = await StorageService.get_conversation(conversation_id)
+        return cls(conversation) if conversation else None
+    
+    @property
+    def dirty(self) -> bool:
+        return bool(self._pending or self._changed_fields)
+    
+    def add_message(
+        self,
+        role: MessageRole,
+        content: str,
+        tarot_cards: Optional[List[TarotCard]] = None,
+        draw_request: Optional[DrawCardsRequest] = None
+    ) -> Message:
+        """追加消息（仅内存，flush 时落盘）"""
+        message = Message(role=role, content=content, tarot_cards=tarot_cards, draw_request=draw_request)
+        self._changed_fields.update(ConversationService._apply_message(self.conversation, message))
+        self._pending.append(message)
+        return message
+    
+    def mark_cards_drawn(self):
+        """标记已抽牌（仅内存，flush 时落盘）"""
+        if not self.conversation.has_drawn_cards:
+            self.conversation.has_drawn_cards = True
+            self._changed_fields["has_drawn_cards"] = True
+    
+    async def flush(self):
+        """把待写改动落盘：有新消息时一次追加到日志，只有字段变化时重写快照。
+
+        待写列表在写入成功后才清掉，写入被取消或出错时改动仍保留，下次 flush 会重试；
+        flush 之间串行，被 shield 的检查点写入还在进行时，收尾的 flush 会等它写完再看还剩什么。
+        """
+        async with self._flush_lock:
+            if not self.dirty:
+                return
+            pending, fields = list(self._pending), dict(self._changed_fields)
+            if pending:
+                await StorageService.append_messages(self.conversation.conversation_id, pending, **fields)
+            else:
+                await StorageService.save_conversation(self.conversation)
+            # 写入期间可能又有新改动，只去掉已写的部分
+            del self._pending[:len(pending)]
+            for key, value in fields.items():
+                if self._changed_fields.get(key) == value:
+                    del self._changed_fields[key]
@@ -2,7 +2,7 @@
 每日一签(Daily Oracle)服务。
 
 - 纯函数:streak、解读上下文窗口、history_block、签语提取、模板渲染(本文件上半部,可单测)
-- DailyService:daily_draws.json 读写 + 提示词组装
+- DailyService:daily_draws.json 读写(STORAGE_BACKEND=sqlite 时转交 SQLite) + 提示词组装
 
 提示词模板在 backend/prompts/ 下,每次请求实时读盘渲染——编辑保存后下一次请求立即生效。
 """
@@ -14,7 +14,8 @@ from typing import Dict, List, Optional
 import aiofiles
 
 from config import DAILY_DRAWS_FILE, PROMPTS_DIR
-from models import Conversation, DailyDrawRecord, MessageRole, User
+from models import Conversation, DailyDrawRecord, DailyFeedback, MessageRole, User
+from services.sqlite_backend import get_sqlite_backend
 
 # 解读上下文:最近至多 7 次,最远回溯 14 天(spec 决策)
 HISTORY_MAX_DRAWS = 7
@@ -144,6 +145,10 @@ class DailyService:
 
     @staticmethod
     async def get_user_records(user_id: str) -> Dict[str, DailyDrawRecord]:
+        db = get_sqlite_backend()
+        if db:
+            raw = await db.get_daily_records(user_id)
+            return {d: DailyDrawRecord(**r) for d, r in raw.items()}
         data = await DailyService._read_all()
         raw = data.get(user_id, {}).get("records", {})
         return {d: DailyDrawRecord(**r) for d, r in raw.items()}
@@ -154,6 +159,10 @@ class DailyService:
 
     @staticmethod
     async def save_record(user_id: str, record: DailyDrawRecord):
+        db = get_sqlite_backend()
+        if db:
+            await db.save_daily_record(user_id, record.model_dump())
+            return
         data = await DailyService._read_all()
         node = data.setdefault(user_id, {"records": {}})
         node.setdefault("records", {})[record.effective_date] = record.model_dump()
@@ -166,6 +175,16 @@ class DailyService:
     ) -> Optional[DailyDrawRecord]:
         """更新指定日期的印证反馈。整体覆盖 feedback:verdict/note 需一并传入,传 None 会清空既有值。"""
         from datetime import datetime
+        db = get_sqlite_backend()
+        if db:
+            record = await DailyService.get_record(user_id, effective_date)
+            if not record:
+                return None
+            record.feedback = DailyFeedback(
+                verdict=verdict, note=note, fed_back_at=datetime.utcnow().isoformat(),
+            )
+            await db.save_daily_record(user_id, record.model_dump())
+            return record
         data = await DailyService._read_all()
         raw = data.get(user_id, {}).get("records", {}).get(effective_date)
         if not raw:
@@ -180,11 +199,18 @@ class DailyService:
 
     @staticmethod
     async def get_journey_cache(user_id: str) -> Optional[dict]:
+        db = get_sqlite_backend()
+        if db:
+            return await db.get_journey_cache(user_id)
         data = await DailyService._read_all()
         return data.get(user_id, {}).get("journey_cache")
 
     @staticmethod
     async def save_journey_cache(user_id: str, generated_on: str, text: str):
+        db = get_sqlite_backend()
+        if db:
+            await db.save_journey_cache(user_id, generated_on, text)
+            return
         data = await DailyService._read_all()
         node = data.setdefault(user_id, {"records": {}})
         node["journey_cache"] = {"generated_on": generated_on, "text": text}
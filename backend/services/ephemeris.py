@@ -0,0 +1,299 @@
+"""离线星历：本地计算本命盘，返回与星盘 API 相同结构的 chart_data。
+
+- 行星：JPL 近似行星根数（Standish，1800–2050 年适用）解开普勒方程得日心坐标，
+  减去地月质心得地心黄经（J2000 历元），再加岁差换算到当日分点；
+- 月亮：Schlyter 平根数 + 主要摄动项（精度约 1–2 角分）；
+- 北交点取平交点（Meeus），南交点 = 北交点 + 180°；
+- 宫位：Placidus（迭代三分半弧）与 Alcabitius（按上升点半弧在赤经上三分）。
+
+所有计算都按 NumPy 数组向量化，可一次算一批星盘（natal_charts）。
+未计入章动、光行差、光行时与 ΔT，误差在角分量级，对星座/度/分展示足够。
+婚神星等小行星无近似根数，离线模式下不返回。
+"""
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+SIGNS = ["白羊", "金牛", "双子", "巨蟹", "狮子", "处女", "天秤", "天蝎", "射手", "摩羯", "水瓶", "双鱼"]
+
+# 星盘 API 的星体 code -> 中文名（离线可计算的部分）
+BODY_NAMES = {
+    "0": "太阳", "1": "月亮", "2": "水星", "3": "金星", "4": "火星",
+    "5": "木星", "6": "土星", "7": "天王星", "8": "海王星", "9": "冥王星",
+    "m": "北交点", "21": "南交点", "10": "上升",
+}
+# compute_longitudes 输出列顺序
+BODY_CODES = ["0", "1", "2", "3", "4", "5", "6", "7", "8", "9", "m", "21"]
+
+# JPL 近似根数：a(au), e, I, L, 近日点经度 ϖ, 升交点经度 Ω（度），及每儒略世纪变化率
+# 行顺序：水星、金星、地月质心、火星、木星、土星、天王星、海王星、冥王星
+_ELEMENTS = np.array([
+    [0.38709927, 0.20563593, 7.00497902, 252.25032350, 77.45779628, 48.33076593],
+    [0.72333566, 0.00677672, 3.39467605, 181.97909950, 131.60246718, 76.67984255],
+    [1.00000261, 0.01671123, -0.00001531, 100.46457166, 102.93768193, 0.0],
+    [1.52371034, 0.09339410, 1.84969142, -4.55343205, -23.94362959, 49.55953891],
+    [5.20288700, 0.04838624, 1.30439695, 34.39644051, 14.72847983, 100.47390909],
+    [9.53667594, 0.05386179, 2.48599187, 49.95424423, 92.59887831, 113.66242448],
+    [19.18916464, 0.04725744, 0.77263783, 313.23810451, 170.95427630, 74.01692503],
+    [30.06992276, 0.00859048, 1.77004347, -55.12002969, 44.96476227, 131.78422574],
+    [39.48211675, 0.24882730, 17.14001206, 238.92903833, 224.06891629, 110.30393684],
+])
+_RATES = np.array([
+    [0.00000037, 0.00001906, -0.00594749, 149472.67411175, 0.16047689, -0.12534081],
+    [0.00000390, -0.00004107, -0.00078890, 58517.81538729, 0.00268329, -0.27769418],
+    [0.00000562, -0.00004392, -0.01294668, 35999.37244981, 0.32327364, 0.0],
+    [0.00001847, 0.00007882, -0.00813131, 19140.30268499, 0.44441088, -0.29257343],
+    [-0.00011607, -0.00013253, -0.00183714, 3034.74612775, 0.21252668, 0.20469106],
+    [-0.00125060, -0.00050991, 0.00193609, 1222.49362201, -0.41897216, -0.28867794],
+    [-0.00196176, -0.00004397, -0.00242939, 428.48202785, 0.40805281, 0.04240589],
+    [0.00026291, 0.00005105, 0.00035372, 218.45945325, -0.32241464, -0.00508664],
+    [-0.00031596, 0.00005170, 0.00004818, 145.20780515, -0.04062942, -0.01183482],
+])
+_EARTH = 2
+
+# 月亮主要摄动项：(系数°, Mm, Ms, D, F) —— 黄经修正 = Σ 系数·sin(Mm·a + Ms·b + D·c + F·d)
+_MOON_TERMS = np.array([
+    [-1.274, 1, 0, -2, 0],   # 出差
+    [0.658, 0, 0, 2, 0],     # 二均差
+    [-0.186, 0, 1, 0, 0],    # 年差
+    [-0.059, 2, 0, -2, 0],
+    [-0.057, 1, 1, -2, 0],
+    [0.053, 1, 0, 2, 0],
+    [0.046, 0, -1, 2, 0],
+    [0.041, 1, -1, 0, 0],
+    [-0.035, 0, 0, 1, 0],    # 视差项
+    [-0.031, 1, 1, 0, 0],
+    [-0.015, 0, 0, -2, 2],
+    [0.011, 1, 0, -4, 0],
+])
+
+_J2000 = 2451545.0
+_UNIX_EPOCH_JD = 2440587.5
+
+
+def julian_day(moment_utc: datetime) -> float:
+    """UTC 时刻（naive datetime）→ 儒略日。"""
+    return _UNIX_EPOCH_JD + (moment_utc - datetime(1970, 1, 1)).total_seconds() / 86400.0
+
+
+def _solve_kepler(mean_anomaly: np.ndarray, e: np.ndarray) -> np.ndarray:
+    """牛顿迭代解开普勒方程 E - e·sinE = M（弧度）。"""
+    ecc = mean_anomaly + e * np.sin(mean_anomaly)
+    for _ in range(8):
+        ecc = ecc - (ecc - e * np.sin(ecc) - mean_anomaly) / (1 - e * np.cos(ecc))
+    return ecc
+
+
+def _heliocentric(t: np.ndarray) -> np.ndarray:
+    """各星体日心黄道直角坐标（J2000），形状 (n, 9, 3)。t 为自 J2000 起的儒略世纪数。"""
+    el = _ELEMENTS[None, :, :] + _RATES[None, :, :] * t[:, None, None]
+    a, e = el[..., 0], el[..., 1]
+    inc, mean_lon, peri, node = (np.radians(el[..., k]) for k in (2, 3, 4, 5))
+    omega = peri - node
+    mean_anomaly = np.remainder(mean_lon - peri + np.pi, 2 * np.pi) - np.pi
+    ecc = _solve_kepler(mean_anomaly, e)
+    xp = a * (np.cos(ecc) - e)
+    yp = a * np.sqrt(1 - e * e) * np.sin(ecc)
+
+    cw, sw, cn, sn, ci, si = np.cos(omega), np.sin(omega), np.cos(node), np.sin(node), np.cos(inc), np.sin(inc)
+    x = (cw * cn - sw * sn * ci) * xp + (-sw * cn - cw * sn * ci) * yp
+    y = (cw * sn + sw * cn * ci) * xp + (-sw * sn + cw * cn * ci) * yp
+    z = (sw * si) * xp + (cw * si) * yp
+    return np.stack([x, y, z], axis=-1)
+
+
+def _moon_longitude(jd: np.ndarray) -> np.ndarray:
+    """月亮地心黄经（当日分点，度）。"""
+    d = jd - 2451543.5
+    node = np.radians(125.1228 - 0.0529538083 * d)
+    inc = np.radians(5.1454)
+    peri = np.radians(318.0634 + 0.1643573223 * d)
+    e = 0.054900
+    mean_anomaly = np.radians(np.remainder(115.3654 + 13.0649929509 * d, 360.0))
+    ecc = _solve_kepler(mean_anomaly, np.full_like(mean_anomaly, e))
+    xv = np.cos(ecc) - e
+    yv = np.sqrt(1 - e * e) * np.sin(ecc)
+    arg = np.arctan2(yv, xv) + peri
+    lon = np.degrees(np.arctan2(
+        np.sin(node) * np.cos(arg) + np.cos(node) * np.sin(arg) * np.cos(inc),
+        np.cos(node) * np.cos(arg) - np.sin(node) * np.sin(arg) * np.cos(inc),
+    ))
+
+    sun_anomaly = np.radians(356.0470 + 0.9856002585 * d)
+    sun_lon = sun_anomaly + np.radians(282.9404 + 4.70935e-5 * d)
+    moon_mean_lon = node + peri + mean_anomaly
+    args = np.stack([
+        mean_anomaly, sun_anomaly, moon_mean_lon - sun_lon, moon_mean_lon - node,
+    ], axis=-1)                                                       # (n, 4)
+    phases = args @ _MOON_TERMS[:, 1:].T                              # (n, 12)
+    return lon + np.sin(phases) @ _MOON_TERMS[:, 0]
+
+
+def _precession(t: np.ndarray) -> np.ndarray:
+    """J2000 → 当日分点的黄经总岁差（度）。"""
+    return (5029.0966 * t + 1.11113 * t * t) / 3600.0
+
+
+def _mean_node(t: np.ndarray) -> np.ndarray:
+    return 125.04452 - 1934.136261 * t + 0.0020708 * t * t + t ** 3 / 450000.0
+
+
+def compute_longitudes(jd_ut: np.ndarray) -> np.ndarray:
+    """一批时刻的各星体地心黄经（当日分点，0–360°），列顺序见 BODY_CODES，形状 (n, 12)。"""
+    jd_ut = np.atleast_1d(np.asarray(jd_ut, dtype=float))
+    t = (jd_ut - _J2000) / 36525.0
+    helio = _heliocentric(t)
+    geo = helio - helio[:, _EARTH:_EARTH + 1, :]
+    planet_lon = np.degrees(np.arctan2(geo[..., 1], geo[..., 0]))   # (n, 9)，地月质心列为 0 向量
+    sun_lon = np.degrees(np.arctan2(-helio[:, _EARTH, 1], -helio[:, _EARTH, 0]))
+    planets = np.delete(planet_lon, _EARTH, axis=1)                   # 水星..冥王星 (n, 8)
+    j2000_lons = np.column_stack([sun_lon, planets]) + _precession(t)[:, None]
+
+    node = _mean_node(t)
+    lons = np.column_stack([
+        j2000_lons[:, :1], _moon_longitude(jd_ut), j2000_lons[:, 1:], node, node + 180.0,
+    ])
+    return np.remainder(lons, 360.0)
+
+
+def _obliquity(t: np.ndarray) -> np.ndarray:
+    return np.radians(23.4392911 - 0.0130042 * t)
+
+
+def _ramc(jd_ut: np.ndarray, longitude: np.ndarray) -> np.ndarray:
+    """中天赤经（弧度）= 格林尼治平恒星时 + 东经。"""
+    t = (jd_ut - _J2000) / 36525.0
+    gmst = 280.46061837 + 360.98564736629 * (jd_ut - _J2000) + 0.000387933 * t * t - t ** 3 / 38710000.0
+    return np.radians(np.remainder(gmst + longitude, 360.0))
+
+
+def _ra_to_ecliptic(ra: np.ndarray, eps: np.ndarray) -> np.ndarray:
+    """黄道上赤经为 ra 的点的黄经（弧度）。"""
+    return np.arctan2(np.sin(ra), np.cos(ra) * np.cos(eps))
+
+
+def _ascensional_difference(lon: np.ndarray, eps: np.ndarray, phi: np.ndarray) -> np.ndarray:
+    decl = np.arcsin(np.sin(eps) * np.sin(lon))
+    return np.arcsin(np.clip(np.tan(phi) * np.tan(decl), -1.0, 1.0))
+
+
+def compute_houses(jd_ut, latitude, longitude, h_sys: str = "P") -> np.ndarray:
+    """一批星盘的 12 宫宫头黄经（度），形状 (n, 12)。h_sys: P=Placidus，A=Alcabitius。"""
+    jd_ut = np.atleast_1d(np.asarray(jd_ut, dtype=float))
+    t = (jd_ut - _J2000) / 36525.0
+    eps = _obliquity(t)
+    phi = np.radians(np.broadcast_to(np.asarray(latitude, dtype=float), jd_ut.shape))
+    ramc = _ramc(jd_ut, np.asarray(longitude, dtype=float))
+
+    mc = _ra_to_ecliptic(ramc, eps)
+    asc = np.arctan2(np.cos(ramc), -(np.sin(ramc) * np.cos(eps) + np.tan(phi) * np.sin(eps)))
+    third = np.pi / 6  # 30°
+
+    if h_sys.upper() == "A":
+        # 上升点的昼半弧在赤经上三等分，夜半弧同理
+        dsa = np.pi / 2 + _ascensional_difference(asc, eps, phi)
+        nsa = np.pi - dsa
+        ras = [ramc + dsa / 3, ramc + 2 * dsa / 3, ramc + dsa + nsa / 3, ramc + dsa + 2 * nsa / 3]
+        c11, c12, c2, c3 = (_ra_to_ecliptic(ra, eps) for ra in ras)
+    elif h_sys.upper() == "P":
+        # 宫头自身的半弧被三等分：宫头赤纬依赖宫头黄经，迭代求解
+        def solve(offset, fraction, nocturnal):
+            lon = _ra_to_ecliptic(ramc + offset, eps)
+            for _ in range(12):
+                ad = _ascensional_difference(lon, eps, phi)
+                if nocturnal:
+                    ra = ramc + np.pi - fraction * (np.pi / 2 - ad)
+                else:
+                    ra = ramc + fraction * (np.pi / 2 + ad)
+                lon = _ra_to_ecliptic(ra, eps)
+            return lon
+        c11 = solve(third, 1 / 3, False)
+        c12 = solve(2 * third, 2 / 3, False)
+        c2 = solve(4 * third, 2 / 3, True)
+        c3 = solve(5 * third, 1 / 3, True)
+    else:
+        raise ValueError(f"不支持的宫位制: {h_sys}")
+
+    cusps = np.column_stack([asc, c2, c3, mc + np.pi, c11 + np.pi, c12 + np.pi, asc + np.pi,
+                             c2 + np.pi, c3 + np.pi, mc, c11, c12])
+    return np.remainder(np.degrees(cusps), 360.0)
+
+
+def _sign_info(lon: float) -> Dict[str, Any]:
+    sign_index = int(lon // 30) % 12
+    within = lon - sign_index * 30
+    deg = int(within)
+    minute = int((within - deg) * 60)
+    return {"sign_id": sign_index + 1, "sign_chinese": SIGNS[sign_index], "deg": deg, "min": minute}
+
+
+def _house_of(lon: float, cusps: Sequence[float]) -> int:
+    for i in range(12):
+        start, end = cusps[i], cusps[(i + 1) % 12]
+        span = (end - start) % 360
+        if (lon - start) % 360 < span:
+            return i + 1
+    return 1
+
+
+def _parse_params(params: Dict[str, Any]):
+    """星盘 API 请求参数 → (UTC 儒略日, 纬度, 经度)。birthday 为当地时间，tz 为时区小时数。"""
+    local = datetime.strptime(str(params["birthday"]).strip(), "%Y-%m-%d %H:%M:%S")
+    utc = local - timedelta(hours=float(params["tz"]))
+    return julian_day(utc), float(params["latitude"]), float(params["longitude"])
+
+
+def _body_entry(code, lon: float, cusps: Sequence[float]) -> Dict[str, Any]:
+    return {
+        "code_name": code,
+        "planet_chinese": BODY_NAMES[str(code)],
+        "longitude": round(lon, 6),
+        "sign": _sign_info(lon),
+        "house_id": _house_of(lon, cusps),
+    }
+
+
+def natal_charts(params_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """批量计算本命盘（星历与宫位整批向量化），返回与星盘 API 相同结构的 chart_data 列表。"""
+    if not params_list:
+        return []
+    parsed = np.array([_parse_params(p) for p in params_list])
+    jd, lat, lon = parsed[:, 0], parsed[:, 1], parsed[:, 2]
+    body_lons = compute_longitudes(jd)
+
+    cusps = np.empty((len(params_list), 12))
+    systems = np.array([str(p.get("h_sys", "P")).upper() for p in params_list])
+    for h_sys in np.unique(systems):
+        rows = systems == h_sys
+        cusps[rows] = compute_houses(jd[rows], lat[rows], lon[rows], h_sys)
+
+    charts = []
+    columns = {code: i for i, code in enumerate(BODY_CODES)}
+    for row, params in enumerate(params_list):
+        row_cusps = cusps[row].tolist()
+        row_lons = body_lons[row].tolist()
+
+        def entry(code):
+            key = str(code)
+            lon_value = row_cusps[0] if key == "10" else row_lons[columns[key]]
+            return _body_entry(code, lon_value, row_cusps)
+
+        wanted = [c for c in params.get("planets", []) if str(c) in BODY_NAMES]
+        virtual = [c for c in params.get("virtual", []) if str(c) in BODY_NAMES]
+        # 与星盘 API 一致：虚星也出现在 planet 数组中
+        charts.append({
+            "planet": [entry(c) for c in wanted + virtual],
+            "virtual": [entry(c) for c in virtual],
+            "planet_xs": [],
+            "house": [
+                {"house_id": i + 1, "longitude": round(c, 6), "sign": _sign_info(c)}
+                for i, c in enumerate(row_cusps)
+            ],
+        })
+    return charts
+
+
+def natal_chart(params: Dict[str, Any]) -> Dict[str, Any]:
+    """计算单个本命盘（参数同星盘 API 请求）。"""
+    return natal_charts([params])[0]
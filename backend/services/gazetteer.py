@@ -0,0 +1,226 @@
+"""内置离线城市库：出生城市 → 经纬度 + IANA 时区，并提供前缀自动补全。
+
+数据文件 geodata/cities.tsv.gz（由 geodata/build_cities.py 生成）约 8.9k 个城市：
+中国大陆到区县级（中文名、去后缀简称、全拼、首字母、「北京朝阳」式简称），
+港澳台全部城镇，海外人口 10 万以上城市（英文名 + 中文/日文汉字别名）。
+繁体写法在 normalise_key 里折叠为简体，「臺北」「紐約」与「台北」「纽约」是同一个 key。
+
+内存布局按列存放，避免每个城市一个 dict / 每个名字一个 str 对象：
+- 字符串列（label、name、国家代码）各拼成一个大字符串 + 偏移数组（_StringTable）；
+- 经纬度存 array('i')（1e-4 度），时区存 array('H') 下标，排序权重存 array('B')；
+- 前缀索引是所有规范化 key 的有序表（同样是 _StringTable）+ 对应城市下标 array('I')。
+  有序表二分即可定位任意前缀的区间，相当于压平的 trie：查找 O(len·log n)，
+  却没有 trie 每个节点一个 dict 的内存开销。
+
+首次查询时才加载（启动零开销）；key 的规范化与排序在构建时完成，加载只是顺序读入，
+耗时记入 metrics 的 gazetteer_load_ms（见 benchmarks/bench_gazetteer.py）。
+"""
+import gzip
+import heapq
+import threading
+import time
+import unicodedata
+from array import array
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import config
+from services.metrics import metrics
+
+LOAD_METRIC = "gazetteer_load_ms"
+_COORD_SCALE = 10000
+_MIN_LATIN_PREFIX = 5
+_IGNORED_CHARS = set(" \t,.'’-·()（），。")
+# 地名常用繁体字 → 简体字（两两一组：繁简），让「臺北」「紐約」与简体写法落到同一个 key
+_T2S_PAIRS = (
+    "亞亚佈布來来侖仑倉仓倫伦傑杰備备兒儿內内凱凯別别則则劍剑動动務务勝胜勞劳勢势勻匀區区參参叢丛吳吴呂吕員员啟启喬乔國国圍围園园圖图堅坚堯尧場场塢坞壟垄壢坜壩坝壽寿"
+    "夢梦奧奥婁娄孫孙學学實实寧宁寶宝將将尋寻對对島岛峽峡崑昆崗岗岡冈崙仑嵐岚嶺岭嶼屿巖岩帶带幹干幾几廈厦廣广廳厅張张強强彎弯後后恆恒懷怀戰战撫抚據据攝摄敘叙數数斷断時时"
+    "晉晋曉晓會会東东條条棗枣棟栋楊杨楓枫榮荣樂乐樓楼標标樞枢樹树橋桥橫横機机檳槟櫻樱欖榄歐欧歲岁歷历歸归氣气淺浅淵渊湧涌湯汤溝沟溫温滄沧滬沪滿满漁渔漢汉漣涟潛潜潤润"
+    "澗涧澤泽濃浓濕湿濟济濤涛濰潍濱滨瀋沈瀏浏瀘泸瀝沥瀟潇瀨濑瀾澜灘滩灣湾烏乌無无煙烟熱热燒烧營营爐炉爛烂爾尔牆墙狹狭獅狮獨独現现瑤瑶瑪玛環环瓊琼瓏珑產产畢毕畫画異异"
+    "當当發发盤盘盧卢眾众硤硖碩硕碼码確确磯矶礦矿禮礼穀谷積积窩窝窪洼窯窑競竞筆笔節节範范築筑篤笃簡简籠笼粵粤糧粮紀纪約约紅红紋纹納纳紐纽紗纱紹绍細细終终結结給给絨绒"
+    "統统絲丝綏绥經经綜综綠绿維维網网綾绫綿绵緒绪線线緣缘緬缅縣县縱纵總总繆缪織织繩绳繼继續续纖纤羅罗義义習习聖圣聞闻聯联聲声聶聂聽听膠胶腳脚臘腊臨临臺台與与興兴舊旧"
+    "舖铺艦舰莊庄荊荆華华萊莱萬万葉叶葦苇蓋盖蓮莲蔣蒋蕪芜蕭萧薊蓟薩萨藍蓝藝艺蘆芦蘇苏蘭兰號号術术衛卫衝冲裏里補补裡里規规見见親亲覺觉觀观訊讯記记訥讷訪访設设許许訶诃"
+    "詩诗誠诚語语調调論论諸诸諾诺謝谢謨谟謬谬證证議议護护讓让豎竖豐丰豬猪貝贝負负財财貢贡貨货貫贯貴贵買买費费貿贸賀贺賈贾資资賓宾賢贤質质賴赖賽赛贊赞贛赣趙赵車车軍军"
+    "軒轩軟软載载輔辅輕轻輝辉輪轮轉转農农這这進进運运達达遜逊遠远遲迟選选遺遗遷迁遼辽邁迈邊边邏逻鄉乡鄒邹鄔邬鄧邓鄭郑鄰邻鄲郸醫医釣钓鈴铃鉛铅銀银銅铜銘铭銚铫鋼钢錢钱"
+    "錦锦錫锡錯错錄录鍋锅鍾钟鎖锁鎮镇鏡镜鐘钟鐵铁長长門门開开閒闲間间閣阁闊阔闍阇關关陣阵陰阴陳陈陸陆陽阳隨随險险隱隐隴陇雙双雜杂雞鸡離离難难雲云霧雾靈灵靜静韃鞑韋韦"
+    "韓韩響响頁页頂顶順顺須须預预頓顿領领頭头顏颜額额願愿類类顯显風风飄飘飛飞飯饭飾饰養养餘余館馆饒饶馬马駐驻騎骑騰腾驗验驛驿驪骊體体鬆松鬥斗鬱郁魚鱼魯鲁鮑鲍鮮鲜鯉鲤"
+    "鱷鳄鳥鸟鳩鸠鳳凤鳴鸣鴉鸦鴨鸭鴻鸿鴿鸽鵝鹅鵬鹏鶯莺鶴鹤鷄鸡鷹鹰鷺鹭鹹咸鹽盐麗丽麥麦黃黄點点黨党齊齐齋斋齒齿龍龙龐庞龜龟"
+)
+_T2S = str.maketrans(_T2S_PAIRS[0::2], _T2S_PAIRS[1::2])
+
+
+def normalise_key(text: str) -> str:
+    """查询/索引 key 规范化：全角转半角、去变音符号、小写、去空格与标点、繁体字折叠为简体。"""
+    decomposed = unicodedata.normalize("NFKD", text.translate(_T2S))
+    return "".join(
+        ch for ch in decomposed.lower()
+        if ch not in _IGNORED_CHARS and not unicodedata.combining(ch)
+    )
+
+
+class _StringTable:
+    """只读字符串数组：全部拼成一个 str，按偏移切片取出。"""
+
+    def __init__(self, strings: Iterable[str]):
+        offsets = array("I", [0])
+        parts = []
+        for s in strings:
+            parts.append(s)
+            offsets.append(offsets[-1] + len(s))
+        self._blob = "".join(parts)
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return self._blob[self._offsets[i]:self._offsets[i + 1]]
+
+    def lower_bound(self, key: str) -> int:
+        """第一个 >= key 的下标（表须有序）。"""
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self[mid] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+
+class Gazetteer:
+    """城市库（懒加载）。查询结果为 dict：label / name / country / latitude / longitude / tz / std_offset（标准时 UTC 偏移，小时）。"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    # ---------- 加载 ----------
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if not self._loaded:
+                self._load()
+                self._loaded = True
+
+    def _load(self):
+        start = time.perf_counter()
+        labels, names, countries = [], [], []
+        lat, lon = array("i"), array("i")
+        tz_index, std_offset, rank = array("H"), array("h"), array("B")
+        tz_names: List[str] = []
+        tz_ids: Dict[str, int] = {}
+        keys, key_ids = [], array("I")
+
+        # 逐行读（不整体读入再 split），加载峰值内存只比常驻多一份 list[str]
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            city_count = int(next(f).split("\t")[1])
+            for _ in range(city_count):
+                label, name, country, la, lo, tz, std, rk = next(f).rstrip("\n").split("\t")
+                labels.append(label)
+                names.append(name)
+                countries.append(country)
+                lat.append(round(float(la) * _COORD_SCALE))
+                lon.append(round(float(lo) * _COORD_SCALE))
+                if tz not in tz_ids:
+                    tz_ids[tz] = len(tz_names)
+                    tz_names.append(tz)
+                tz_index.append(tz_ids[tz])
+                std_offset.append(int(std))
+                rank.append(int(rk))
+
+            # 索引段：构建时已规范化并排序
+            index_count = int(next(f).split("\t")[1])
+            for _ in range(index_count):
+                key, city_id = next(f).rstrip("\n").split("\t")
+                keys.append(key)
+                key_ids.append(int(city_id))
+
+        self._labels = _StringTable(labels)
+        self._names = _StringTable(names)
+        self._countries = _StringTable(countries)
+        self._lat, self._lon = lat, lon
+        self._tz_index, self._tz_names = tz_index, tz_names
+        self._std_offset, self._rank = std_offset, rank
+        self._keys = _StringTable(keys)
+        self._key_ids = key_ids
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        metrics.observe(LOAD_METRIC, elapsed_ms)
+        print(f"[Gazetteer] 城市库已加载: {city_count} 个城市, {index_count} 个索引项, {elapsed_ms:.0f}ms")
+
+    # ---------- 查询 ----------
+
+    def __len__(self) -> int:
+        self._ensure_loaded()
+        return len(self._labels)
+
+    def _city(self, city_id: int) -> Dict[str, Any]:
+        return {
+            "label": self._labels[city_id],
+            "name": self._names[city_id],
+            "country": self._countries[city_id],
+            "latitude": self._lat[city_id] / _COORD_SCALE,
+            "longitude": self._lon[city_id] / _COORD_SCALE,
+            "tz": self._tz_names[self._tz_index[city_id]],
+            "std_offset": self._std_offset[city_id] / 60,
+        }
+
+    def _range(self, key: str, prefix: bool):
+        """索引中等于 key（prefix=True 时为以 key 开头）的区间 [lo, hi)。"""
+        lo = self._keys.lower_bound(key)
+        hi = self._keys.lower_bound(key + ("\uffff" if prefix else "\x00"))
+        return lo, hi
+
+    def search(self, prefix: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """前缀自动补全：完全匹配优先，其余按城市规模排序（数据文件中行号即排序）。"""
+        key = normalise_key(prefix)
+        if not key:
+            return []
+        self._ensure_loaded()
+        lo, hi = self._range(key, prefix=True)
+        exact_hi = self._range(key, prefix=False)[1]
+        exact = sorted(set(self._key_ids[lo:exact_hi]))
+        seen = set(exact)
+        partial = heapq.nsmallest(limit, {i for i in self._key_ids[exact_hi:hi] if i not in seen})
+        return [self._city(city_id) for city_id in (exact + partial)[:limit]]
+
+    def resolve(self, text: str) -> Optional[Dict[str, Any]]:
+        """
+        把用户填写的出生城市解析为唯一城市
+
+        先找完全匹配的名称/简称/拼音（同名取规模最大的，如「朝阳」→ 辽宁省朝阳市）；
+        找不到再取输入的最长已知前缀（「北京市朝阳区望京」→ 北京市朝阳区）。
+        无法识别返回 None。
+        """
+        key = normalise_key(text or "")
+        if not key:
+            return None
+        self._ensure_loaded()
+        for end in range(len(key), 1, -1):
+            candidate = key[:end]
+            # 拉丁字母前缀太短容易误中拼音首字母简称（如 "xy"），至少 5 个字母才采用
+            if end < len(key) and candidate.isascii() and end < _MIN_LATIN_PREFIX:
+                break
+            lo, hi = self._range(candidate, prefix=False)
+            if lo < hi:
+                return self._city(min(self._key_ids[lo:hi]))
+        return None
+
+    @staticmethod
+    def utc_offset_hours(city: Dict[str, Any], local_time: datetime) -> float:
+        """出生地当地时间对应的 UTC 偏移（小时，含夏令时等历史变更）；系统缺少时区库时退回标准时。"""
+        try:
+            zone = ZoneInfo(city["tz"])
+        except ZoneInfoNotFoundError:
+            return city["std_offset"]
+        return local_time.replace(tzinfo=zone).utcoffset().total_seconds() / 3600
+
+
+# 全局实例
+gazetteer = Gazetteer(config.GAZETTEER_FILE)
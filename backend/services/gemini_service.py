@@ -1,13 +1,23 @@
+import asyncio
 import json
+import time
 import google.generativeai as genai
-from typing import AsyncGenerator, Optional, Dict, List, Any
-from config import GEMINI_API_KEY, GEMINI_MODEL
+from typing import AsyncGenerator, Optional, Dict, List, Any, Tuple
+from config import GEMINI_API_KEY, GEMINI_MODEL, TOOL_TIMEOUT_SECONDS
 from models import Message, MessageRole, TarotCard, User, SessionType
 from google.generativeai.types import FunctionDeclaration, Tool
+from services import http_client
+from services.history_window import history_windower
+from services.metrics import metrics
+from services.prompt_cache import formatted_history_cache
+from services.model_pool import model_pool
 
 # 配置Gemini API
 genai.configure(api_key=GEMINI_API_KEY)
 
+# 首个文本 token 到达耗时（send_message_async 发起 → 第一个文本块）
+TTFT_METRIC = "gemini_ttft_ms"
+
 
 class GeminiService:
     """Gemini AI服务（支持Function Calling）"""
@@ -114,6 +124,10 @@ class GeminiService:
                 "reason": {
                     "type": "string",
                     "description": "读取笔记本的原因，说明为什么需要查看历史记录"
+                },
+                "query": {
+                    "type": "string",
+                    "description": "想查找的历史记录的关键词（如问题主题、牌名），只会返回最相关的几条记录；留空则按当前对话检索"
                 }
             },
             "required": ["reason"]
@@ -283,6 +297,15 @@ class GeminiService:
     当我说看星盘，你使用`get_astrology_chart` 工具获取星盘数据，然后你只需告诉我太阳星座，月亮星座是什么就够了；
     当我说填资料，你回复好的，然后使用`request_user_profile` 工具请求用户补充信息，然后你把结果简单告知我即可"""
 
+    # 各工具执行超时（秒），未列出的用 TOOL_TIMEOUT_SECONDS；星盘要请求外部 API，
+    # 按出站请求全部重试耗尽的最长耗时再留 5 秒余量，否则重试还没轮到就被取消
+    TOOL_TIMEOUTS = {
+        "get_astrology_chart": http_client.worst_case_seconds() + 5.0,
+        "read_divination_notebook": 10.0,
+        "draw_tarot_cards": 5.0,
+        "request_user_profile": 5.0,
+    }
+    
     def __init__(self):
         # 定义工具集合 - 两个会话都可以使用所有工具
         all_tools = [
@@ -291,10 +314,11 @@ class GeminiService:
             self.TOOL_REQUEST_USER_PROFILE,
             self.TOOL_READ_NOTEBOOK
         ]
+        # 两个工具集内容相同，共用同一个 Tool 列表，在模型池中对应同一个模型实例
         self.tarot_tools = [Tool(function_declarations=all_tools)]
-        self.astrology_tools = [Tool(function_declarations=all_tools)]
+        self.astrology_tools = self.tarot_tools
         
-        # 创建模型实例（不带工具，工具在调用时动态配置）
+        # 生成配置（模型实例从 model_pool 按 模型名+工具集+配置 复用）
         self.generation_config = {
             "temperature": 0.9,
             "top_p": 0.95,
@@ -328,14 +352,57 @@ class GeminiService:
         else:
             return "\n# <用户资料>\n尚未完善（如需星盘分析，请使用 request_user_profile 工具请求用户补充信息）"
     
+    def _tools_for(self, session_type: SessionType) -> List[Tool]:
+        """选择工具集(daily 与 tarot 同集:含 read_divination_notebook;模板已禁止再抽牌)"""
+        return self.tarot_tools if session_type in (SessionType.TAROT, SessionType.DAILY) else self.astrology_tools
+    
+    def _get_model(self, session_type: SessionType) -> genai.GenerativeModel:
+        """按会话类型取池中复用的模型实例"""
+        return model_pool.get(GEMINI_MODEL, self._tools_for(session_type), self.generation_config)
+    
+    def warm_up(self):
+        """启动时预构建各会话类型用到的模型，避免首个请求承担构建开销"""
+        for session_type in SessionType:
+            self._get_model(session_type)
+    
+    def _render_message(self, msg: Message) -> List[Dict]:
+        """单条历史消息格式化为 0~2 条 Gemini 消息"""
+        # 处理系统消息（抽牌结果或星盘数据）
+        if msg.role == MessageRole.SYSTEM:
+            # 处理塔罗抽牌结果
+            if msg.tarot_cards:
+                cards_desc = "[抽牌结果]如下：\n"
+                for i, card in enumerate(msg.tarot_cards, 1):
+                    position = msg.draw_request.positions[i-1] if msg.draw_request and msg.draw_request.positions else f"第{i}张"
+                    reversed_str = "（逆位）" if card.reversed else "（正位）"
+                    cards_desc += f"{position}: {card.card_name} {reversed_str}\n"
+                # 在抽牌结果后添加确认语
+                return [
+                    {"role": "user", "parts": [{"text": cards_desc}]},
+                    {"role": "model", "parts": [{"text": "我看到了，让我为你解读这些牌。"}]},
+                ]
+            # 处理星盘数据（内容以[星盘数据]开头）
+            if msg.content.startswith("[星盘数据]"):
+                # 在星盘数据后添加确认语
+                return [
+                    {"role": "user", "parts": [{"text": msg.content}]},
+                    {"role": "model", "parts": [{"text": "我看到了你的星盘数据，让我为你解读。"}]},
+                ]
+            return []
+        
+        # 如果是助手消息且有抽牌请求，不再添加抽牌结果（已在SYSTEM消息中处理）
+        role = "user" if msg.role == MessageRole.USER else "model"
+        return [{"role": role, "parts": [{"text": msg.content}]}]
+    
     def _format_messages_for_gemini(
         self,
         messages: List[Message],
         user: Optional[User] = None,
         session_type: SessionType = SessionType.TAROT,
-        system_prompt_override: Optional[str] = None
+        system_prompt_override: Optional[str] = None,
+        conversation_id: Optional[str] = None
     ) -> List[Dict]:
-        """将消息格式化为Gemini API格式"""
+        """将消息格式化为Gemini API格式（传入 conversation_id 时复用该对话已格式化的历史）"""
         gemini_messages = []
 
         # 根据会话类型选择系统提示;override(daily/journey)由调用方完整渲染,
@@ -361,57 +428,72 @@ class GeminiService:
             "parts": [{"text": "我明白了。"}]
         })
         
-        # 添加历史消息
-        for msg in messages:
-            # 处理系统消息（抽牌结果或星盘数据）
-            if msg.role == MessageRole.SYSTEM:
-                # 处理塔罗抽牌结果
-                if msg.tarot_cards:
-                    cards_desc = "[抽牌结果]如下：\n"
-                    for i, card in enumerate(msg.tarot_cards, 1):
-                        position = msg.draw_request.positions[i-1] if msg.draw_request and msg.draw_request.positions else f"第{i}张"
-                        reversed_str = "（逆位）" if card.reversed else "（正位）"
-                        cards_desc += f"{position}: {card.card_name} {reversed_str}\n"
-                    gemini_messages.append({
-                        "role": "user",
-                        "parts": [{"text": cards_desc}]
-                    })
-                    # 在抽牌结果后添加确认语
-                    gemini_messages.append({
-                        "role": "model",
-                        "parts": [{"text": "我看到了，让我为你解读这些牌。"}]
-                    })
-                # 处理星盘数据（内容以[星盘数据]开头）
-                elif msg.content.startswith("[星盘数据]"):
-                    gemini_messages.append({
-                        "role": "user",
-                        "parts": [{"text": msg.content}]
-                    })
-                    # 在星盘数据后添加确认语
-                    gemini_messages.append({
-                        "role": "model",
-                        "parts": [{"text": "我看到了你的星盘数据，让我为你解读。"}]
-                    })
-                continue
-            
-            content = msg.content
-            
-            # 如果是助手消息且有抽牌请求，不再添加抽牌结果（已在SYSTEM消息中处理）
-            role = "user" if msg.role == MessageRole.USER else "model"
+        # 历史超出 token 预算时：较早的对话折叠为滚动摘要，其余原样发送
+        kept_indices, history_summary = history_windower.window_indices(messages)
+        if history_summary:
+            gemini_messages.append({
+                "role": "user",
+                "parts": [{"text": f"[此前对话摘要]\n{history_summary}"}]
+            })
             gemini_messages.append({
-                "role": role,
-                "parts": [{"text": content}]
+                "role": "model",
+                "parts": [{"text": "好的，我记得我们之前聊过的内容。"}]
             })
         
+        # 添加历史消息（按对话缓存已格式化的前缀，只格式化新增消息）
+        rendered = formatted_history_cache.render(conversation_id, messages, self._render_message)
+        for i in kept_indices:
+            gemini_messages.extend(rendered[i])
+        
         return gemini_messages
     
+    async def _stream_turn(self, chat, content) -> AsyncGenerator[Tuple[str, Any], None]:
+        """
+        以 stream=True 发送一轮消息，逐块产出 ("text", str) 或 ("function_call", FunctionCall)。
+        
+        流必须被完整消费：ChatSession 在流结束后才把本轮回复并入历史，
+        下一轮 send_message_async 才能带上它。首个文本块到达时记录 TTFT。
+        """
+        started = time.perf_counter()
+        first_token = True
+        response = await chat.send_message_async(content, stream=True)
+        async for chunk in response:
+            # 直接读 candidates：chunk.parts 在无候选（如仅含用量信息的块）时会抛错
+            if not chunk.candidates:
+                continue
+            for part in chunk.candidates[0].content.parts:
+                if part.function_call and part.function_call.name:
+                    print(f"[Gemini Agent] 🔧 检测到函数调用: {part.function_call.name}")
+                    print(f"[Gemini Agent] 参数: {dict(part.function_call.args)}")
+                    yield "function_call", part.function_call
+                elif part.text:
+                    if first_token:
+                        first_token = False
+                        ttft_ms = (time.perf_counter() - started) * 1000
+                        metrics.observe(TTFT_METRIC, ttft_ms)
+                        print(f"[Gemini Agent] ⏱️ 首个token耗时: {ttft_ms:.0f}ms")
+                    yield "text", part.text
+    
+    async def _execute_function(self, function_executor: callable, func_name: str, func_args: Dict) -> Dict[str, Any]:
+        """执行单个函数调用；超时或出错时返回失败结果（交给模型向用户说明），不影响同轮其他调用"""
+        timeout = self.TOOL_TIMEOUTS.get(func_name, TOOL_TIMEOUT_SECONDS)
+        try:
+            return await asyncio.wait_for(function_executor(func_name, func_args), timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"[Gemini Agent] ⚠️ 函数 {func_name} 执行超时（{timeout}s）")
+            return {"success": False, "error": f"{func_name} 执行超时，请稍后重试"}
+        except Exception as e:
+            print(f"[Gemini Agent] ❌ 函数 {func_name} 执行出错: {e}")
+            return {"success": False, "error": f"{func_name} 执行出错: {e}"}
+    
     async def stream_response(
         self,
         messages: List[Message],
         user: Optional[User] = None,
         session_type: SessionType = SessionType.TAROT,
         function_executor: Optional[callable] = None,
-        system_prompt_override: Optional[str] = None
+        system_prompt_override: Optional[str] = None,
+        conversation_id: Optional[str] = None
     ) -> AsyncGenerator[Dict[str, Any], None]:
         """
         流式生成回复（支持Function Calling的Agent Loop）
@@ -421,6 +503,7 @@ class GeminiService:
             user: 用户信息
             session_type: 会话类型
             function_executor: 函数执行器 async callable(func_name, func_args) -> Dict
+            conversation_id: 对话ID（用于复用已格式化的历史，不传则每次全量格式化）
         
         Yields:
             Dict包含以下可能的键：
@@ -428,18 +511,14 @@ class GeminiService:
             - function_call: Dict - 函数调用请求（仅当 function_executor 为 None 时）
             - done: bool - 是否完成
         """
-        # 选择工具集(daily 与 tarot 同集:含 read_divination_notebook;模板已禁止再抽牌)
-        tools = self.tarot_tools if session_type in (SessionType.TAROT, SessionType.DAILY) else self.astrology_tools
-
-        # 创建模型实例
-        model = genai.GenerativeModel(
-            model_name=GEMINI_MODEL,
-            generation_config=self.generation_config,
-            tools=tools
-        )
+        # 取池中复用的模型实例
+        tools = self._tools_for(session_type)
+        model = self._get_model(session_type)
 
         # 格式化消息
-        gemini_messages = self._format_messages_for_gemini(messages, user, session_type, system_prompt_override)
+        gemini_messages = self._format_messages_for_gemini(
+            messages, user, session_type, system_prompt_override, conversation_id
+        )
 
         # 打印调试信息
         print(f"\n[Gemini Agent] 会话类型: {session_type.value}")
@@ -463,72 +542,50 @@ class GeminiService:
             iteration += 1
             print(f"\n[Gemini Agent] ========== Iteration {iteration} ==========")
             
-            # 发送消息并获取响应
-            response = await chat.send_message_async(last_message, stream=False)
-            
-            # 检查响应中是否有function call
+            # 真流式：文本 token 一到就转发；函数调用在流中检测到即先通知前端
             function_calls = []
-            text_content = ""
-            
-            for part in response.parts:
-                if hasattr(part, 'function_call') and part.function_call:
-                    function_calls.append(part.function_call)
-                    print(f"[Gemini Agent] 🔧 检测到函数调用: {part.function_call.name}")
-                    print(f"[Gemini Agent] 参数: {dict(part.function_call.args)}")
-                elif hasattr(part, 'text') and part.text:
-                    text_content += part.text
-            
-            # 如果有文本内容，立即流式输出
-            if text_content:
-                print(f"[Gemini Agent] 💬 生成文本内容")
-                # 将文本分块流式输出
-                chunk_size = 50
-                for i in range(0, len(text_content), chunk_size):
-                    chunk = text_content[i:i+chunk_size]
-                    yield {"content": chunk}
-            
-            # 如果有函数调用，处理它们
-            if function_calls:
-                # 处理第一个函数调用
-                func_call = function_calls[0]
-                func_name = func_call.name
-                func_args = dict(func_call.args)
-                
-                # 如果提供了函数执行器，在loop内部执行函数
-                if function_executor:
-                    print(f"[Gemini Agent] 🔧 执行函数: {func_name}")
-                    
+            async for kind, payload in self._stream_turn(chat, last_message):
+                if kind == "text":
+                    yield {"content": payload}
+                    continue
+                function_calls.append(payload)
+                # 有执行器时本轮所有调用都会执行，逐个通知；否则外部只处理第一个
+                if function_executor or len(function_calls) == 1:
                     # 通知前端有函数调用（用于显示UI，如抽牌动画、资料补充按钮等）
                     yield {
                         "function_call": {
-                            "name": func_name,
-                            "args": func_args
+                            "name": payload.name,
+                            "args": dict(payload.args)
                         }
                     }
-                    
-                    # 执行函数
-                    function_result = await function_executor(func_name, func_args)
+            
+            # 如果有函数调用，处理它们（须等本轮流结束，chat 历史才完整）
+            if function_calls:
+                # 如果提供了函数执行器，在loop内部执行函数
+                if function_executor:
+                    # 本轮所有函数调用并发执行（各自超时），结果一次性喂回，省去逐个调用的模型往返
+                    names = [fc.name for fc in function_calls]
+                    print(f"[Gemini Agent] 🔧 并发执行函数: {names}")
+                    results = await asyncio.gather(*(
+                        self._execute_function(function_executor, fc.name, dict(fc.args))
+                        for fc in function_calls
+                    ))
                     print(f"[Gemini Agent] ✅ 函数执行完成")
-                    print(f"[Gemini Agent] 函数结果详情: {json.dumps(function_result, ensure_ascii=False, indent=2)}")
+                    for name, result in zip(names, results):
+                        print(f"[Gemini Agent] 函数 {name} 结果详情: {json.dumps(result, ensure_ascii=False, indent=2)}")
                     
                     # 将函数结果发送回AI，准备下一轮loop
-                    last_message = [genai.protos.Part(
-                        function_response=genai.protos.FunctionResponse(
-                            name=func_name,
-                            response=function_result
+                    last_message = [
+                        genai.protos.Part(
+                            function_response=genai.protos.FunctionResponse(name=name, response=result)
                         )
-                    )]
+                        for name, result in zip(names, results)
+                    ]
                     # 继续loop，AI可能会继续调用其他函数或生成文本
                     print(f"[Gemini Agent] 🔄 将函数结果喂回AI，继续Agent Loop...")
                 else:
-                    # 没有函数执行器，通知外部执行函数，然后退出
-                    print(f"[Gemini Agent] ⏸️  通知外部执行函数: {func_name}")
-                    yield {
-                        "function_call": {
-                            "name": func_name,
-                            "args": func_args
-                        }
-                    }
+                    # 没有函数执行器，已通知外部执行函数，退出
+                    print(f"[Gemini Agent] ⏸️  通知外部执行函数: {function_calls[0].name}")
                     break  # 退出循环，等待外部提供函数结果
             else:
                 # 没有函数调用，对话结束
@@ -547,7 +604,8 @@ class GeminiService:
         session_type: SessionType = SessionType.TAROT,
         function_name: str = "",
         function_result: Dict[str, Any] = None,
-        system_prompt_override: Optional[str] = None
+        system_prompt_override: Optional[str] = None,
+        conversation_id: Optional[str] = None
     ) -> AsyncGenerator[Dict[str, Any], None]:
         """
         在收到函数执行结果后继续Agent Loop（支持嵌套函数调用）
@@ -558,56 +616,34 @@ class GeminiService:
             session_type: 会话类型
             function_name: 函数名称
             function_result: 函数执行结果
+            conversation_id: 对话ID（用于复用已格式化的历史）
         """
-        # 选择工具集(daily 与 tarot 同集:含 read_divination_notebook;模板已禁止再抽牌)
-        tools = self.tarot_tools if session_type in (SessionType.TAROT, SessionType.DAILY) else self.astrology_tools
-
-        # 创建模型实例
-        model = genai.GenerativeModel(
-            model_name=GEMINI_MODEL,
-            generation_config=self.generation_config,
-            tools=tools
-        )
+        # 取池中复用的模型实例
+        model = self._get_model(session_type)
 
         # 格式化消息（包含函数结果）
-        gemini_messages = self._format_messages_for_gemini(messages, user, session_type, system_prompt_override)
+        gemini_messages = self._format_messages_for_gemini(
+            messages, user, session_type, system_prompt_override, conversation_id
+        )
         
         print(f"\n[Gemini Agent] 继续Agent Loop，函数: {function_name}, 结果: {function_result.get('success', 'N/A')}")
         
         # 创建聊天会话
         chat = model.start_chat(history=gemini_messages)
         
-        # 发送函数结果
-        response = await chat.send_message_async(
-            [genai.protos.Part(
-                function_response=genai.protos.FunctionResponse(
-                    name=function_name,
-                    response=function_result
-                )
-            )],
-            stream=False  # 改为非流式，以便检测新的函数调用
-        )
-        
-        # 检查响应中是否有新的函数调用或文本内容
+        # 发送函数结果（流式：文本边生成边输出）
+        function_result_message = [genai.protos.Part(
+            function_response=genai.protos.FunctionResponse(
+                name=function_name,
+                response=function_result
+            )
+        )]
         function_calls = []
-        text_content = ""
-        
-        for part in response.parts:
-            if hasattr(part, 'function_call') and part.function_call:
-                function_calls.append(part.function_call)
-                print(f"[Gemini Agent] 🔧 检测到嵌套函数调用: {part.function_call.name}")
-                print(f"[Gemini Agent] 参数: {dict(part.function_call.args)}")
-            elif hasattr(part, 'text') and part.text:
-                text_content += part.text
-        
-        # 如果有文本内容，流式输出
-        if text_content:
-            print(f"[Gemini Agent] 💬 生成文本内容")
-            # 将文本分块流式输出
-            chunk_size = 50
-            for i in range(0, len(text_content), chunk_size):
-                chunk = text_content[i:i+chunk_size]
-                yield {"content": chunk}
+        async for kind, payload in self._stream_turn(chat, function_result_message):
+            if kind == "text":
+                yield {"content": payload}
+            else:
+                function_calls.append(payload)
         
         # 如果有新的函数调用，通知前端（但不执行，交给 router 层处理）
         if function_calls:
@@ -624,4 +660,8 @@ class GeminiService:
         else:
             # 没有新的函数调用，对话完成
             print(f"[Gemini Agent] ✅ Agent Loop 完成")
-            yield {"done": True}
\ No newline at end of file
+            yield {"done": True}
+
+
+# 全局实例（tarot / astrology / daily router 共享）
+gemini_service = GeminiService()
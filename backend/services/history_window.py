@@ -0,0 +1,192 @@
+"""按 token 预算裁剪发给模型的对话历史。
+
+历史估算 token 不超过 HISTORY_TOKEN_BUDGET 时原样发送；超出时：
+- 最近 HISTORY_RECENT_TURNS 轮原样保留（预算仍不够则逐步减到 1 轮）；
+- 更早消息中最新的一次抽牌结果、最新的一份星盘数据原样保留；
+- 其余更早的消息折叠成一段滚动摘要。
+
+摘要是抽取式的（每条消息取开头若干字 + 牌名），不额外调用模型，
+不增加首 token 延迟。摘要按「被摘要的整个前缀」的链式摘要缓存：窗口后移时找到
+已缓存的最长前缀，只为新滑出窗口的消息追加摘要行；前缀中任一消息被改动/删除则前缀
+摘要随之改变，不会复用过期摘要（开场白相同的不同对话也互不干扰）。
+"""
+import hashlib
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import config
+from models import Message, MessageRole
+
+CHART_PREFIX = "[星盘数据]"
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中日韩字符约 1 字 1 token，其余字符约 4 字 1 token。"""
+    cjk = sum(1 for ch in text if ch >= "⺀")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def message_tokens(message: Message) -> int:
+    tokens = estimate_tokens(message.content)
+    if message.tarot_cards:
+        tokens += sum(estimate_tokens(card.card_name) + 4 for card in message.tarot_cards)
+    return tokens
+
+
+def _is_card_block(message: Message) -> bool:
+    return message.role == MessageRole.SYSTEM and bool(message.tarot_cards)
+
+
+def _is_chart_block(message: Message) -> bool:
+    return message.role == MessageRole.SYSTEM and message.content.startswith(CHART_PREFIX)
+
+
+def message_digest(message: Message) -> str:
+    """消息内容摘要（角色 + 时间戳 + 内容），用于校验缓存覆盖的前缀未被改动。"""
+    raw = f"{message.role.value}|{message.timestamp}|{message.content}"
+    return hashlib.md5(raw.encode("utf-8")).hexdigest()
+
+
+def prefix_digests(messages: List[Message], upto: int) -> List[str]:
+    """messages[:n]（n = 0..upto）的链式摘要：任一前缀消息改动都会改变其后所有前缀的摘要。"""
+    digests = [""]
+    for message in messages[:upto]:
+        raw = digests[-1] + message_digest(message)
+        digests.append(hashlib.md5(raw.encode("utf-8")).hexdigest())
+    return digests
+
+
+def _summary_line(message: Message, line_chars: int) -> Optional[str]:
+    """单条消息的摘要行；与解读无关的系统消息返回 None。"""
+    if _is_card_block(message):
+        return "抽牌：" + "、".join(
+            f"{card.card_name}{'（逆位）' if card.reversed else '（正位）'}" for card in message.tarot_cards
+        )
+    if _is_chart_block(message):
+        return "（已提供星盘数据）"
+    if message.role == MessageRole.SYSTEM:
+        return None
+    text = " ".join(message.content.split())
+    if not text:
+        return None
+    if len(text) > line_chars:
+        text = text[:line_chars] + "…"
+    speaker = "用户" if message.role == MessageRole.USER else "占卜师"
+    return f"{speaker}：{text}"
+
+
+def _trim_lines(lines: List[str], max_chars: int) -> List[str]:
+    """从最早的行开始丢弃，直到总长不超过 max_chars（至少保留最后一行）。"""
+    total = sum(len(line) + 1 for line in lines)
+    start = 0
+    while total > max_chars and start < len(lines) - 1:
+        total -= len(lines[start]) + 1
+        start += 1
+    return lines[start:]
+
+
+class HistoryWindower:
+    """历史窗口裁剪 + 按对话缓存的滚动摘要。"""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        # messages[:n] 的链式摘要 -> 摘要行
+        self._summaries: "OrderedDict[str, List[str]]" = OrderedDict()
+
+    def window(
+        self,
+        messages: List[Message],
+        token_budget: Optional[int] = None,
+        recent_turns: Optional[int] = None,
+    ) -> Tuple[List[Message], Optional[str]]:
+        """
+        裁剪历史消息
+
+        Returns:
+            (原样发送的消息（保持原顺序）, 更早对话的摘要文本或 None)
+        """
+        indices, summary = self.window_indices(messages, token_budget, recent_turns)
+        return [messages[i] for i in indices], summary
+
+    def window_indices(
+        self,
+        messages: List[Message],
+        token_budget: Optional[int] = None,
+        recent_turns: Optional[int] = None,
+    ) -> Tuple[List[int], Optional[str]]:
+        """同 window，返回原样发送的消息下标（升序），便于调用方复用按下标缓存的格式化结果。"""
+        budget = config.HISTORY_TOKEN_BUDGET if token_budget is None else token_budget
+        turns = config.HISTORY_RECENT_TURNS if recent_turns is None else recent_turns
+        everything = list(range(len(messages)))
+
+        costs = [message_tokens(m) for m in messages]
+        if sum(costs) <= budget:
+            return everything, None
+
+        # 每轮起点 = 用户消息下标
+        turn_starts = [i for i, m in enumerate(messages) if m.role == MessageRole.USER]
+        if not turn_starts:
+            return everything, None
+        turns = max(1, min(turns, len(turn_starts)))
+
+        while True:
+            start = turn_starts[-turns]
+            pinned = self._pinned_before(messages, start)
+            used = sum(costs[start:]) + sum(costs[i] for i in pinned)
+            if used <= budget or turns == 1:
+                break
+            turns -= 1
+
+        if start == 0:
+            return everything, None
+
+        summary = self._rolling_summary(messages, start)
+        return pinned + everything[start:], summary
+
+    @staticmethod
+    def _pinned_before(messages: List[Message], start: int) -> List[int]:
+        """窗口之前最新的抽牌块、星盘块下标（升序）。"""
+        card = chart = None
+        for i in range(start - 1, -1, -1):
+            if card is None and _is_card_block(messages[i]):
+                card = i
+            elif chart is None and _is_chart_block(messages[i]):
+                chart = i
+            if card is not None and chart is not None:
+                break
+        return sorted(i for i in (card, chart) if i is not None)
+
+    def _rolling_summary(self, messages: List[Message], upto: int) -> Optional[str]:
+        """messages[:upto] 的摘要；命中缓存时只追加新滑出窗口的消息。"""
+        line_chars = config.HISTORY_SUMMARY_LINE_CHARS
+        max_chars = config.HISTORY_SUMMARY_MAX_CHARS
+
+        prefixes = prefix_digests(messages, upto)
+        key = prefixes[upto]
+        covered, lines = 0, []
+        for n in range(upto, 0, -1):
+            cached = self._summaries.get(prefixes[n])
+            if cached is not None:
+                covered, lines = n, list(cached)
+                break
+
+        if covered < upto:
+            for message in messages[covered:upto]:
+                line = _summary_line(message, line_chars)
+                if line:
+                    lines.append(line)
+            lines = _trim_lines(lines, max_chars)
+
+        self._summaries[key] = lines
+        self._summaries.move_to_end(key)
+        while len(self._summaries) > self.max_entries:
+            self._summaries.popitem(last=False)
+
+        return "\n".join(lines) if lines else None
+
+    def clear(self):
+        self._summaries.clear()
+
+
+# 全局实例
+history_windower = HistoryWindower()
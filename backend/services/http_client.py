@@ -0,0 +1,88 @@
+"""应用级共享的出站 HTTP 客户端（连接池）。
+
+每次请求新建 httpx.AsyncClient 都要重新建 TCP（及 TLS）连接；这里整个进程共用一个
+客户端，连接按 keep-alive 复用。main.py 的 lifespan 启动时创建、关闭时释放；
+未经 lifespan（脚本、测试）时首次使用按需创建。
+
+超时、重试次数与最大并发出站请求数见 config.OUTBOUND_HTTP_*。只对连接错误/超时
+与 5xx 响应重试（指数退避），4xx 直接返回给调用方处理。
+"""
+import asyncio
+from typing import Any, Dict, Optional
+
+import httpx
+
+import config
+
+_client: Optional[httpx.AsyncClient] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _create_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=config.OUTBOUND_HTTP_MAX_CONCURRENCY,
+        max_keepalive_connections=config.OUTBOUND_HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=config.OUTBOUND_HTTP_KEEPALIVE_EXPIRY,
+    )
+    return httpx.AsyncClient(timeout=config.OUTBOUND_HTTP_TIMEOUT, limits=limits)
+
+
+async def start_http_client() -> httpx.AsyncClient:
+    """创建共享客户端（已存在且属于当前事件循环则直接返回）。"""
+    global _client, _semaphore, _loop
+    loop = asyncio.get_running_loop()
+    if _client is not None and _loop is loop and not _client.is_closed:
+        return _client
+    # 连接池绑定事件循环：换了循环（如测试里多次 asyncio.run）就重建
+    _client = _create_client()
+    _semaphore = asyncio.Semaphore(config.OUTBOUND_HTTP_MAX_CONCURRENCY)
+    _loop = loop
+    print(f"[HttpClient] 共享客户端已创建 (并发上限 {config.OUTBOUND_HTTP_MAX_CONCURRENCY})")
+    return _client
+
+
+async def close_http_client():
+    """关闭共享客户端，释放连接池。"""
+    global _client, _semaphore, _loop
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+        print("[HttpClient] 共享客户端已关闭")
+    _client = _semaphore = _loop = None
+
+
+def worst_case_seconds(retries: Optional[int] = None) -> float:
+    """post_json 重试耗尽前最长可能耗时：每次请求都超时，加上各次重试前的退避等待"""
+    retries = config.OUTBOUND_HTTP_RETRIES if retries is None else retries
+    backoff = config.OUTBOUND_HTTP_RETRY_BACKOFF * (2 ** retries - 1)
+    return config.OUTBOUND_HTTP_TIMEOUT * (retries + 1) + backoff
+
+
+async def post_json(url: str, payload: Dict[str, Any], retries: Optional[int] = None) -> httpx.Response:
+    """
+    用共享客户端 POST JSON；连接错误/超时与 5xx 按指数退避重试
+
+    Returns:
+        最后一次的响应（可能仍是 5xx，由调用方 raise_for_status）
+
+    Raises:
+        httpx.TransportError: 重试耗尽后仍连不上/超时
+    """
+    client = await start_http_client()
+    semaphore = _semaphore
+    attempts = 1 + (config.OUTBOUND_HTTP_RETRIES if retries is None else retries)
+    delay = config.OUTBOUND_HTTP_RETRY_BACKOFF
+
+    for attempt in range(1, attempts + 1):
+        try:
+            async with semaphore:
+                response = await client.post(url, json=payload)
+            if response.status_code < 500 or attempt == attempts:
+                return response
+            print(f"[HttpClient] {url} 返回 {response.status_code}，第 {attempt} 次重试")
+        except httpx.TransportError as e:
+            if attempt == attempts:
+                raise
+            print(f"[HttpClient] {url} 请求失败 ({type(e).__name__})，第 {attempt} 次重试")
+        await asyncio.sleep(delay)
+        delay *= 2
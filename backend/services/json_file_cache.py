@@ -0,0 +1,91 @@
+"""进程内 JSON 文件缓存（write-through）。
+
+以文件的 (mtime_ns, size) 作为版本戳：戳未变化时直接返回内存中已解析的 dict，
+不再重复读盘 + json.loads；写入时磁盘与内存一起更新。其他进程或手工改了文件，
+stat 随之变化，下一次读取自动重载。
+
+注意：read 返回的是缓存本体（不拷贝），调用方只读使用；若就地修改，必须紧接着
+write 回去，否则内存与磁盘会不一致。
+"""
+import json
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Tuple
+
+import aiofiles
+
+Stamp = Tuple[int, int]
+AnyStamp = Tuple  # 复合版本戳（例如多个文件的 Stamp 组合）
+
+
+def file_stamp(path: Path) -> Optional[Stamp]:
+    """文件版本戳 (mtime_ns, size)；文件不存在返回 None。"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+class JsonFileCache:
+    """按路径（或自定义 key + 复合版本戳）缓存解析结果，超过 max_entries 时按 LRU 淘汰。"""
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[AnyStamp, object]]" = OrderedDict()
+
+    def get(self, key: str, stamp: AnyStamp):
+        """按 key 取缓存值，版本戳不一致视为未命中（返回 None）。"""
+        cached = self._entries.get(key)
+        if cached is None or cached[0] != stamp:
+            return None
+        self._entries.move_to_end(key)
+        return cached[1]
+
+    def put(self, key: str, stamp: Optional[AnyStamp], data):
+        """以 stamp 为版本戳写入缓存；stamp 为 None 时丢弃该 key。"""
+        if stamp is None:
+            self._entries.pop(key, None)
+            return
+        self._entries[key] = (stamp, data)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def read(self, path: Path) -> dict:
+        """读取 JSON 文件；版本戳未变则命中内存。文件不存在返回空 dict。"""
+        key = str(path)
+        # 先取戳再读：读的过程中文件若被改，戳已过期，下次读取会重新加载
+        stamp = file_stamp(path)
+        if stamp is None:
+            self._entries.pop(key, None)
+            return {}
+
+        cached = self.get(key, stamp)
+        if cached is not None:
+            return cached
+
+        async with aiofiles.open(path, "r", encoding="utf-8") as f:
+            content = await f.read()
+        data = json.loads(content) if content else {}
+        self.put(key, stamp, data)
+        return data
+
+    async def write(self, path: Path, data: dict, indent: Optional[int] = 2):
+        """写盘并同步更新内存；写盘失败则丢弃该路径的缓存，下次从磁盘重读。"""
+        key = str(path)
+        try:
+            async with aiofiles.open(path, "w", encoding="utf-8") as f:
+                await f.write(json.dumps(data, ensure_ascii=False, indent=indent))
+        except Exception:
+            self.invalidate(path)
+            raise
+        self.put(key, file_stamp(path), data)
+
+    def invalidate(self, path=None):
+        """丢弃某个路径/key（或全部）的缓存。"""
+        if path is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(str(path), None)
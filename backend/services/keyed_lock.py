@@ -0,0 +1,25 @@
+"""按 key 分配的 asyncio 锁（例如每个 user_id 一把）。
+
+不同 key 互不阻塞，同一 key 串行。锁对象放在 WeakValueDictionary 里：
+持有或等待某把锁的协程都引用着它，全部退出后锁自动回收，不会随用户数无限增长。
+"""
+import asyncio
+import weakref
+
+
+class KeyedLock:
+    """用法：`async with locks(user_id): ...`"""
+
+    def __init__(self):
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    def __call__(self, key: str) -> asyncio.Lock:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+        return lock
+
+    def __len__(self) -> int:
+        """当前仍存活的锁数量（调试/测试用）。"""
+        return len(self._locks)
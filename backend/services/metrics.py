@@ -0,0 +1,114 @@
+"""进程内轻量指标：按名称记录耗时样本，提供 count / avg / p50 / p95 / max 汇总；
+另有计数（累计次数 + 最近一分钟次数）与取值函数形式的即时量（如队列长度）。
+
+只保留最近 window 个样本做分位数，内存有上界；多进程部署时各进程各算各的。
+"""
+import math
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Tuple
+
+
+class LatencyMetric:
+    """单个耗时指标（毫秒）。"""
+
+    def __init__(self, window: int = 1024):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def observe(self, value_ms: float):
+        self.count += 1
+        self.total += value_ms
+        self.max = max(self.max, value_ms)
+        self._samples.append(value_ms)
+
+    def percentile(self, q: float) -> float:
+        """最近样本的 q 分位（最近秩法），无样本返回 0。"""
+        if not self._samples:
+            return 0.0
+        ordered = sorted(self._samples)
+        rank = max(1, math.ceil(q * len(ordered)))
+        return ordered[rank - 1]
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total / self.count, 2) if self.count else 0.0,
+            "p50_ms": round(self.percentile(0.5), 2),
+            "p95_ms": round(self.percentile(0.95), 2),
+            "max_ms": round(self.max, 2),
+        }
+
+
+class CounterMetric:
+    """单个计数指标：累计次数与最近 60 秒内的次数（吞吐量，次/分钟）。"""
+
+    RATE_WINDOW_SECONDS = 60.0
+
+    def __init__(self):
+        self.count = 0
+        self._recent: Deque[Tuple[float, int]] = deque()
+
+    def incr(self, n: int = 1):
+        now = time.monotonic()
+        self.count += n
+        self._recent.append((now, n))
+        self._expire(now)
+
+    def _expire(self, now: float):
+        while self._recent and now - self._recent[0][0] > self.RATE_WINDOW_SECONDS:
+            self._recent.popleft()
+
+    def summary(self) -> Dict[str, float]:
+        self._expire(time.monotonic())
+        return {"count": self.count, "per_min": sum(n for _, n in self._recent)}
+
+
+class MetricsRegistry:
+    """按名称懒创建指标。"""
+
+    def __init__(self):
+        self._latencies: Dict[str, LatencyMetric] = {}
+        self._counters: Dict[str, CounterMetric] = {}
+        self._gauges: Dict[str, Callable[[], float]] = {}
+
+    def observe(self, name: str, value_ms: float):
+        metric = self._latencies.get(name)
+        if metric is None:
+            metric = self._latencies[name] = LatencyMetric()
+        metric.observe(value_ms)
+
+    def incr(self, name: str, n: int = 1):
+        counter = self._counters.get(name)
+        if counter is None:
+            counter = self._counters[name] = CounterMetric()
+        counter.incr(n)
+
+    def register_gauge(self, name: str, read: Callable[[], float]):
+        """登记即时量：每次 snapshot 时调用 read() 取当前值。"""
+        self._gauges[name] = read
+
+    def get(self, name: str) -> Dict[str, float]:
+        metric = self._latencies.get(name)
+        return metric.summary() if metric else LatencyMetric().summary()
+
+    def get_counter(self, name: str) -> Dict[str, float]:
+        counter = self._counters.get(name)
+        return counter.summary() if counter else CounterMetric().summary()
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        result = {name: metric.summary() for name, metric in self._latencies.items()}
+        result.update({name: counter.summary() for name, counter in self._counters.items()})
+        result.update({name: {"value": read()} for name, read in self._gauges.items()})
+        return result
+
+    def reset(self):
+        """清空耗时样本与计数（即时量的登记保留）。"""
+        self._latencies.clear()
+        self._counters.clear()
+
+
+# 全局实例
+metrics = MetricsRegistry()
@@ -0,0 +1,62 @@
+"""GenerativeModel 池：按 (模型名, 工具集, 生成配置) 复用预构建的模型对象。
+
+GenerativeModel 本身无会话状态（会话在 start_chat 返回的 ChatSession 里），
+构造时却要把 Tool / FunctionDeclaration 转成 proto、校验配置。同一组参数的
+模型在进程内只建一次，各 router / Service 共享。
+"""
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import google.generativeai as genai
+from google.generativeai.types import Tool
+
+PoolKey = Tuple[str, Tuple, Tuple]
+
+
+def _tools_key(tools: Optional[List[Tool]]) -> Tuple:
+    """工具集的 key：每个 Tool 内函数声明名的元组（声明内容随代码固定，名字足以区分）。"""
+    if not tools:
+        return ()
+    return tuple(tuple(decl.name for decl in tool.function_declarations) for tool in tools)
+
+
+def _config_key(generation_config: Optional[Dict]) -> Tuple[Tuple[str, Hashable], ...]:
+    return tuple(sorted((generation_config or {}).items()))
+
+
+class ModelPool:
+    """按 key 缓存 GenerativeModel，首次 get 时构建。"""
+
+    def __init__(self):
+        self._models: Dict[PoolKey, genai.GenerativeModel] = {}
+
+    @staticmethod
+    def key(model_name: str, tools: Optional[List[Tool]] = None, generation_config: Optional[Dict] = None) -> PoolKey:
+        return (model_name, _tools_key(tools), _config_key(generation_config))
+
+    def get(
+        self,
+        model_name: str,
+        tools: Optional[List[Tool]] = None,
+        generation_config: Optional[Dict] = None,
+    ) -> genai.GenerativeModel:
+        """取（必要时构建）对应参数的模型实例。"""
+        key = self.key(model_name, tools, generation_config)
+        model = self._models.get(key)
+        if model is None:
+            model = genai.GenerativeModel(
+                model_name=model_name,
+                generation_config=generation_config,
+                tools=tools,
+            )
+            self._models[key] = model
+        return model
+
+    def __len__(self) -> int:
+        return len(self._models)
+
+    def clear(self):
+        self._models.clear()
+
+
+# 全局实例
+model_pool = ModelPool()
@@ -0,0 +1,81 @@
+"""占卜笔记本检索：单个用户笔记的倒排索引 + BM25 打分。
+
+笔记是中文短文本，不引入分词库：连续的中日韩字符切成相邻二字组（bigram，单字成段时保留单字），
+拉丁字母/数字按词切分并转小写。文档 = 一条笔记的 问题 + 摘要 + 抽到的牌。
+
+索引只负责打分；笔记条目本身、索引与笔记文件的一致性由 NotebookService 维护。
+"""
+import heapq
+import math
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+_TOKEN_RE = re.compile(r"[⺀-鿿豈-﫿]+|[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for run in _TOKEN_RE.findall(text.lower()):
+        if not run.isascii() and len(run) > 1:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+class NotebookIndex:
+    """一个用户的笔记倒排索引：term -> {doc_id: 词频}，doc_id 为 conversation_id。"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._doc_terms: Dict[str, Counter] = {}
+        self._doc_len: Dict[str, int] = {}
+        self._total_len = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_len)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._doc_len
+
+    def upsert(self, doc_id: str, fields: Iterable[str]):
+        """加入或替换一条笔记（fields：参与检索的文本字段）。"""
+        self.remove(doc_id)
+        terms = Counter(token for text in fields if text for token in tokenize(text))
+        for term, tf in terms.items():
+            self._postings.setdefault(term, {})[doc_id] = tf
+        length = sum(terms.values())
+        self._doc_terms[doc_id] = terms
+        self._doc_len[doc_id] = length
+        self._total_len += length
+
+    def remove(self, doc_id: str):
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self._postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self._postings[term]
+        self._total_len -= self._doc_len.pop(doc_id)
+
+    def search(self, query: str, top_k: int) -> List[Tuple[float, str]]:
+        """BM25 得分最高的 top_k 条 (得分, doc_id)，只返回得分 > 0 的。"""
+        n = len(self._doc_len)
+        if not n or top_k <= 0:
+            return []
+        avgdl = self._total_len / n or 1.0
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self._doc_len[doc_id] / avgdl)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(top_k, ((score, doc_id) for doc_id, score in scores.items()))
@@ -2,19 +2,35 @@
 占卜笔记本服务
 为每个用户维护独立的占卜笔记本，记录对话摘要
 """
+import asyncio
 import json
 import os
+from collections import OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple
 from datetime import datetime
 import google.generativeai as genai
 
-from config import DATA_DIR, GEMINI_API_KEY
+try:
+    import fcntl
+except ImportError:  # Windows 没有 flock：只支持单进程运行
+    fcntl = None
+
+from config import DATA_DIR, GEMINI_API_KEY, NOTEBOOK_SEARCH_TOP_K, NOTEBOOK_SEARCH_TOKEN_CAP
 from models import Conversation, User, Message, MessageRole
+from services.history_window import estimate_tokens
+from services.json_file_cache import Stamp, file_stamp
+from services.keyed_lock import KeyedLock
+from services.model_pool import model_pool
+from services.notebook_index import NotebookIndex
 
 # 配置 Gemini API
 genai.configure(api_key=GEMINI_API_KEY)
 
+# 同一用户的笔记本读-改-写串行（进程内）；跨进程再由笔记本旁的 .lock 文件 flock 互斥
+_notebook_locks = KeyedLock()
+
 
 class NotebookEntry:
     """笔记本条目"""
@@ -72,6 +88,7 @@ class NotebookService:
         "top_p": 0.9,
         "top_k": 40,
         "max_output_tokens": 2000,  # 限制在300字左右
+        "response_mime_type": "application/json",  # 结构化输出
     }
     
     # 笔记生成提示词（生成结构化输出：摘要 + 抽到的牌列表）
@@ -94,9 +111,22 @@ class NotebookService:
 }}
 """
     
+    # 内存中保留检索索引的用户数（LRU）
+    INDEX_MAX_USERS = 256
+    
     def __init__(self):
         # 确保笔记本目录存在
         self.NOTEBOOK_DIR.mkdir(exist_ok=True)
+        # user_id -> (笔记本文件版本戳, 检索索引, conversation_id -> 条目)
+        self._indexes: "OrderedDict[str, Tuple[Stamp, NotebookIndex, Dict[str, NotebookEntry]]]" = OrderedDict()
+    
+    def _get_model(self) -> genai.GenerativeModel:
+        """笔记生成模型（JSON 输出，从 model_pool 复用）"""
+        return model_pool.get(self.NOTEBOOK_MODEL, generation_config=self.NOTEBOOK_GENERATION_CONFIG)
+    
+    def warm_up(self):
+        """启动时预构建笔记生成模型"""
+        self._get_model()
     
     def _get_notebook_path(self, user_id: str) -> Path:
         """获取用户笔记本文件路径"""
@@ -116,20 +146,117 @@ class NotebookService:
             print(f"[Notebook] 加载笔记本失败 {user_id}: {e}")
             return []
     
-    def _save_notebook(self, user_id: str, entries: List[NotebookEntry]):
-        """保存用户笔记本"""
+    def _save_notebook(self, user_id: str, entries: List[NotebookEntry]) -> bool:
+        """保存用户笔记本（先写临时文件再替换，读者不会读到半个文件），返回是否成功"""
         notebook_path = self._get_notebook_path(user_id)
+        tmp = notebook_path.with_name(notebook_path.name + ".tmp")
         try:
-            with open(notebook_path, "w", encoding="utf-8") as f:
+            with open(tmp, "w", encoding="utf-8") as f:
                 json.dump([entry.to_dict() for entry in entries], f, ensure_ascii=False, indent=2)
+            os.replace(tmp, notebook_path)
             print(f"[Notebook] 笔记本已保存: {user_id}, 共 {len(entries)} 条记录")
+            return True
         except Exception as e:
             print(f"[Notebook] 保存笔记本失败 {user_id}: {e}")
+            return False
+    
+    @contextmanager
+    def _file_locked(self, user_id: str):
+        """跨进程互斥（flock）：同一用户笔记本的读-改-写在锁内进行。会阻塞，在线程里调用"""
+        with open(self.NOTEBOOK_DIR / f"note_{user_id}.lock", "a") as handle:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+            yield  # 关闭文件即释放锁
+    
+    def _upsert_entry(self, user_id: str, new_entry: NotebookEntry) -> Tuple[Optional[Stamp], bool]:
+        """
+        在文件锁内重新读取笔记本，替换或追加该对话的条目后保存
+        
+        Returns:
+            (写入前的文件版本戳, 是否保存成功)；版本戳用于判断内存中的检索索引能否增量更新
+        """
+        with self._file_locked(user_id):
+            stamp_before = file_stamp(self._get_notebook_path(user_id))
+            entries = self._load_notebook(user_id)
+            for i, entry in enumerate(entries):
+                if entry.conversation_id == new_entry.conversation_id:
+                    entries[i] = new_entry
+                    print(f"[Notebook] 更新条目: {new_entry.conversation_id}")
+                    break
+            else:
+                entries.append(new_entry)
+                print(f"[Notebook] 新增条目: {new_entry.conversation_id}")
+            return stamp_before, self._save_notebook(user_id, entries)
+    
+    # ---------- 检索索引 ----------
+    
+    @staticmethod
+    def _index_fields(entry: NotebookEntry) -> List[str]:
+        return [entry.question, entry.summary, " ".join(entry.cards_drawn)]
+    
+    def _get_index(self, user_id: str) -> Tuple[NotebookIndex, Dict[str, NotebookEntry]]:
+        """
+        用户笔记的检索索引（按笔记本文件版本戳缓存）
+        
+        本进程写笔记时增量更新；文件被其他进程改过（版本戳不符）则从磁盘重建。
+        """
+        stamp = file_stamp(self._get_notebook_path(user_id))
+        cached = self._indexes.get(user_id)
+        if cached is not None and stamp is not None and cached[0] == stamp:
+            self._indexes.move_to_end(user_id)
+            return cached[1], cached[2]
+        
+        index = NotebookIndex()
+        entries = {}
+        for entry in self._load_notebook(user_id):
+            index.upsert(entry.conversation_id, self._index_fields(entry))
+            entries[entry.conversation_id] = entry
+        self._remember_index(user_id, stamp, index, entries)
+        return index, entries
+    
+    def _remember_index(self, user_id: str, stamp: Optional[Stamp], index: NotebookIndex, entries: Dict[str, NotebookEntry]):
+        if stamp is None:
+            self._indexes.pop(user_id, None)
+            return
+        self._indexes[user_id] = (stamp, index, entries)
+        self._indexes.move_to_end(user_id)
+        while len(self._indexes) > self.INDEX_MAX_USERS:
+            self._indexes.popitem(last=False)
+    
+    def _index_entry(self, user_id: str, stamp_before: Optional[Stamp], entry: NotebookEntry):
+        """写入笔记后增量更新索引；索引与写入前的文件不一致则丢弃，下次检索时重建。"""
+        cached = self._indexes.get(user_id)
+        if cached is None:
+            return
+        stamp, index, entries = cached
+        if stamp != stamp_before:
+            self._indexes.pop(user_id, None)
+            return
+        index.upsert(entry.conversation_id, self._index_fields(entry))
+        entries[entry.conversation_id] = entry
+        self._remember_index(user_id, file_stamp(self._get_notebook_path(user_id)), index, entries)
+    
+    def search_entries(self, user_id: str, query: str, top_k: int = NOTEBOOK_SEARCH_TOP_K) -> Tuple[List[NotebookEntry], int]:
+        """
+        检索与 query 最相关的笔记
+        
+        Returns:
+            (按相关度排序的条目（没有任何相关条目时为最近的条目）, 笔记总数)
+        """
+        index, entries = self._get_index(user_id)
+        hits = index.search(query, top_k)
+        if hits:
+            # 同分时较新的在前
+            ranked = sorted(hits, key=lambda hit: (hit[0], entries[hit[1]].start_time), reverse=True)
+            return [entries[doc_id] for _, doc_id in ranked], len(entries)
+        recent = sorted(entries.values(), key=lambda e: e.start_time, reverse=True)
+        return recent[:top_k], len(entries)
     
     async def generate_summary(
         self,
         conversation: Conversation,
-        user: Optional[User] = None
+        user: Optional[User] = None,
+        fallback: bool = True
     ) -> str:
         """
         使用AI生成对话摘要
@@ -137,6 +264,7 @@ class NotebookService:
         Args:
             conversation: 对话对象
             user: 用户对象
+            fallback: 生成失败时是否返回默认摘要；为 False 时抛出异常（由调用方重试）
             
         Returns:
             生成的摘要文本
@@ -180,14 +308,7 @@ class NotebookService:
         
         # 调用AI生成摘要（结构化输出）
         try:
-            # 配置JSON响应模式
-            generation_config = self.NOTEBOOK_GENERATION_CONFIG.copy()
-            generation_config["response_mime_type"] = "application/json"
-            
-            model = genai.GenerativeModel(
-                model_name=self.NOTEBOOK_MODEL,
-                generation_config=generation_config
-            )
+            model = self._get_model()
             
             print(f"[Notebook] 正在为对话 {conversation.conversation_id} 生成摘要...")
             response = await model.generate_content_async(prompt)
@@ -202,6 +323,8 @@ class NotebookService:
             return summary, cards_drawn
         except Exception as e:
             print(f"[Notebook] 生成摘要失败: {e}")
+            if not fallback:
+                raise
             import traceback
             traceback.print_exc()
             # 返回默认值
@@ -211,7 +334,8 @@ class NotebookService:
         self,
         user_id: str,
         conversation: Conversation,
-        user: Optional[User] = None
+        user: Optional[User] = None,
+        fallback: bool = True
     ) -> Dict[str, any]:
         """
         直接生成并保存笔记（供定时任务调用）
@@ -221,22 +345,13 @@ class NotebookService:
             user_id: 用户ID
             conversation: 对话对象
             user: 用户对象（可选）
+            fallback: 摘要生成失败时是否写入默认摘要；为 False 时抛出异常、不写笔记
             
         Returns:
             包含生成状态的字典
         """
-        # 加载现有笔记本
-        entries = self._load_notebook(user_id)
-        
-        # 查找是否已有该对话的记录
-        existing_entry_idx = None
-        for i, entry in enumerate(entries):
-            if entry.conversation_id == conversation.conversation_id:
-                existing_entry_idx = i
-                break
-        
         # 生成摘要（AI 会从对话中自动提取抽到的牌）
-        summary, cards_drawn = await self.generate_summary(conversation, user)
+        summary, cards_drawn = await self.generate_summary(conversation, user, fallback=fallback)
         
         # 提取问题
         question = "未知问题"
@@ -255,16 +370,11 @@ class NotebookService:
             end_time=conversation.updated_at
         )
         
-        # 更新或添加条目
-        if existing_entry_idx is not None:
-            entries[existing_entry_idx] = new_entry
-            print(f"[Notebook] 更新条目: {conversation.conversation_id}")
-        else:
-            entries.append(new_entry)
-            print(f"[Notebook] 新增条目: {conversation.conversation_id}")
-        
-        # 保存笔记本
-        self._save_notebook(user_id, entries)
+        # 摘要生成耗时较长：等它完成后再在锁内重新读取笔记本写入，并发写同一用户的笔记不会互相覆盖
+        async with _notebook_locks(user_id):
+            stamp_before, saved = await asyncio.to_thread(self._upsert_entry, user_id, new_entry)
+            if saved:
+                self._index_entry(user_id, stamp_before, new_entry)
         
         return {
             "notebook_updated": True,
@@ -329,6 +439,7 @@ class NotebookService:
         Args:
             user_id: 用户ID
         """
+        self._indexes.pop(user_id, None)
         notebook_path = self._get_notebook_path(user_id)
         if notebook_path.exists():
             try:
@@ -347,6 +458,8 @@ class NotebookService:
         """
         old_path = self._get_notebook_path(old_user_id)
         new_path = self._get_notebook_path(new_user_id)
+        self._indexes.pop(old_user_id, None)
+        self._indexes.pop(new_user_id, None)
         
         if old_path.exists():
             try:
@@ -372,6 +485,79 @@ class NotebookService:
         """
         entries = self._load_notebook(user_id)
         return [entry.to_dict() for entry in entries]
+    
+    @staticmethod
+    def tool_query(conversation: Conversation, func_args: Dict) -> str:
+        """
+        read_divination_notebook 的检索词：模型给的 query + 用户最近一条消息
+        
+        reason 是模型对调用原因的泛泛说明（如「用户想回顾之前的占卜」），不参与检索，以免带偏排序。
+        """
+        parts = [str(func_args.get("query") or "")]
+        for msg in reversed(conversation.messages):
+            if msg.role == MessageRole.USER and msg.content.strip():
+                parts.append(msg.content)
+                break
+        return " ".join(p for p in parts if p)
+    
+    @staticmethod
+    def _format_entry(number: int, entry: NotebookEntry) -> str:
+        try:
+            start_time = datetime.fromisoformat(entry.start_time).strftime("%Y年%m月%d日")
+        except (TypeError, ValueError):
+            start_time = entry.start_time or "未知时间"
+        cards_str = "、".join(entry.cards_drawn) if entry.cards_drawn else "无"
+        text = (
+            f"【记录 {number}】\n"
+            f"时间：{start_time}\n"
+            f"问题：{entry.question or '无'}\n"
+            f"抽到的牌：{cards_str}\n"
+            f"记录：{entry.summary or '无'}\n"
+        )
+        if entry.user_feedback:
+            text += f"用户反馈：{entry.user_feedback}\n"
+        return text + "\n"
+    
+    def read_for_tool(self, user_id: str, query: str, token_cap: int = NOTEBOOK_SEARCH_TOKEN_CAP) -> Dict:
+        """
+        read_divination_notebook 工具的返回结果：只给与当前问题最相关的几条笔记，总长不超过 token_cap
+        
+        Args:
+            user_id: 用户ID
+            query: 检索词（见 tool_query）
+            token_cap: 笔记内容的 token 上限（估算）
+        """
+        entries, total = self.search_entries(user_id, query)
+        if total == 0:
+            return {
+                "success": True,
+                "notebook_count": 0,
+                "message": "笔记本中暂时还没有记录。当你完成占卜并退出对话后，系统会自动生成占卜记录保存在笔记本中。"
+            }
+        
+        blocks = []
+        used = 0
+        for entry in entries:
+            block = self._format_entry(len(blocks) + 1, entry)
+            cost = estimate_tokens(block)
+            if used + cost > token_cap:
+                if blocks:
+                    break
+                # 单条就超出上限：截断这一条
+                while block and estimate_tokens(block) > token_cap - 1:
+                    block = block[: len(block) * 9 // 10]
+                block += "…\n"
+                cost = estimate_tokens(block)
+            blocks.append(block)
+            used += cost
+        
+        header = f"用户的占卜笔记本（共 {total} 条记录，以下是与当前问题最相关的 {len(blocks)} 条）：\n\n"
+        return {
+            "success": True,
+            "notebook_count": total,
+            "returned_count": len(blocks),
+            "notebook_content": header + "".join(blocks)
+        }
 
 
 # 全局服务实例
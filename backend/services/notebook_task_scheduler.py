@@ -1,16 +1,69 @@
 """
 占卜笔记本定时任务调度器
 管理延迟12小时生成笔记的定时任务
+
+任务按 conversation_id 存在 dict 中，另用按计划时间排序的最小堆找下一个到期任务：调度循环
+睡到堆顶任务到期为止，新增更早的任务时提前唤醒。堆采用惰性删除（移除/改期只让旧堆项失效），
+失效项过多时重建。
+
+到期任务放进队列，由 NOTEBOOK_TASK_CONCURRENCY 个 worker 并发处理；单个任务有超时，
+失败按指数退避重新排期，达到最大尝试次数的最后一次写入默认摘要（仍失败则放弃）。
+
+持久化：快照 notebook_task_list.json（{"seq", "tasks"}）+ 追加日志 notebook_task_journal.jsonl。
+新增/改期/移除只追加一行日志（put/del，带递增 seq）；日志满 NOTEBOOK_TASK_JOURNAL_COMPACT_EVERY 条、
+启动和停止时压实：先写临时文件并 fsync，再 os.replace 替换快照，最后清空日志。
+加载时跳过 seq 小于快照 seq 的记录（压实中途崩溃不会重复应用），丢弃崩溃留下的半行。
+任务表只经由日志记录修改：写日志失败时该操作不生效并报错给调用方（add_task 返回 False）。
+
+多进程（uvicorn --workers N）：所有进程共用上述文件，读写都在文件锁（flock）内进行，
+每次加锁后先追上其他进程追加的日志（快照被别的进程压实过则整体重读）。任务到期后，
+进程在锁内写一条带租约的 put 记录（lease_owner/lease_until）认领任务，只处理自己认领的任务；
+其他进程看到未过期的租约就把该任务推迟到租约到期再检查。进程崩溃时租约过期后由其他进程接手，
+正常停止时释放租约。每个进程只认领空闲 worker 数量的任务，到期任务因此分散到各进程。
+
+加锁（可能要等其他进程压实完）、读写日志与压实时的 fsync 都是阻塞调用，统一放到每个调度器专用的
+单线程 I/O 执行器里（_in_lock），事件循环不会被卡住；单线程同时保证了本进程内锁内操作依次进行。
+I/O 线程只改任务表与文件，最小堆与唤醒事件只在事件循环里改：锁内操作返回涉及的任务，回到循环后再排期。
 """
+import heapq
+import itertools
 import json
+import os
+import socket
+import uuid
 import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Dict, List, Optional
-from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional, Tuple
+from dataclasses import dataclass, asdict, replace
 import threading
 
-from config import DATA_DIR
+try:
+    import fcntl
+except ImportError:  # Windows 没有 flock：只支持单进程运行
+    fcntl = None
+
+from config import (
+    DATA_DIR,
+    NOTEBOOK_TASK_CONCURRENCY,
+    NOTEBOOK_TASK_TIMEOUT_SECONDS,
+    NOTEBOOK_TASK_MAX_ATTEMPTS,
+    NOTEBOOK_TASK_RETRY_BACKOFF,
+    NOTEBOOK_TASK_JOURNAL_COMPACT_EVERY,
+    NOTEBOOK_TASK_LEASE_SECONDS,
+)
+from services.json_file_cache import file_stamp
+from services.metrics import metrics
+
+# 指标名
+TASK_DURATION_METRIC = "notebook_task_ms"  # 单个任务处理耗时
+TASK_LAG_METRIC = "notebook_task_lag_ms"  # 开始处理时已超过计划时间多久
+TASK_COMPLETED_METRIC = "notebook_tasks_completed"
+TASK_RETRIED_METRIC = "notebook_tasks_retried"
+TASK_FAILED_METRIC = "notebook_tasks_failed"  # 达到最大尝试次数后放弃
 
 
 @dataclass
@@ -20,6 +73,9 @@ class NotebookTask:
     user_id: str
     scheduled_time: str  # ISO格式时间字符串
     created_at: str  # 任务创建时间
+    attempts: int = 0  # 已失败的次数
+    lease_owner: str = ""  # 认领该任务的进程（为空表示未被认领）
+    lease_until: str = ""  # 租约到期时间（ISO），过期后其他进程可以重新认领
     
     def to_dict(self) -> Dict:
         return asdict(self)
@@ -35,6 +91,11 @@ class NotebookTaskScheduler:
     _instance = None
     _lock = threading.Lock()
     
+    # 对话结束后多久生成笔记
+    TASK_DELAY = timedelta(hours=12)
+    # 调度循环单次最长睡眠（秒）：堆按墙上时间排序，系统时间被调整时也能及时纠正
+    MAX_SLEEP_SECONDS = 300
+    
     def __new__(cls):
         if cls._instance is None:
             with cls._lock:
@@ -49,40 +110,213 @@ class NotebookTaskScheduler:
         
         self._initialized = True
         self.task_file = Path(DATA_DIR) / "notebook_task_list.json"
-        self.tasks: List[NotebookTask] = []
+        self.journal_file = Path(DATA_DIR) / "notebook_task_journal.jsonl"
+        self.lock_file = Path(DATA_DIR) / "notebook_task_list.lock"
+        # 本进程的租约标识
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lock_depth = 0
+        self._lock_handle = None
+        # 锁内操作（加锁、读写日志、压实）在这个线程里执行
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="notebook-task-io")
+        # 上次加载时快照的版本戳：变了说明其他进程压实过，需要整体重读
+        self._snapshot_stamp = None
+        # 下一条日志记录的 seq、日志中有效内容的字节数与记录数
+        self._journal_seq = 0
+        self._journal_offset = 0
+        self._journal_len = 0
+        # conversation_id -> 任务（含已入队/处理中的任务，直到完成或放弃才移除）
+        self.tasks: Dict[str, NotebookTask] = {}
         self.running = False
         self.worker_task: Optional[asyncio.Task] = None
-        self._processing_lock = asyncio.Lock()
+        self.concurrency = max(1, NOTEBOOK_TASK_CONCURRENCY)
+        self._queue: Optional[asyncio.Queue] = None
+        self._pool: List[asyncio.Task] = []
+        self._active = 0
+        # 最小堆：(计划时间, 序号, conversation_id)；_heap_entries 记录每个任务当前有效的堆项，
+        # 入队处理中的任务不在其中
+        self._heap: List[Tuple[datetime, int, str]] = []
+        self._heap_entries: Dict[str, Tuple[datetime, int, str]] = {}
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
         
         # 确保数据目录存在
         self.task_file.parent.mkdir(parents=True, exist_ok=True)
         
-        # 加载任务列表
-        self._load_tasks()
+        # 加载任务列表（快照 + 日志），并把日志并入快照
+        with self._locked():
+            self._load_tasks()
+            if self._journal_len:
+                self._compact()
+        self._rebuild_heap()
+        
+        metrics.register_gauge("notebook_tasks_pending", lambda: len(self.tasks))
+        metrics.register_gauge("notebook_tasks_queued", lambda: self._queue.qsize() if self._queue else 0)
+        metrics.register_gauge("notebook_tasks_running", lambda: self._active)
     
     def _load_tasks(self):
-        """从文件加载任务列表"""
-        if not self.task_file.exists():
-            self.tasks = []
-            return
+        """从快照和追加日志加载任务列表（不动堆，由调用方重建）"""
+        tasks: Dict[str, NotebookTask] = {}
+        snapshot_seq = 0
+        self._snapshot_stamp = file_stamp(self.task_file)
+        if self.task_file.exists():
+            try:
+                with open(self.task_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if isinstance(data, list):  # 旧格式：任务数组
+                    items = data
+                else:
+                    snapshot_seq = data.get("seq", 0)
+                    items = data.get("tasks", [])
+                for item in items:
+                    task = NotebookTask.from_dict(item)
+                    tasks[task.conversation_id] = task
+            except Exception as e:
+                print(f"[TaskScheduler] 加载任务快照失败: {e}")
+                tasks = {}
         
+        self.tasks = tasks
+        self._journal_seq = snapshot_seq
+        self._journal_offset = 0
+        self._journal_len = 0
+        if self.journal_file.exists():
+            with open(self.journal_file, 'rb') as f:
+                self._fold_journal(f.read())
+        
+        print(f"[TaskScheduler] 加载了 {len(self.tasks)} 个待处理任务")
+    
+    def _fold_journal(self, raw: bytes) -> List[str]:
+        """把从 _journal_offset 起的日志内容应用到任务表，返回涉及的 conversation_id"""
+        changed = []
+        for line in raw.splitlines(keepends=True):
+            if not line.endswith(b"\n"):
+                break  # 崩溃时留下的半行，下次追加前截掉
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            self._journal_offset += len(line)
+            self._journal_len += 1
+            if record["seq"] < self._journal_seq:
+                continue  # 已并入快照
+            self._apply_record(record)
+            self._journal_seq = record["seq"] + 1
+            changed.append(record["task"]["conversation_id"] if record["op"] == "put" else record["conversation_id"])
+        return changed
+    
+    def _apply_record(self, record: Dict):
+        if record["op"] == "put":
+            task = NotebookTask.from_dict(record["task"])
+            self.tasks[task.conversation_id] = task
+        elif record["op"] == "del":
+            self.tasks.pop(record["conversation_id"], None)
+    
+    # ---------- 多进程同步 ----------
+    
+    @contextmanager
+    def _locked(self):
+        """跨进程互斥（flock，可重入）：读写任务文件都在锁内进行。会阻塞，只在 I/O 线程里或启动时调用"""
+        if self._lock_depth == 0:
+            self._lock_handle = open(self.lock_file, 'a')
+            if fcntl is not None:
+                fcntl.flock(self._lock_handle, fcntl.LOCK_EX)
+        self._lock_depth += 1
         try:
-            with open(self.task_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                self.tasks = [NotebookTask.from_dict(task) for task in data]
-            print(f"[TaskScheduler] 加载了 {len(self.tasks)} 个待处理任务")
-        except Exception as e:
-            print(f"[TaskScheduler] 加载任务列表失败: {e}")
-            self.tasks = []
+            yield
+        finally:
+            self._lock_depth -= 1
+            if self._lock_depth == 0:
+                # 关闭文件即释放锁
+                self._lock_handle.close()
+                self._lock_handle = None
     
-    def _save_tasks(self):
-        """保存任务列表到文件"""
+    def _sync(self) -> Optional[List[str]]:
+        """（持锁调用）追上其他进程写入的日志，返回有改动的 conversation_id；快照被压实过则整体重读，返回 None"""
+        if file_stamp(self.task_file) != self._snapshot_stamp:
+            self._load_tasks()
+            return None
         try:
-            with open(self.task_file, 'w', encoding='utf-8') as f:
-                json.dump([task.to_dict() for task in self.tasks], f, ensure_ascii=False, indent=2)
-            print(f"[TaskScheduler] 任务列表已保存，共 {len(self.tasks)} 个任务")
-        except Exception as e:
-            print(f"[TaskScheduler] 保存任务列表失败: {e}")
+            size = os.path.getsize(self.journal_file)
+        except FileNotFoundError:
+            size = 0
+        if size < self._journal_offset:
+            self._load_tasks()
+            return None
+        if size == self._journal_offset:
+            return []
+        with open(self.journal_file, 'rb') as f:
+            f.seek(self._journal_offset)
+            raw = f.read()
+        return self._fold_journal(raw)
+    
+    async def _in_lock(self, fn, *args):
+        """在 I/O 线程里持锁执行 fn（先追上其他进程的改动），回到事件循环后按同步到的改动重新排期。
+        fn 写日志失败抛出的 OSError 在重新排期后原样抛给调用方"""
+        def locked():
+            with self._locked():
+                changed = self._sync()
+                try:
+                    return changed, fn(*args), None
+                except OSError as e:
+                    return changed, None, e
+        
+        changed, result, error = await asyncio.get_running_loop().run_in_executor(self._io, locked)
+        if changed is None:
+            self._rebuild_heap()
+        else:
+            for conversation_id in changed:
+                self._reschedule(conversation_id)
+        if error is not None:
+            raise error
+        return result
+    
+    def _lease_active(self, task: NotebookTask, now: datetime) -> bool:
+        """任务已被认领且租约未过期"""
+        return bool(task.lease_owner) and datetime.fromisoformat(task.lease_until) > now
+    
+    def _due_at(self, task: NotebookTask) -> datetime:
+        """堆中的排序时间：计划时间；被认领时推迟到租约到期"""
+        due = datetime.fromisoformat(task.scheduled_time)
+        if task.lease_owner and task.lease_until:
+            due = max(due, datetime.fromisoformat(task.lease_until))
+        return due
+    
+    def _append_journal(self, record: Dict):
+        """同步追加一条日志记录（一行，几十字节）并应用到任务表，必要时压实。
+        任务表只经由这里修改：写日志失败时抛出 OSError，任务表保持不变"""
+        record = {**record, "seq": self._journal_seq}
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        if self.journal_file.exists() and os.path.getsize(self.journal_file) > self._journal_offset:
+            os.truncate(self.journal_file, self._journal_offset)  # 截掉半行，新记录从整行边界开始
+        with open(self.journal_file, 'ab') as f:
+            f.write(line)
+        self._journal_seq += 1
+        self._journal_offset += len(line)
+        self._journal_len += 1
+        self._apply_record(record)
+        if self._journal_len >= NOTEBOOK_TASK_JOURNAL_COMPACT_EVERY:
+            self._compact()
+    
+    def _compact(self):
+        """把当前任务表原子写成快照，然后清空日志"""
+        tmp = self.task_file.with_name(self.task_file.name + ".tmp")
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(
+                    {"seq": self._journal_seq, "tasks": [task.to_dict() for task in self.tasks.values()]},
+                    f, ensure_ascii=False
+                )
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.task_file)
+            self._snapshot_stamp = file_stamp(self.task_file)
+            # 快照已包含全部日志记录；此处崩溃时，重启会按 seq 跳过这些旧记录
+            self.journal_file.unlink(missing_ok=True)
+        except OSError as e:
+            print(f"[TaskScheduler] 压实任务日志失败: {e}")
+            return
+        self._journal_offset = 0
+        self._journal_len = 0
+        print(f"[TaskScheduler] 任务快照已保存，共 {len(self.tasks)} 个任务")
     
     async def add_task(self, conversation_id: str, user_id: str) -> bool:
         """
@@ -90,27 +324,34 @@ class NotebookTaskScheduler:
         
         Returns:
             True: 成功添加新任务
-            False: 任务已存在
+            False: 任务已存在，或写任务日志失败（任务未添加）
         """
-        # 检查是否已存在
-        for task in self.tasks:
-            if task.conversation_id == conversation_id:
-                print(f"[TaskScheduler] 任务已存在，跳过: {conversation_id}")
-                return False
-        
-        # 创建新任务，12小时后执行
-        scheduled_time = datetime.utcnow() + timedelta(hours=12)
-        new_task = NotebookTask(
-            conversation_id=conversation_id,
-            user_id=user_id,
-            scheduled_time=scheduled_time.isoformat(),
-            created_at=datetime.utcnow().isoformat()
-        )
-        
-        self.tasks.append(new_task)
-        self._save_tasks()
+        def put() -> Optional[NotebookTask]:
+            # 检查是否已存在（含其他进程添加的）
+            if conversation_id in self.tasks:
+                return None
+            
+            # 创建新任务，12小时后执行
+            scheduled_time = datetime.utcnow() + self.TASK_DELAY
+            task = NotebookTask(
+                conversation_id=conversation_id,
+                user_id=user_id,
+                scheduled_time=scheduled_time.isoformat(),
+                created_at=datetime.utcnow().isoformat()
+            )
+            self._append_journal({"op": "put", "task": task.to_dict()})
+            return self.tasks[conversation_id]
         
-        print(f"[TaskScheduler] 新增任务: {conversation_id}, 计划执行时间: {scheduled_time}")
+        try:
+            new_task = await self._in_lock(put)
+        except OSError as e:
+            print(f"[TaskScheduler] 写任务日志失败，未添加任务: {conversation_id}, 错误: {e}")
+            return False
+        if new_task is None:
+            print(f"[TaskScheduler] 任务已存在，跳过: {conversation_id}")
+            return False
+        self._schedule(new_task)
+        print(f"[TaskScheduler] 新增任务: {conversation_id}, 计划执行时间: {new_task.scheduled_time}")
         
         # 如果worker未运行，启动它
         if not self.running:
@@ -118,64 +359,172 @@ class NotebookTaskScheduler:
         
         return True
     
-    async def remove_task(self, conversation_id: str):
-        """移除任务"""
-        self.tasks = [t for t in self.tasks if t.conversation_id != conversation_id]
-        self._save_tasks()
-        print(f"[TaskScheduler] 移除任务: {conversation_id}")
+    async def remove_task(self, conversation_id: str, lease_owner: Optional[str] = None) -> bool:
+        """
+        移除任务
+        
+        Args:
+            lease_owner: 给出时只在任务仍由它认领时移除（租约过期、已被其他进程接手的任务保留）
+        
+        Returns:
+            是否移除了任务
+        """
+        def delete() -> bool:
+            task = self.tasks.get(conversation_id)
+            if task is None or (lease_owner is not None and task.lease_owner != lease_owner):
+                return False
+            self._append_journal({"op": "del", "conversation_id": conversation_id})
+            return True
+        
+        removed = await self._in_lock(delete)
+        if removed:
+            self._heap_entries.pop(conversation_id, None)
+            print(f"[TaskScheduler] 移除任务: {conversation_id}")
+        else:
+            self._reschedule(conversation_id)
+        return removed
+    
+    # ---------- 到期时间堆 ----------
+    
+    def _schedule(self, task: NotebookTask):
+        """按任务的到期时间放入堆（替换旧堆项）；成为最早的任务时唤醒调度循环"""
+        entry = (self._due_at(task), next(self._seq), task.conversation_id)
+        self._heap_entries[task.conversation_id] = entry
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry and self._wakeup is not None:
+            self._wakeup.set()
+        if len(self._heap) > 2 * len(self._heap_entries) + 64:
+            self._compact_heap()
+    
+    def _reschedule(self, conversation_id: str):
+        """按任务表里的当前状态更新堆：任务已不存在则让堆项失效"""
+        task = self.tasks.get(conversation_id)
+        if task is None:
+            self._heap_entries.pop(conversation_id, None)
+        else:
+            self._schedule(task)
+    
+    def _compact_heap(self):
+        """丢弃失效堆项"""
+        self._heap = list(self._heap_entries.values())
+        heapq.heapify(self._heap)
+    
+    def _rebuild_heap(self):
+        """按任务表重建堆（加载任务后、worker 重新启动时：上次处理中的任务重新排期）"""
+        self._heap_entries = {}
+        for task in list(self.tasks.values()):  # I/O 线程可能正在改任务表，先取快照
+            self._heap_entries[task.conversation_id] = (self._due_at(task), next(self._seq), task.conversation_id)
+        self._compact_heap()
+    
+    def _pop_due(self, now: datetime, limit: int) -> List[str]:
+        """弹出已到期的任务，最多 limit 个（失效堆项跳过）"""
+        due = []
+        while self._heap and self._heap[0][0] <= now and len(due) < limit:
+            entry = heapq.heappop(self._heap)
+            conversation_id = entry[2]
+            if self._heap_entries.get(conversation_id) is not entry:
+                continue  # 已移除或已改期
+            del self._heap_entries[conversation_id]
+            due.append(conversation_id)
+        return due
+    
+    def _lease(self, conversation_ids: List[str], now: datetime) -> Tuple[List[NotebookTask], List[str]]:
+        """（持锁调用）给到期任务写租约认领；返回 (认领到的任务, 其他进程已认领或已改期、需要重新排期的任务)"""
+        claimed, deferred = [], []
+        lease_until = (now + timedelta(seconds=NOTEBOOK_TASK_LEASE_SECONDS)).isoformat()
+        for conversation_id in conversation_ids:
+            task = self.tasks.get(conversation_id)
+            if task is None:
+                continue  # 已被其他进程处理完
+            if self._lease_active(task, now) or self._due_at(task) > now:
+                deferred.append(conversation_id)
+                continue
+            self._append_journal({"op": "put", "task": {**task.to_dict(), "lease_owner": self.owner, "lease_until": lease_until}})
+            claimed.append(self.tasks[conversation_id])
+        return claimed, deferred
+    
+    async def _claim_due(self, now: datetime, limit: int) -> List[NotebookTask]:
+        """认领已到期的任务，最多 limit 个；被其他进程认领的推迟到租约到期"""
+        due = self._pop_due(now, limit)
+        try:
+            claimed, deferred = await self._in_lock(self._lease, due, now)
+        except OSError:
+            # 写日志失败：弹出的任务放回堆（已认领到的按租约到期排期），由调度循环出错退避后重试
+            for conversation_id in due:
+                self._reschedule(conversation_id)
+            raise
+        for conversation_id in deferred:
+            self._reschedule(conversation_id)
+        return claimed
+    
+    def _seconds_until_next_due(self, now: datetime) -> float:
+        while self._heap and self._heap_entries.get(self._heap[0][2]) is not self._heap[0]:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return self.MAX_SLEEP_SECONDS
+        wait = (self._heap[0][0] - now).total_seconds()
+        return min(max(wait, 0.0), self.MAX_SLEEP_SECONDS)
     
     async def start_worker(self):
-        """启动后台工作线程"""
+        """启动后台调度循环与 worker 池"""
         if self.running:
             print("[TaskScheduler] Worker 已在运行")
             return
         
         self.running = True
+        self._queue = asyncio.Queue()
+        self._wakeup = asyncio.Event()
+        self._rebuild_heap()
+        self._pool = [asyncio.create_task(self._pool_worker()) for _ in range(self.concurrency)]
         
         # 创建异步任务
         if self.worker_task is None or self.worker_task.done():
             self.worker_task = asyncio.create_task(self._worker_loop())
         
-        print("[TaskScheduler] Worker 已启动")
+        print(f"[TaskScheduler] Worker 已启动，并发数: {self.concurrency}")
     
     async def stop_worker(self):
-        """停止后台工作线程"""
+        """停止后台调度循环与 worker 池（处理中的任务被取消，仍留在任务列表中，下次启动重新执行）"""
         self.running = False
-        if self.worker_task and not self.worker_task.done():
-            self.worker_task.cancel()
-            try:
-                await self.worker_task
-            except asyncio.CancelledError:
-                pass
+        pending = [t for t in [self.worker_task, *self._pool] if t and not t.done()]
+        for t in pending:
+            t.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        self._pool = []
+        self._wakeup = None
+        
+        def release():
+            # 释放本进程认领的任务（处理被中断），其他进程或下次启动可立即接手
+            for task in list(self.tasks.values()):
+                if task.lease_owner == self.owner:
+                    self._append_journal({"op": "put", "task": {**task.to_dict(), "lease_owner": "", "lease_until": ""}})
+            if self._journal_len:
+                self._compact()
+        
+        try:
+            await self._in_lock(release)
+        except OSError as e:
+            # 未释放的租约到期后照样会被接手
+            print(f"[TaskScheduler] 释放租约失败: {e}")
         print("[TaskScheduler] Worker 已停止")
     
     async def _worker_loop(self):
-        """后台工作循环，处理定时任务"""
+        """后台调度循环：把到期任务放入队列，然后睡到下一个任务到期（或被更早的新任务唤醒）"""
         print("[TaskScheduler] Worker loop 开始")
         
         while self.running:
             try:
-                # 每分钟检查一次
-                await asyncio.sleep(60)
-                
-                if not self.tasks:
-                    continue
-                
-                current_time = datetime.utcnow()
-                
-                # 查找到期的任务
-                due_tasks = [
-                    task for task in self.tasks
-                    if datetime.fromisoformat(task.scheduled_time) <= current_time
-                ]
-                
-                if due_tasks:
-                    print(f"[TaskScheduler] 发现 {len(due_tasks)} 个到期任务")
-                    # 顺序执行（使用锁保证不并行）
-                    async with self._processing_lock:
-                        for task in due_tasks:
-                            await self._process_task(task)
-                
+                self._wakeup.clear()
+                await self._enqueue_due_tasks()
+                if self._free_workers() > 0:
+                    delay = self._seconds_until_next_due(datetime.utcnow())
+                else:
+                    # worker 都在忙：等某个任务处理完（worker 会唤醒调度循环）
+                    delay = self.MAX_SLEEP_SECONDS
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
             except asyncio.CancelledError:
                 print("[TaskScheduler] Worker loop 被取消")
                 break
@@ -183,47 +532,124 @@ class NotebookTaskScheduler:
                 print(f"[TaskScheduler] Worker loop 错误: {e}")
                 import traceback
                 traceback.print_exc()
+                await asyncio.sleep(1)
     
-    async def _process_task(self, task: NotebookTask):
-        """处理单个任务"""
-        print(f"[TaskScheduler] 开始处理任务: {task.conversation_id}")
-        
+    def _free_workers(self) -> int:
+        return self.concurrency - self._active - self._queue.qsize()
+    
+    async def _enqueue_due_tasks(self):
+        """同步其他进程的改动，认领到期任务（不超过空闲 worker 数），放入队列"""
+        free = self._free_workers()
+        if free <= 0:
+            return
+        due_tasks = await self._claim_due(datetime.utcnow(), free)
+        if due_tasks:
+            print(f"[TaskScheduler] 发现 {len(due_tasks)} 个到期任务")
+        for task in due_tasks:
+            self._queue.put_nowait(task)
+    
+    async def _pool_worker(self):
+        """worker：从队列取任务处理，直到被取消"""
+        while True:
+            task = await self._queue.get()
+            self._active += 1
+            try:
+                await self._run_task(task)
+            except Exception as e:
+                print(f"[TaskScheduler] 处理任务出错: {task.conversation_id}, 错误: {e}")
+                # 完成/改期没能写入日志：任务仍在任务表里，按租约到期时间重新排期
+                self._reschedule(task.conversation_id)
+            finally:
+                self._active -= 1
+                self._queue.task_done()
+                if self._wakeup is not None:
+                    self._wakeup.set()
+    
+    async def _run_task(self, task: NotebookTask):
+        """带超时地处理一个任务：成功则移除，失败则退避重试或放弃"""
+        lag = datetime.utcnow() - datetime.fromisoformat(task.scheduled_time)
+        metrics.observe(TASK_LAG_METRIC, max(0.0, lag.total_seconds() * 1000))
+        # 最后一次尝试允许写入默认摘要，保证笔记最终会生成
+        last_attempt = task.attempts + 1 >= NOTEBOOK_TASK_MAX_ATTEMPTS
+        start = time.perf_counter()
         try:
-            # 获取对话和用户信息
-            from services.conversation_service import ConversationService
-            from services.storage_service import StorageService
-            from services.notebook_service import notebook_service
-            
-            conversation = await ConversationService.get_conversation(task.conversation_id)
-            if not conversation:
-                print(f"[TaskScheduler] 对话不存在: {task.conversation_id}")
-                await self.remove_task(task.conversation_id)
-                return
-            
-            user = await StorageService.get_user(task.user_id)
-            
-            # 调用笔记生成服务（不再检查时间条件）
-            result = await notebook_service.generate_and_save_entry(
-                user_id=task.user_id,
-                conversation=conversation,
-                user=user
-            )
-            
-            print(f"[TaskScheduler] 任务完成: {task.conversation_id}, 结果: {result}")
-            
+            await asyncio.wait_for(self._process_task(task, fallback=last_attempt), NOTEBOOK_TASK_TIMEOUT_SECONDS)
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            print(f"[TaskScheduler] 处理任务失败: {task.conversation_id}, 错误: {e}")
-            import traceback
-            traceback.print_exc()
-        finally:
-            # 无论成功失败，都移除任务
-            await self.remove_task(task.conversation_id)
+            reason = "超时" if isinstance(e, asyncio.TimeoutError) else str(e)
+            await self._retry_or_give_up(task, reason)
+            return
+        metrics.observe(TASK_DURATION_METRIC, (time.perf_counter() - start) * 1000)
+        metrics.incr(TASK_COMPLETED_METRIC)
+        if not await self.remove_task(task.conversation_id, lease_owner=self.owner):
+            # 处理超过了租约时长，任务已被其他进程接手：由持有租约的进程收尾
+            print(f"[TaskScheduler] 租约已被其他进程接手，保留任务: {task.conversation_id}")
+    
+    async def _retry_or_give_up(self, task: NotebookTask, reason: str):
+        def record_failure() -> Optional[NotebookTask]:
+            current = self.tasks.get(task.conversation_id)
+            if current is None or current.lease_owner != self.owner:
+                return None  # 处理期间任务已被移除，或租约已过期被其他进程接手
+            attempts = current.attempts + 1
+            if attempts >= NOTEBOOK_TASK_MAX_ATTEMPTS:
+                return replace(current, attempts=attempts)  # 放弃：由调用方移除，不必再记一次改期
+            delay = NOTEBOOK_TASK_RETRY_BACKOFF * (2 ** (attempts - 1))
+            self._append_journal({"op": "put", "task": {
+                **current.to_dict(), "attempts": attempts, "lease_owner": "", "lease_until": "",
+                "scheduled_time": (datetime.utcnow() + timedelta(seconds=delay)).isoformat(),
+            }})
+            return self.tasks[task.conversation_id]
+        
+        task = await self._in_lock(record_failure)
+        if task is None:
+            return
+        give_up = task.attempts >= NOTEBOOK_TASK_MAX_ATTEMPTS
+        if give_up:
+            print(f"[TaskScheduler] 任务失败 {task.attempts} 次，放弃: {task.conversation_id}, 原因: {reason}")
+            metrics.incr(TASK_FAILED_METRIC)
+            await self.remove_task(task.conversation_id, lease_owner=self.owner)
+            return
+        self._schedule(task)
+        metrics.incr(TASK_RETRIED_METRIC)
+        delay = NOTEBOOK_TASK_RETRY_BACKOFF * (2 ** (task.attempts - 1))
+        print(f"[TaskScheduler] 任务失败（第 {task.attempts} 次），{delay:.0f} 秒后重试: {task.conversation_id}, 原因: {reason}")
+    
+    async def _process_task(self, task: NotebookTask, fallback: bool = True):
+        """
+        处理单个任务（生成并保存笔记），失败时抛出异常
+        
+        Args:
+            fallback: 摘要生成失败时是否写入默认摘要
+        """
+        print(f"[TaskScheduler] 开始处理任务: {task.conversation_id}")
+        
+        # 获取对话和用户信息
+        from services.conversation_service import ConversationService
+        from services.storage_service import StorageService
+        from services.notebook_service import notebook_service
+        
+        conversation = await ConversationService.get_conversation(task.conversation_id)
+        if not conversation:
+            print(f"[TaskScheduler] 对话不存在: {task.conversation_id}")
+            return
+        
+        user = await StorageService.get_user(task.user_id)
+        
+        # 调用笔记生成服务（不再检查时间条件）
+        result = await notebook_service.generate_and_save_entry(
+            user_id=task.user_id,
+            conversation=conversation,
+            user=user,
+            fallback=fallback
+        )
+        
+        print(f"[TaskScheduler] 任务完成: {task.conversation_id}, 结果: {result}")
     
     def get_pending_tasks(self) -> List[Dict]:
         """获取待处理任务列表（用于调试）"""
-        return [task.to_dict() for task in self.tasks]
+        return [task.to_dict() for task in list(self.tasks.values())]
 
 
 # 全局单例
 task_scheduler = NotebookTaskScheduler()
-
@@ -7,7 +7,7 @@
   - `AlipayProvider` / `WechatProvider`：真实渠道**脚手架**。凭证齐全时启用，
     缺失时（且 PAYMENTS_ALLOW_MOCK）自动回退到 Mock，便于先联调前端。
     真实下单/验签处用 lazy import 接官方 SDK，并标注了接入点。
-- 金额与套餐以服务端目录为准，回调入账带幂等保护（credited 标记）。
+- 金额与套餐以服务端目录为准，回调入账带幂等保护（credited 标记 + 星尘账本按 order_id 去重）。
 
 接真实支付需要的凭证见仓库根目录 `docs/.../payments-setup.md`（本次新建）。
 """
@@ -195,21 +195,23 @@ class PaymentService:
 
     @staticmethod
     async def mark_paid(order_id: str, transaction_id: Optional[str] = None) -> Optional[PaymentOrder]:
-        """把订单置为已支付并入账星尘（幂等：credited 标记保证只入账一次）。"""
-        async with StoreStorage.order_lock:
+        """把订单置为已支付并入账星尘（幂等：账本按 order_id 去重，credited 标记短路重复回调）。"""
+        async with StoreStorage.order_lock(order_id):
             order = await StoreStorage.get_order(order_id)
             if order is None:
                 return None
             if order.credited:
                 return order  # 已入账，幂等返回
+            # 先按 order_id 记账再标记订单：两步之间崩溃，渠道重试时账本去重，不会重复入账。
+            # 锁顺序固定为「订单锁 → 钱包锁」，钱包路径从不反向取订单锁。
+            await WalletService.credit_stardust(
+                order.user_id, order.stardust + order.bonus, order_id=order.order_id
+            )
             order.status = OrderStatus.PAID
             order.transaction_id = transaction_id
             order.paid_at = datetime.utcnow().isoformat()
             order.credited = True
             await StoreStorage.save_order(order)
-
-        # 入账放在订单锁外（用钱包锁），避免锁嵌套。
-        await WalletService.credit_stardust(order.user_id, order.stardust + order.bonus)
         return order
 
     @staticmethod
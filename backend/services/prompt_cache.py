@@ -0,0 +1,60 @@
+"""按对话缓存已格式化的历史消息（发给 Gemini 的 dict 结构）。
+
+每轮请求只有末尾几条消息是新的：缓存记录「已格式化的消息数 + 这段前缀的链式摘要」，
+命中时只格式化新增消息。整体改写对话（StorageService.save_conversation）或删除对话时
+显式失效；链式摘要校验兜底其他进程改动了已缓存前缀中的任意一条消息。
+"""
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from models import Message
+from services.history_window import prefix_digests
+
+RenderedMessage = List[Dict]  # 一条消息格式化后的 0~2 个 Gemini 消息
+
+
+class FormattedHistoryCache:
+    """conversation_id -> (消息数, 前缀链式摘要, 每条消息的格式化结果)，LRU 淘汰。"""
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[int, str, List[RenderedMessage]]]" = OrderedDict()
+
+    def render(
+        self,
+        conversation_id: Optional[str],
+        messages: List[Message],
+        render_one: Callable[[Message], RenderedMessage],
+    ) -> List[RenderedMessage]:
+        """返回与 messages 一一对应的格式化结果；只对缓存未覆盖的消息调用 render_one。
+        返回值与缓存共享，调用方只读使用。"""
+        if not conversation_id or not messages:
+            return [render_one(m) for m in messages]
+
+        digests = prefix_digests(messages, len(messages))
+        rendered: List[RenderedMessage] = []
+        cached = self._entries.get(conversation_id)
+        if cached is not None:
+            count, prefix_digest, cached_rendered = cached
+            if 0 < count <= len(messages) and digests[count] == prefix_digest:
+                rendered = cached_rendered
+
+        if len(rendered) < len(messages):
+            rendered = rendered + [render_one(m) for m in messages[len(rendered):]]
+
+        self._entries[conversation_id] = (len(messages), digests[-1], rendered)
+        self._entries.move_to_end(conversation_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return rendered
+
+    def invalidate(self, conversation_id: Optional[str] = None):
+        """丢弃某个对话（或全部）的缓存。"""
+        if conversation_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(conversation_id, None)
+
+
+# 全局实例
+formatted_history_cache = FormattedHistoryCache()
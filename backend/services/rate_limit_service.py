@@ -4,6 +4,8 @@
 只保留当天数据，避免无限增长；写入走临时文件 + os.replace 原子替换，配合进程内
 asyncio.Lock，避免并发下计数丢失或文件损坏。
 
+STORAGE_BACKEND=sqlite 时计数落在 SQLite 的 usage 表（BEGIN IMMEDIATE 保证多进程下也不丢）。
+
 注意：游客身份可被清缓存重置，本层不防此类绕过（按需求暂不做 IP 限流）。它的定位是
 「每个身份的公平额度 + 账单兜底」，更强的防滥用应叠加 IP 限流 / 全局预算熔断。
 """
@@ -16,6 +18,7 @@ from fastapi import HTTPException
 
 from config import GUEST_DAILY_MESSAGE_LIMIT, USAGE_FILE, USER_DAILY_MESSAGE_LIMIT
 from models import User, UserType
+from services.sqlite_backend import get_sqlite_backend
 
 _lock = asyncio.Lock()
 
@@ -45,6 +48,14 @@ def _limit_for(user: User) -> int:
     return GUEST_DAILY_MESSAGE_LIMIT if user.user_type == UserType.GUEST else USER_DAILY_MESSAGE_LIMIT
 
 
+def _raise_exceeded(user: User, limit: int):
+    if user.user_type == UserType.GUEST:
+        detail = f"今日免费次数已用完（{limit} 次/天），明天再来，或注册账号获取更多次数。"
+    else:
+        detail = f"今日次数已达上限（{limit} 次/天），请明天再来。"
+    raise HTTPException(status_code=429, detail=detail)
+
+
 class RateLimitService:
     """每日次数限制。"""
 
@@ -53,16 +64,18 @@ class RateLimitService:
         """额度足够则计数 +1 并返回用量；超额抛 429。"""
         limit = _limit_for(user)
         today = _today()
+        db = get_sqlite_backend()
+        if db:
+            used = await db.consume_usage(today, user.user_id, limit)
+            if used is None:
+                _raise_exceeded(user, limit)
+            return {"used": used, "limit": limit}
         async with _lock:
             data = _read()
             day = data.get(today, {})
             used = day.get(user.user_id, 0)
             if used >= limit:
-                if user.user_type == UserType.GUEST:
-                    detail = f"今日免费次数已用完（{limit} 次/天），明天再来，或注册账号获取更多次数。"
-                else:
-                    detail = f"今日次数已达上限（{limit} 次/天），请明天再来。"
-                raise HTTPException(status_code=429, detail=detail)
+                _raise_exceeded(user, limit)
             day[user.user_id] = used + 1
             # 只落当天，顺手丢弃历史日期，保持文件极小
             _write_atomic({today: day})
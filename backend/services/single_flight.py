@@ -0,0 +1,32 @@
+"""按 key 合并并发的相同请求（single-flight）。
+
+同一 key 已有请求在途时，后来者不再重复发起，而是等待同一个任务的结果；
+任务结束即从在途表移除——结果不缓存（缓存由调用方自行负责），失败（异常）
+会抛给所有等待者，下一次调用重新发起。
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+
+class SingleFlight:
+    """用法：`result = await flights.do(key, lambda: fetch(...))`"""
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._forget(k, t))
+        # shield：某个等待者被取消不影响共享任务和其他等待者
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    def __len__(self) -> int:
+        """当前在途的 key 数量（调试/测试用）。"""
+        return len(self._inflight)
@@ -0,0 +1,467 @@
+"""SQLite 存储后端（STORAGE_BACKEND=sqlite 时启用）。
+
+标准库 sqlite3 + WAL 模式：读写互不阻塞，单机多 worker 也能安全并发。
+所有 SQL 都丢进专用线程池执行，不阻塞事件循环；每个工作线程持有自己的连接
+（sqlite3 连接不能跨线程共享）。
+
+数据行以 JSON 文本存放（data 列），需要查询/排序的字段单独成列并建索引：
+users.username、conversations.user_id、messages.conversation_id、
+payment_orders.out_trade_no / user_id。接口只收发 dict，模型转换留在各 Service。
+
+JSON 文件后端仍是默认值，开发期可直接查看/手改数据文件。
+"""
+import asyncio
+import json
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import config
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id   TEXT PRIMARY KEY,
+    username  TEXT,
+    data      TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username ON users(username) WHERE username IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS conversations (
+    conversation_id TEXT PRIMARY KEY,
+    user_id         TEXT NOT NULL,
+    updated_at      TEXT NOT NULL,
+    data            TEXT NOT NULL          -- 对话元数据（不含 messages）
+);
+CREATE INDEX IF NOT EXISTS idx_conversations_user ON conversations(user_id, updated_at, conversation_id);
+
+CREATE TABLE IF NOT EXISTS messages (
+    conversation_id TEXT NOT NULL,
+    seq             INTEGER NOT NULL,
+    data            TEXT NOT NULL,
+    PRIMARY KEY (conversation_id, seq)
+);
+
+CREATE TABLE IF NOT EXISTS wallets (
+    user_id TEXT PRIMARY KEY,
+    data    TEXT NOT NULL          -- 钱包状态快照（随每条账本事件在同一事务内更新）
+);
+
+CREATE TABLE IF NOT EXISTS wallet_ledger (
+    user_id  TEXT NOT NULL,
+    seq      INTEGER NOT NULL,
+    order_id TEXT,
+    data     TEXT NOT NULL,
+    PRIMARY KEY (user_id, seq)
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_wallet_ledger_order ON wallet_ledger(order_id) WHERE order_id IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS payment_orders (
+    order_id     TEXT PRIMARY KEY,
+    out_trade_no TEXT NOT NULL,
+    user_id      TEXT NOT NULL,
+    created_at   TEXT NOT NULL,
+    data         TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_out_trade_no ON payment_orders(out_trade_no);
+CREATE INDEX IF NOT EXISTS idx_orders_user ON payment_orders(user_id, created_at);
+
+CREATE TABLE IF NOT EXISTS daily_records (
+    user_id        TEXT NOT NULL,
+    effective_date TEXT NOT NULL,
+    data           TEXT NOT NULL,
+    PRIMARY KEY (user_id, effective_date)
+);
+
+CREATE TABLE IF NOT EXISTS daily_journey_cache (
+    user_id      TEXT PRIMARY KEY,
+    generated_on TEXT NOT NULL,
+    text         TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS natal_charts (
+    chart_key TEXT PRIMARY KEY,
+    data      TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS usage (
+    day     TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    used    INTEGER NOT NULL,
+    PRIMARY KEY (day, user_id)
+);
+"""
+
+
+def _dumps(data) -> str:
+    return json.dumps(data, ensure_ascii=False)
+
+
+class SqliteBackend:
+    """SQLite 持久化实现。方法均为 async，内部在线程池中执行同步 SQL。"""
+
+    def __init__(self, db_path: Path, max_workers: int = 4):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._conn_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sqlite")
+
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+
+    # ── 连接与线程池 ─────────────────────────────────────────────
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # 连接只在创建它的工作线程里使用；关闭 same-thread 检查仅为了 close() 时统一回收
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._conn_lock:
+                self._connections.append(conn)
+        return conn
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: fn(self._conn(), *args))
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._conn_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
+    # ── 用户 ───────────────────────────────────────────────────
+    async def get_user(self, user_id: str) -> Optional[dict]:
+        def q(conn):
+            row = conn.execute("SELECT data FROM users WHERE user_id = ?", (user_id,)).fetchone()
+            return json.loads(row[0]) if row else None
+        return await self._run(q)
+
+    async def get_user_by_username(self, username: str) -> Optional[dict]:
+        def q(conn):
+            row = conn.execute("SELECT data FROM users WHERE username = ?", (username,)).fetchone()
+            return json.loads(row[0]) if row else None
+        return await self._run(q)
+
+    async def save_user(self, data: dict):
+        def q(conn):
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO users (user_id, username, data) VALUES (?, ?, ?)",
+                    (data["user_id"], data.get("username"), _dumps(data)),
+                )
+        await self._run(q)
+
+    async def delete_user(self, user_id: str):
+        def q(conn):
+            with conn:
+                conn.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
+        await self._run(q)
+
+    # ── 对话 ───────────────────────────────────────────────────
+    @staticmethod
+    def _load_conversation(conn, conversation_id: str) -> Optional[dict]:
+        row = conn.execute(
+            "SELECT data FROM conversations WHERE conversation_id = ?", (conversation_id,)
+        ).fetchone()
+        if not row:
+            return None
+        data = json.loads(row[0])
+        data["messages"] = [
+            json.loads(m[0]) for m in conn.execute(
+                "SELECT data FROM messages WHERE conversation_id = ? ORDER BY seq", (conversation_id,)
+            )
+        ]
+        return data
+
+    async def get_conversation(self, conversation_id: str) -> Optional[dict]:
+        return await self._run(lambda conn: self._load_conversation(conn, conversation_id))
+
+    async def get_user_conversations(self, user_id: str) -> List[dict]:
+        """用户全部对话（含消息），按 updated_at 倒序。"""
+        def q(conn):
+            ids = [r[0] for r in conn.execute(
+                "SELECT conversation_id FROM conversations WHERE user_id = ? ORDER BY updated_at DESC",
+                (user_id,),
+            )]
+            return [self._load_conversation(conn, cid) for cid in ids]
+        return await self._run(q)
+
+    async def list_conversation_summaries(
+        self, user_id: str, limit: int, after: Optional[Tuple[str, str]] = None
+    ) -> List[dict]:
+        """按 (updated_at, conversation_id) 倒序取对话摘要，不读 messages 表；after 为上一页最后一项。"""
+        def q(conn):
+            sql = (
+                "SELECT conversation_id, json_extract(data, '$.session_type'), "
+                "json_extract(data, '$.title'), updated_at FROM conversations WHERE user_id = ?"
+            )
+            params: list = [user_id]
+            if after:
+                sql += " AND (updated_at, conversation_id) < (?, ?)"
+                params += list(after)
+            sql += " ORDER BY updated_at DESC, conversation_id DESC LIMIT ?"
+            params.append(limit)
+            return [
+                {"conversation_id": r[0], "session_type": r[1], "title": r[2], "updated_at": r[3]}
+                for r in conn.execute(sql, params)
+            ]
+        return await self._run(q)
+
+    async def save_conversation(self, data: dict):
+        """整体保存对话：元数据覆盖；消息按 seq upsert（已存在的被编辑消息也会更新），多出的尾部删除。"""
+        meta = {k: v for k, v in data.items() if k != "messages"}
+        messages = data.get("messages", [])
+        conv_id = meta["conversation_id"]
+
+        def q(conn):
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO conversations (conversation_id, user_id, updated_at, data) "
+                    "VALUES (?, ?, ?, ?)",
+                    (conv_id, meta["user_id"], meta["updated_at"], _dumps(meta)),
+                )
+                conn.execute(
+                    "DELETE FROM messages WHERE conversation_id = ? AND seq >= ?", (conv_id, len(messages))
+                )
+                conn.executemany(
+                    "INSERT INTO messages (conversation_id, seq, data) VALUES (?, ?, ?) "
+                    "ON CONFLICT(conversation_id, seq) DO UPDATE SET data = excluded.data "
+                    "WHERE data IS NOT excluded.data",
+                    [(conv_id, i, _dumps(m)) for i, m in enumerate(messages)],
+                )
+        await self._run(q)
+
+    async def append_messages(self, conversation_id: str, messages: List[dict], fields: dict):
+        """追加若干消息（每条一行 INSERT，同一事务）并更新对话字段；对话不存在抛 ValueError。"""
+        def q(conn):
+            with conn:
+                row = conn.execute(
+                    "SELECT data FROM conversations WHERE conversation_id = ?", (conversation_id,)
+                ).fetchone()
+                if not row:
+                    raise ValueError("对话不存在")
+                meta = json.loads(row[0])
+                meta.update(fields)
+                seq = conn.execute(
+                    "SELECT COALESCE(MAX(seq) + 1, 0) FROM messages WHERE conversation_id = ?",
+                    (conversation_id,),
+                ).fetchone()[0]
+                conn.executemany(
+                    "INSERT INTO messages (conversation_id, seq, data) VALUES (?, ?, ?)",
+                    [(conversation_id, seq + i, _dumps(m)) for i, m in enumerate(messages)],
+                )
+                conn.execute(
+                    "UPDATE conversations SET updated_at = ?, data = ? WHERE conversation_id = ?",
+                    (meta["updated_at"], _dumps(meta), conversation_id),
+                )
+        await self._run(q)
+
+    async def delete_conversation(self, conversation_id: str):
+        def q(conn):
+            with conn:
+                conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+                conn.execute("DELETE FROM conversations WHERE conversation_id = ?", (conversation_id,))
+        await self._run(q)
+
+    async def delete_user_conversations(self, user_id: str):
+        def q(conn):
+            with conn:
+                conn.execute(
+                    "DELETE FROM messages WHERE conversation_id IN "
+                    "(SELECT conversation_id FROM conversations WHERE user_id = ?)",
+                    (user_id,),
+                )
+                conn.execute("DELETE FROM conversations WHERE user_id = ?", (user_id,))
+        await self._run(q)
+
+    # ── 钱包 / 订单 ─────────────────────────────────────────────
+    async def get_wallet_state(self, user_id: str) -> Optional[dict]:
+        def q(conn):
+            row = conn.execute("SELECT data FROM wallets WHERE user_id = ?", (user_id,)).fetchone()
+            return json.loads(row[0]) if row else None
+        return await self._run(q)
+
+    async def append_wallet_event(self, user_id: str, event: dict, apply, new_state) -> Tuple[dict, bool]:
+        """在一个 BEGIN IMMEDIATE 事务里读钱包状态、分配 seq、用 apply 折叠事件、写账本与快照。
+
+        返回 (最新状态, 是否生效)；带 order_id 且该订单已入账时不写入，返回 (当前状态, False)。
+        new_state() 给出尚无钱包时的初始状态。账本 (user_id, seq) 冲突时重读状态重试。
+        """
+        order_id = event.get("order_id")
+
+        def credited(conn) -> bool:
+            return bool(order_id) and conn.execute(
+                "SELECT 1 FROM wallet_ledger WHERE order_id = ?", (order_id,)
+            ).fetchone() is not None
+
+        def q(conn):
+            for _ in range(5):
+                try:
+                    with conn:
+                        conn.execute("BEGIN IMMEDIATE")  # 先拿写锁：读状态到写入之间不会有其他写者
+                        row = conn.execute("SELECT data FROM wallets WHERE user_id = ?", (user_id,)).fetchone()
+                        state = json.loads(row[0]) if row else new_state()
+                        if credited(conn):
+                            return state, False
+                        stamped = {**event, "seq": state["seq"]}
+                        apply(state, stamped)
+                        conn.execute(
+                            "INSERT INTO wallet_ledger (user_id, seq, order_id, data) VALUES (?, ?, ?, ?)",
+                            (user_id, stamped["seq"], order_id, _dumps(stamped)),
+                        )
+                        conn.execute(
+                            "INSERT OR REPLACE INTO wallets (user_id, data) VALUES (?, ?)",
+                            (user_id, _dumps(state)),
+                        )
+                        return state, True
+                except sqlite3.IntegrityError:
+                    if credited(conn):
+                        row = conn.execute("SELECT data FROM wallets WHERE user_id = ?", (user_id,)).fetchone()
+                        return (json.loads(row[0]) if row else new_state()), False
+                    print(f"[SQLite] 钱包账本 seq 冲突，重试: {user_id}")
+            raise RuntimeError(f"钱包账本写入反复冲突: {user_id}")
+        return await self._run(q)
+
+    async def list_wallet_events(self, user_id: str, limit: int) -> List[dict]:
+        def q(conn):
+            return [json.loads(r[0]) for r in conn.execute(
+                "SELECT data FROM wallet_ledger WHERE user_id = ? ORDER BY seq DESC LIMIT ?", (user_id, limit)
+            )]
+        return await self._run(q)
+
+    async def get_order(self, order_id: str) -> Optional[dict]:
+        def q(conn):
+            row = conn.execute("SELECT data FROM payment_orders WHERE order_id = ?", (order_id,)).fetchone()
+            return json.loads(row[0]) if row else None
+        return await self._run(q)
+
+    async def get_order_by_out_trade_no(self, out_trade_no: str) -> Optional[dict]:
+        def q(conn):
+            row = conn.execute(
+                "SELECT data FROM payment_orders WHERE out_trade_no = ?", (out_trade_no,)
+            ).fetchone()
+            return json.loads(row[0]) if row else None
+        return await self._run(q)
+
+    async def list_user_orders(self, user_id: str) -> List[dict]:
+        def q(conn):
+            return [json.loads(r[0]) for r in conn.execute(
+                "SELECT data FROM payment_orders WHERE user_id = ? ORDER BY created_at DESC", (user_id,)
+            )]
+        return await self._run(q)
+
+    async def save_order(self, data: dict):
+        def q(conn):
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO payment_orders (order_id, out_trade_no, user_id, created_at, data) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (data["order_id"], data["out_trade_no"], data["user_id"], data["created_at"], _dumps(data)),
+                )
+        await self._run(q)
+
+    # ── 每日一签 ────────────────────────────────────────────────
+    async def get_daily_records(self, user_id: str) -> Dict[str, dict]:
+        def q(conn):
+            return {
+                d: json.loads(data) for d, data in conn.execute(
+                    "SELECT effective_date, data FROM daily_records WHERE user_id = ?", (user_id,)
+                )
+            }
+        return await self._run(q)
+
+    async def save_daily_record(self, user_id: str, data: dict):
+        def q(conn):
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO daily_records (user_id, effective_date, data) VALUES (?, ?, ?)",
+                    (user_id, data["effective_date"], _dumps(data)),
+                )
+        await self._run(q)
+
+    async def get_journey_cache(self, user_id: str) -> Optional[dict]:
+        def q(conn):
+            row = conn.execute(
+                "SELECT generated_on, text FROM daily_journey_cache WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            return {"generated_on": row[0], "text": row[1]} if row else None
+        return await self._run(q)
+
+    async def save_journey_cache(self, user_id: str, generated_on: str, text: str):
+        def q(conn):
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO daily_journey_cache (user_id, generated_on, text) VALUES (?, ?, ?)",
+                    (user_id, generated_on, text),
+                )
+        await self._run(q)
+
+    # ── 本命盘缓存 ──────────────────────────────────────────────
+    async def get_natal_chart(self, chart_key: str) -> Optional[dict]:
+        def q(conn):
+            row = conn.execute("SELECT data FROM natal_charts WHERE chart_key = ?", (chart_key,)).fetchone()
+            return json.loads(row[0]) if row else None
+        return await self._run(q)
+
+    async def save_natal_chart(self, chart_key: str, entry: dict):
+        def q(conn):
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO natal_charts (chart_key, data) VALUES (?, ?)",
+                    (chart_key, _dumps(entry)),
+                )
+        await self._run(q)
+
+    # ── 用量计数 ────────────────────────────────────────────────
+    async def consume_usage(self, day: str, user_id: str, limit: int) -> Optional[int]:
+        """额度内则计数 +1 并返回新用量；已达上限返回 None。顺手清理历史日期。"""
+        def q(conn):
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")  # 先拿写锁，多进程并发计数也不丢
+                row = conn.execute(
+                    "SELECT used FROM usage WHERE day = ? AND user_id = ?", (day, user_id)
+                ).fetchone()
+                used = row[0] if row else 0
+                if used >= limit:
+                    return None
+                conn.execute(
+                    "INSERT OR REPLACE INTO usage (day, user_id, used) VALUES (?, ?, ?)",
+                    (day, user_id, used + 1),
+                )
+                conn.execute("DELETE FROM usage WHERE day < ?", (day,))
+                return used + 1
+        return await self._run(q)
+
+
+_backend: Optional[SqliteBackend] = None
+
+
+def get_sqlite_backend() -> Optional[SqliteBackend]:
+    """STORAGE_BACKEND=sqlite 时返回进程级单例，否则返回 None（走 JSON 文件）。"""
+    global _backend
+    if config.STORAGE_BACKEND != "sqlite":
+        return None
+    if _backend is None or _backend.db_path != Path(config.SQLITE_DB_FILE):
+        if _backend is not None:
+            _backend.close()
+        _backend = SqliteBackend(config.SQLITE_DB_FILE, max_workers=config.SQLITE_MAX_WORKERS)
+    return _backend
+
+
+def close_sqlite_backend():
+    """关闭线程池与连接（应用关闭时调用）。"""
+    global _backend
+    if _backend is not None:
+        _backend.close()
+        _backend = None
@@ -1,34 +1,68 @@
+import asyncio
+import base64
+import hashlib
 import json
+import os
+import re
+import shutil
 import aiofiles
 from pathlib import Path
-from typing import List, Optional
-from models import User, Conversation
-from config import USERS_FILE, CONVERSATIONS_FILE
+from typing import List, Optional, Tuple
+from models import User, Conversation, ConversationSummary, Message
+from config import (
+    USERS_FILE, USERNAME_INDEX_FILE, CONVERSATIONS_FILE, CONVERSATIONS_DIR, CONVERSATION_INDEX_DIR,
+    CONVERSATION_JOURNAL_COMPACT_EVERY,
+)
+from services.json_file_cache import JsonFileCache, file_stamp
+from services.prompt_cache import formatted_history_cache
+from services.sqlite_backend import get_sqlite_backend
+
+# 进程级 write-through 缓存：users.json 解析结果常驻内存，
+# 仅在文件 mtime/size 变化时重读；鉴权依赖每个请求都会 get_user，不再整文件解析。
+_cache = JsonFileCache()
+# 对话缓存：快照 + 追加日志折叠后的结果，版本戳为 (快照戳, 日志戳)
+_conversation_cache = JsonFileCache()
+
+# 对话 id 只允许字母数字/下划线/连字符：id 会拼进文件路径，防止 ../ 穿越
+_CONVERSATION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,128}$")
+
+# 用户名索引是否已确认存在；与 users.json 的读-改-写共用一把锁
+_username_index_ready = False
+_users_lock = asyncio.Lock()
+
+# 旧版 conversations.json 是否已迁移到分片目录（进程内只检查一次）
+_legacy_migrated = False
+_migrate_lock = asyncio.Lock()
+
+# 对话二级索引（user_id -> 对话摘要）是否已确认存在；读-改-写用同一把锁串行
+_index_ready = False
+_index_lock = asyncio.Lock()
+
+# 对话摘要字段：列表页只需要这些，不加载消息
+_SUMMARY_FIELDS = ("session_type", "title", "updated_at")
 
 
 class StorageService:
-    """本地JSON文件存储服务"""
+    """本地存储服务：默认 JSON 文件；STORAGE_BACKEND=sqlite 时转交 SQLite 后端"""
     
     @staticmethod
     async def _read_json(file_path: Path) -> dict:
-        """读取JSON文件"""
-        if not file_path.exists():
-            return {}
-        
-        async with aiofiles.open(file_path, 'r', encoding='utf-8') as f:
-            content = await f.read()
-            return json.loads(content) if content else {}
+        """读取JSON文件（命中缓存时不读盘；返回缓存本体，修改后须 _write_json）"""
+        return await _cache.read(file_path)
     
     @staticmethod
     async def _write_json(file_path: Path, data: dict):
-        """写入JSON文件"""
-        async with aiofiles.open(file_path, 'w', encoding='utf-8') as f:
-            await f.write(json.dumps(data, ensure_ascii=False, indent=2))
+        """写入JSON文件（同时更新内存缓存）"""
+        await _cache.write(file_path, data)
     
     # 用户相关操作
     @staticmethod
     async def get_user(user_id: str) -> Optional[User]:
         """获取用户"""
+        db = get_sqlite_backend()
+        if db:
+            user_data = await db.get_user(user_id)
+            return User(**user_data) if user_data else None
         users = await StorageService._read_json(USERS_FILE)
         user_data = users.get(user_id)
         return User(**user_data) if user_data else None
@@ -36,73 +70,484 @@ class StorageService:
     @staticmethod
     async def get_user_by_username(username: str) -> Optional[User]:
         """通过用户名获取用户"""
+        db = get_sqlite_backend()
+        if db:
+            user_data = await db.get_user_by_username(username)
+            return User(**user_data) if user_data else None
+        await StorageService.ensure_username_index()
+        index = await StorageService._read_json(USERNAME_INDEX_FILE)
+        user_id = index.get(username)
+        if user_id is None:
+            return None
         users = await StorageService._read_json(USERS_FILE)
-        for user_data in users.values():
-            if user_data.get('username') == username:
-                return User(**user_data)
-        return None
+        user_data = users.get(user_id)
+        if not user_data or user_data.get('username') != username:
+            # 索引与 users.json 不一致（例如手工改过文件）：重建后再查一次
+            await StorageService.rebuild_username_index()
+            index = await StorageService._read_json(USERNAME_INDEX_FILE)
+            user_data = users.get(index.get(username, ""))
+        return User(**user_data) if user_data else None
+    
+    @staticmethod
+    async def rebuild_username_index() -> int:
+        """从 users.json 全量重建用户名索引，返回索引条数"""
+        async with _users_lock:
+            users = await StorageService._read_json(USERS_FILE)
+            index = {
+                data['username']: user_id
+                for user_id, data in users.items() if data.get('username')
+            }
+            await _cache.write(USERNAME_INDEX_FILE, index, indent=None)
+        print(f"[Storage] 已重建用户名索引：{len(index)} 个用户名")
+        return len(index)
+    
+    @staticmethod
+    async def ensure_username_index():
+        """索引文件不存在时重建（首次升级或手工删除后）"""
+        global _username_index_ready
+        if get_sqlite_backend() or _username_index_ready:
+            return
+        if not USERNAME_INDEX_FILE.exists():
+            await StorageService.rebuild_username_index()
+        _username_index_ready = True
     
     @staticmethod
     async def save_user(user: User):
         """保存用户"""
-        users = await StorageService._read_json(USERS_FILE)
-        users[user.user_id] = user.model_dump()
-        await StorageService._write_json(USERS_FILE, users)
+        db = get_sqlite_backend()
+        if db:
+            await db.save_user(user.model_dump())
+            return
+        await StorageService.ensure_username_index()
+        async with _users_lock:
+            users = await StorageService._read_json(USERS_FILE)
+            old_username = (users.get(user.user_id) or {}).get('username')
+            users[user.user_id] = user.model_dump()
+            await StorageService._write_json(USERS_FILE, users)
+            if old_username != user.username:
+                index = await StorageService._read_json(USERNAME_INDEX_FILE)
+                if old_username and index.get(old_username) == user.user_id:
+                    del index[old_username]
+                if user.username:
+                    index[user.username] = user.user_id
+                await _cache.write(USERNAME_INDEX_FILE, index, indent=None)
     
     @staticmethod
     async def delete_user(user_id: str):
         """删除用户"""
-        users = await StorageService._read_json(USERS_FILE)
-        if user_id in users:
-            del users[user_id]
+        db = get_sqlite_backend()
+        if db:
+            await db.delete_user(user_id)
+            return
+        await StorageService.ensure_username_index()
+        async with _users_lock:
+            users = await StorageService._read_json(USERS_FILE)
+            if user_id not in users:
+                return
+            username = users.pop(user_id).get('username')
             await StorageService._write_json(USERS_FILE, users)
+            index = await StorageService._read_json(USERNAME_INDEX_FILE)
+            if username and index.get(username) == user_id:
+                del index[username]
+                await _cache.write(USERNAME_INDEX_FILE, index, indent=None)
+    
+    # 对话相关操作（分片存储：每个对话一个文件，按 id 哈希前缀分桶）
+    @staticmethod
+    def _conversation_path(conversation_id: str) -> Optional[Path]:
+        """对话分片文件路径 conversations/<ab>/<conversation_id>.json；非法 id 返回 None"""
+        if not _CONVERSATION_ID_RE.match(conversation_id or ""):
+            return None
+        bucket = hashlib.md5(conversation_id.encode("utf-8")).hexdigest()[:2]
+        return CONVERSATIONS_DIR / bucket / f"{conversation_id}.json"
+    
+    @staticmethod
+    def _iter_conversation_paths() -> List[Path]:
+        """列出所有对话分片文件"""
+        if not CONVERSATIONS_DIR.exists():
+            return []
+        return list(CONVERSATIONS_DIR.glob("*/*.json"))
+    
+    @staticmethod
+    def _journal_path(snapshot_path: Path) -> Path:
+        """对话追加日志路径：与快照同目录的 <conversation_id>.jsonl"""
+        return snapshot_path.with_suffix(".jsonl")
+    
+    @staticmethod
+    def _fold_journal(data: dict, lines: List[str]) -> int:
+        """把日志记录折叠进快照 dict，返回日志有效记录数。
+        每条记录带 seq（追加前的消息数）：seq 小于当前消息数说明已并入快照，跳过，
+        因此压实过程中途崩溃、日志未及时裁剪也不会重复消息。"""
+        messages = data.setdefault("messages", [])
+        count = 0
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # 崩溃时可能留下半行，丢弃
+            count += 1
+            if record.get("seq", 0) < len(messages):
+                continue
+            messages.append(record["message"])
+            data.update(record.get("set") or {})
+        return count
+    
+    @staticmethod
+    async def _load_conversation_entry(conversation_id: str) -> Optional[dict]:
+        """读取对话（快照 + 日志尾部折叠），命中缓存时不读盘。
+        返回缓存本体 {"data": 对话 dict, "journal_len": 日志记录数}。"""
+        path = StorageService._conversation_path(conversation_id)
+        if path is None:
+            return None
+        journal = StorageService._journal_path(path)
+        stamp = (file_stamp(path), file_stamp(journal))
+        if stamp[0] is None:
+            return None
+        
+        key = f"conv:{conversation_id}"
+        entry = _conversation_cache.get(key, stamp)
+        if entry is not None:
+            return entry
+        
+        async with aiofiles.open(path, 'r', encoding='utf-8') as f:
+            content = await f.read()
+        data = json.loads(content) if content else {}
+        if not data:
+            return None
+        lines = []
+        if stamp[1] is not None:
+            async with aiofiles.open(journal, 'r', encoding='utf-8') as f:
+                lines = (await f.read()).splitlines()
+        entry = {"data": data, "journal_len": StorageService._fold_journal(data, lines)}
+        _conversation_cache.put(key, stamp, entry)
+        return entry
+    
+    @staticmethod
+    def _trim_journal(journal: Path, snapshot_seq: int) -> int:
+        """裁掉已并入快照的日志记录（seq < snapshot_seq），返回保留的记录数。
+        同步执行：与 append_message 的同步追加之间不会交错。"""
+        if not journal.exists():
+            return 0
+        with open(journal, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+        kept = []
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("seq", 0) >= snapshot_seq:
+                kept.append(line)
+        if kept:
+            tmp = journal.with_name(journal.name + ".tmp")
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.writelines(kept)
+            os.replace(tmp, journal)
+        else:
+            os.remove(journal)
+        return len(kept)
+    
+    @staticmethod
+    async def _write_conversation_snapshot(conversation_id: str, data: dict):
+        """原子写快照（临时文件 + os.replace），再裁剪已并入快照的日志"""
+        path = StorageService._conversation_path(conversation_id)
+        if path is None:
+            raise ValueError(f"非法的对话ID: {conversation_id}")
+        journal = StorageService._journal_path(path)
+        # 先同步序列化，定格此刻的内容；写盘期间的并发追加会留在日志里
+        text = json.dumps(data, ensure_ascii=False, indent=2)
+        snapshot_seq = len(data.get("messages", []))
+        
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        async with aiofiles.open(tmp, 'w', encoding='utf-8') as f:
+            await f.write(text)
+        os.replace(tmp, path)
+        kept = StorageService._trim_journal(journal, snapshot_seq)
+        
+        key = f"conv:{conversation_id}"
+        if kept:
+            # 写快照期间有新追加：下次读取从磁盘重新折叠
+            _conversation_cache.invalidate(key)
+        else:
+            _conversation_cache.put(key, (file_stamp(path), None), {"data": data, "journal_len": 0})
+    
+    @staticmethod
+    def _remove_conversation_files(conversation_id: str, path: Path):
+        _conversation_cache.invalidate(f"conv:{conversation_id}")
+        for p in (path, StorageService._journal_path(path)):
+            if p.exists():
+                os.remove(p)
+    
+    # 二级索引：conversation_index/<md5(user_id)>.json = {conversation_id: 摘要}
+    @staticmethod
+    def _index_path(user_id: str) -> Path:
+        return CONVERSATION_INDEX_DIR / f"{hashlib.md5(user_id.encode('utf-8')).hexdigest()}.json"
+    
+    @staticmethod
+    def _summary_of(data: dict) -> dict:
+        return {k: data.get(k) for k in _SUMMARY_FIELDS}
+    
+    @staticmethod
+    async def _update_index(user_id: str, conversation_id: str, summary: Optional[dict]):
+        """更新某用户索引中的一项；summary 为 None 表示移除"""
+        path = StorageService._index_path(user_id)
+        async with _index_lock:
+            index = await _cache.read(path)
+            if summary is None:
+                if conversation_id not in index:
+                    return
+                del index[conversation_id]
+            elif index.get(conversation_id) == summary:
+                return
+            else:
+                index[conversation_id] = summary
+            if index:
+                CONVERSATION_INDEX_DIR.mkdir(parents=True, exist_ok=True)
+                await _cache.write(path, index, indent=None)
+            else:
+                _cache.invalidate(path)
+                if path.exists():
+                    os.remove(path)
+    
+    @staticmethod
+    async def rebuild_conversation_index() -> int:
+        """全量扫描对话分片重建索引，返回索引的对话数。
+        先写到临时目录再整体替换，重建中途崩溃不会留下半份索引。"""
+        async with _index_lock:
+            by_user = {}
+            for path in StorageService._iter_conversation_paths():
+                entry = await StorageService._load_conversation_entry(path.stem)
+                if entry is None:
+                    continue
+                data = entry["data"]
+                by_user.setdefault(data["user_id"], {})[path.stem] = StorageService._summary_of(data)
+            
+            tmp_dir = CONVERSATION_INDEX_DIR.with_name(CONVERSATION_INDEX_DIR.name + ".tmp")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            tmp_dir.mkdir(parents=True)
+            for user_id, index in by_user.items():
+                name = StorageService._index_path(user_id).name
+                with open(tmp_dir / name, 'w', encoding='utf-8') as f:
+                    json.dump(index, f, ensure_ascii=False)
+            shutil.rmtree(CONVERSATION_INDEX_DIR, ignore_errors=True)
+            os.replace(tmp_dir, CONVERSATION_INDEX_DIR)
+            _cache.invalidate()
+            count = sum(len(index) for index in by_user.values())
+            print(f"[Storage] 已重建对话索引：{len(by_user)} 个用户，{count} 个对话")
+            return count
+    
+    @staticmethod
+    async def ensure_conversation_index():
+        """索引目录不存在时重建（首次升级或手工删除后）"""
+        global _index_ready
+        if get_sqlite_backend() or _index_ready:
+            return
+        if not CONVERSATION_INDEX_DIR.exists():
+            await StorageService.rebuild_conversation_index()
+        _index_ready = True
+    
+    @staticmethod
+    async def migrate_legacy_conversations() -> int:
+        """把旧版单文件 conversations.json 拆分到分片目录，返回迁移的对话数。
+        已存在的分片不覆盖；迁移完成后旧文件改名为 conversations.json.migrated 留作备份。"""
+        global _legacy_migrated
+        if get_sqlite_backend():
+            return 0
+        async with _migrate_lock:
+            if _legacy_migrated:
+                return 0
+            migrated = 0
+            if CONVERSATIONS_FILE.exists():
+                legacy = await _cache.read(CONVERSATIONS_FILE)
+                for conv_id, conv_data in legacy.items():
+                    path = StorageService._conversation_path(conv_id)
+                    if path is None or path.exists():
+                        continue
+                    await StorageService._write_conversation_snapshot(conv_id, conv_data)
+                    migrated += 1
+                _cache.invalidate(CONVERSATIONS_FILE)
+                if migrated:
+                    await StorageService.rebuild_conversation_index()
+                os.replace(CONVERSATIONS_FILE, CONVERSATIONS_FILE.with_name(CONVERSATIONS_FILE.name + ".migrated"))
+                print(f"[Storage] 已迁移 {migrated} 个对话到分片目录 {CONVERSATIONS_DIR}")
+            _legacy_migrated = True
+            return migrated
+    
+    @staticmethod
+    async def _ensure_migrated():
+        if not _legacy_migrated:
+            await StorageService.migrate_legacy_conversations()
+        await StorageService.ensure_conversation_index()
     
-    # 对话相关操作
     @staticmethod
     async def get_conversation(conversation_id: str) -> Optional[Conversation]:
         """获取对话"""
-        conversations = await StorageService._read_json(CONVERSATIONS_FILE)
-        conv_data = conversations.get(conversation_id)
-        return Conversation(**conv_data) if conv_data else None
+        db = get_sqlite_backend()
+        if db:
+            conv_data = await db.get_conversation(conversation_id)
+            return Conversation(**conv_data) if conv_data else None
+        await StorageService._ensure_migrated()
+        entry = await StorageService._load_conversation_entry(conversation_id)
+        return Conversation(**entry["data"]) if entry else None
     
     @staticmethod
     async def get_user_conversations(user_id: str) -> List[Conversation]:
         """获取用户的所有对话"""
-        conversations = await StorageService._read_json(CONVERSATIONS_FILE)
+        db = get_sqlite_backend()
+        if db:
+            return [Conversation(**c) for c in await db.get_user_conversations(user_id)]
+        await StorageService._ensure_migrated()
+        # 只加载索引里属于该用户的对话，不再全量扫描
+        index = await _cache.read(StorageService._index_path(user_id))
         user_convs = []
-        for conv_data in conversations.values():
-            if conv_data.get('user_id') == user_id:
-                user_convs.append(Conversation(**conv_data))
+        for conv_id in list(index):
+            entry = await StorageService._load_conversation_entry(conv_id)
+            if entry and entry["data"].get('user_id') == user_id:
+                user_convs.append(Conversation(**entry["data"]))
         # 按更新时间倒序排序
         user_convs.sort(key=lambda x: x.updated_at, reverse=True)
         return user_convs
     
+    @staticmethod
+    def _encode_cursor(updated_at: str, conversation_id: str) -> str:
+        raw = json.dumps([updated_at, conversation_id], ensure_ascii=False).encode("utf-8")
+        return base64.urlsafe_b64encode(raw).decode("ascii")
+    
+    @staticmethod
+    def _decode_cursor(cursor: str) -> Tuple[str, str]:
+        """解析分页游标；格式不对抛 ValueError"""
+        try:
+            updated_at, conversation_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        except Exception:
+            raise ValueError("无效的分页游标")
+        return str(updated_at), str(conversation_id)
+    
+    @staticmethod
+    async def list_user_conversation_summaries(
+        user_id: str, limit: int = 20, cursor: Optional[str] = None
+    ) -> Tuple[List[ConversationSummary], Optional[str]]:
+        """按 (updated_at, conversation_id) 倒序分页列出对话摘要，只读索引、不加载消息。
+        返回 (本页摘要, 下一页游标)；没有更多时游标为 None。"""
+        after = StorageService._decode_cursor(cursor) if cursor else None
+        db = get_sqlite_backend()
+        if db:
+            rows = await db.list_conversation_summaries(user_id, limit + 1, after)
+        else:
+            await StorageService._ensure_migrated()
+            index = await _cache.read(StorageService._index_path(user_id))
+            keys = [(s["updated_at"], conv_id) for conv_id, s in index.items()]
+            if after:
+                keys = [k for k in keys if k < after]
+            keys.sort(reverse=True)
+            rows = [{"conversation_id": k[1], **index[k[1]]} for k in keys[:limit + 1]]
+        
+        items = [ConversationSummary(**row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = items[-1]
+            next_cursor = StorageService._encode_cursor(last.updated_at, last.conversation_id)
+        return items, next_cursor
+    
     @staticmethod
     async def save_conversation(conversation: Conversation):
-        """保存对话"""
-        conversations = await StorageService._read_json(CONVERSATIONS_FILE)
-        conversations[conversation.conversation_id] = conversation.model_dump()
-        await StorageService._write_json(CONVERSATIONS_FILE, conversations)
+        """保存对话（只重写该对话自己的快照文件）"""
+        # 整体改写可能改动/删减了已有消息，已格式化的提示词前缀作废
+        formatted_history_cache.invalidate(conversation.conversation_id)
+        db = get_sqlite_backend()
+        if db:
+            await db.save_conversation(conversation.model_dump())
+            return
+        await StorageService._ensure_migrated()
+        data = conversation.model_dump()
+        await StorageService._write_conversation_snapshot(conversation.conversation_id, data)
+        await StorageService._update_index(
+            conversation.user_id, conversation.conversation_id, StorageService._summary_of(data)
+        )
+    
+    @staticmethod
+    async def append_message(conversation_id: str, message: Message, **fields):
+        """向对话追加一条消息：只往日志末尾写这一条记录，不重写整个对话。
+        fields 为随消息一起更新的对话字段（如 updated_at、title）。"""
+        await StorageService.append_messages(conversation_id, [message], **fields)
+    
+    @staticmethod
+    async def append_messages(conversation_id: str, messages: List[Message], **fields):
+        """一次追加多条消息（一次写盘），fields 随最后一条记录生效。
+        日志累计 CONVERSATION_JOURNAL_COMPACT_EVERY 条后压实进快照。"""
+        if not messages:
+            return
+        db = get_sqlite_backend()
+        if db:
+            await db.append_messages(conversation_id, [m.model_dump() for m in messages], fields)
+            return
+        await StorageService._ensure_migrated()
+        entry = await StorageService._load_conversation_entry(conversation_id)
+        if entry is None:
+            raise ValueError("对话不存在")
+        
+        data = entry["data"]
+        seq = len(data["messages"])
+        records = [
+            {"seq": seq + i, "message": m.model_dump(), "set": fields if i == len(messages) - 1 else {}}
+            for i, m in enumerate(messages)
+        ]
+        text = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+        
+        path = StorageService._conversation_path(conversation_id)
+        journal = StorageService._journal_path(path)
+        # 同步追加（只写这几条消息的字节）；从计算 seq 到更新内存之间没有 await，
+        # 同一进程内的并发追加不会交错或拿到相同的 seq
+        with open(journal, 'a', encoding='utf-8') as f:
+            f.write(text)
+        data["messages"].extend(r["message"] for r in records)
+        data.update(fields)
+        entry["journal_len"] += len(records)
+        _conversation_cache.put(f"conv:{conversation_id}", (file_stamp(path), file_stamp(journal)), entry)
+        
+        summary = StorageService._summary_of(data)
+        if entry["journal_len"] >= CONVERSATION_JOURNAL_COMPACT_EVERY:
+            await StorageService._write_conversation_snapshot(conversation_id, data)
+        if any(k in fields for k in _SUMMARY_FIELDS):
+            await StorageService._update_index(data["user_id"], conversation_id, summary)
     
     @staticmethod
     async def delete_conversation(conversation_id: str):
         """删除对话"""
-        conversations = await StorageService._read_json(CONVERSATIONS_FILE)
-        if conversation_id in conversations:
-            del conversations[conversation_id]
-            await StorageService._write_json(CONVERSATIONS_FILE, conversations)
+        formatted_history_cache.invalidate(conversation_id)
+        db = get_sqlite_backend()
+        if db:
+            await db.delete_conversation(conversation_id)
+            return
+        await StorageService._ensure_migrated()
+        entry = await StorageService._load_conversation_entry(conversation_id)
+        if entry is None:
+            return
+        user_id = entry["data"]["user_id"]
+        StorageService._remove_conversation_files(
+            conversation_id, StorageService._conversation_path(conversation_id)
+        )
+        await StorageService._update_index(user_id, conversation_id, None)
     
     @staticmethod
     async def delete_user_conversations(user_id: str):
         """删除用户的所有对话"""
-        conversations = await StorageService._read_json(CONVERSATIONS_FILE)
-        # 过滤掉该用户的所有对话
-        filtered_conversations = {
-            conv_id: conv_data
-            for conv_id, conv_data in conversations.items()
-            if conv_data.get('user_id') != user_id
-        }
-        await StorageService._write_json(CONVERSATIONS_FILE, filtered_conversations)
-
-
-
+        db = get_sqlite_backend()
+        if db:
+            await db.delete_user_conversations(user_id)
+            return
+        await StorageService._ensure_migrated()
+        index_path = StorageService._index_path(user_id)
+        for conv_id in list(await _cache.read(index_path)):
+            entry = await StorageService._load_conversation_entry(conv_id)
+            if entry and entry["data"].get('user_id') == user_id:
+                formatted_history_cache.invalidate(conv_id)
+                StorageService._remove_conversation_files(
+                    conv_id, StorageService._conversation_path(conv_id)
+                )
+        async with _index_lock:
+            _cache.invalidate(index_path)
+            if index_path.exists():
+                os.remove(index_path)
@@ -1,71 +1,331 @@
-"""牌组商城的本地 JSON 存储：钱包 + 支付订单。
+"""牌组商城的本地存储：钱包 + 支付订单。
 
-沿用 `storage_service.py` 的 aiofiles + JSON 文件模式（个人应用规模，无需数据库）。
-额外加了一把 asyncio 锁，保证「读-改-写」式的扣款/入账不会因并发请求互相覆盖。
+沿用 `storage_service.py` 的 JSON 文件 + write-through 缓存模式（个人应用规模，无需数据库）；
+STORAGE_BACKEND=sqlite 时转交 SQLite 后端。
+
+钱包是每个用户一本追加式星尘账本（grant / purchase / credit / set_active 事件），
+每次变动只往该用户的 .jsonl 末尾写一行；每 WALLET_SNAPSHOT_EVERY 条写一次余额快照，
+读取 = 快照 + 快照之后的账本尾部。充值入账按 order_id 幂等：以账本本身为准（SQLite 上是 order_id
+唯一索引，JSON 上查该用户的账本文件），不在钱包状态里另存已入账订单列表。账本从不裁剪，即交易历史。
+钱包按 user_id、订单按 order_id 加锁，保证「读-改-写」式的扣款/入账不会因并发请求
+互相覆盖，同时一个用户的购买不会挡住其他用户的充值入账。
+
+订单另建内存索引 out_trade_no -> order_id、user_id -> [order_id]：支付回调与
+「我的订单」都不再线性扫描 payment_orders.json。索引随缓存的订单 dict 一起
+失效（文件被外部改动、缓存重载时整体重建），save_order 时增量维护。
 """
-import json
 import asyncio
-import aiofiles
+import hashlib
+import json
+import os
+from datetime import datetime
 from pathlib import Path
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple
+
+import aiofiles
+
+from store_models import Wallet, WalletLedgerEntry, PaymentOrder
+from config import WALLETS_FILE, WALLET_LEDGER_DIR, WALLET_SNAPSHOT_EVERY, PAYMENT_ORDERS_FILE
+from services.json_file_cache import JsonFileCache, file_stamp
+from services.keyed_lock import KeyedLock
+from services.sqlite_backend import get_sqlite_backend
 
-from store_models import Wallet, PaymentOrder
-from config import WALLETS_FILE, PAYMENT_ORDERS_FILE
+# 业务层锁：钱包按 user_id、订单按 order_id 串行各自的读改写。
+_wallet_locks = KeyedLock()
+_order_locks = KeyedLock()
+# 文件层锁：订单存在一个 JSON 文件里，不同订单的保存仍须串行写盘。
+_orders_file_lock = asyncio.Lock()
 
-# 钱包与订单各自一把锁：序列化各自的读改写，避免并发请求互相覆盖。
-_wallet_lock = asyncio.Lock()
-_order_lock = asyncio.Lock()
+_cache = JsonFileCache()
 
 
 async def _read_json(file_path: Path) -> dict:
-    if not file_path.exists():
-        return {}
-    async with aiofiles.open(file_path, "r", encoding="utf-8") as f:
-        content = await f.read()
-        return json.loads(content) if content else {}
+    """返回缓存本体，修改后须 _write_json"""
+    return await _cache.read(file_path)
 
 
 async def _write_json(file_path: Path, data: dict):
-    async with aiofiles.open(file_path, "w", encoding="utf-8") as f:
-        await f.write(json.dumps(data, ensure_ascii=False, indent=2))
+    await _cache.write(file_path, data)
+
+
+class _OrderIndex:
+    """订单二级索引，绑定到某一份已解析的订单 dict（按对象身份判断是否需要重建）。"""
+
+    def __init__(self):
+        self._source: Optional[dict] = None
+        self.by_out_trade_no: Dict[str, str] = {}
+        self.by_user: Dict[str, List[str]] = {}
+
+    def sync(self, orders: dict) -> "_OrderIndex":
+        if orders is not self._source:
+            self._source = orders
+            self.by_out_trade_no = {}
+            self.by_user = {}
+            for data in orders.values():
+                self.add(data)
+        return self
+
+    def add(self, data: dict):
+        order_id = data["order_id"]
+        self.by_out_trade_no[data["out_trade_no"]] = order_id
+        user_orders = self.by_user.setdefault(data["user_id"], [])
+        if order_id not in user_orders:
+            user_orders.append(order_id)
+
+
+_order_index = _OrderIndex()
+
+
+def _empty_wallet_state(user_id: str) -> dict:
+    """尚无任何事件的钱包状态：seq 为已折叠的事件数。"""
+    return {
+        "wallet": Wallet(user_id=user_id, balance=0, owned_deck_ids=[]).model_dump(),
+        "seq": 0,
+    }
+
+
+def _apply_wallet_event(state: dict, event: dict):
+    """把一条账本事件折叠进钱包状态（就地修改）。"""
+    wallet = state["wallet"]
+    wallet["balance"] += event.get("amount", 0)
+    kind = event["type"]
+    if kind == "grant":
+        if "owned_deck_ids" in event:
+            wallet["owned_deck_ids"] = list(event["owned_deck_ids"])
+        if "active_deck_id" in event:
+            wallet["active_deck_id"] = event["active_deck_id"]
+    elif kind == "purchase":
+        if event["deck_id"] not in wallet["owned_deck_ids"]:
+            wallet["owned_deck_ids"].append(event["deck_id"])
+    elif kind == "set_active":
+        wallet["active_deck_id"] = event["deck_id"]
+    state.pop("credited_orders", None)  # 旧版状态里的已入账订单列表，改为查账本后不再保存
+    wallet["updated_at"] = event["at"]
+    state["seq"] = event["seq"] + 1
+
+
+def _ledger_paths(user_id: str) -> Tuple[Path, Path]:
+    """(余额快照, 账本) 路径；文件名取 user_id 的 md5，避免特殊字符进入路径。"""
+    name = hashlib.md5(user_id.encode("utf-8")).hexdigest()
+    return WALLET_LEDGER_DIR / f"{name}.json", WALLET_LEDGER_DIR / f"{name}.jsonl"
+
+
+async def _load_wallet_entry(user_id: str) -> Optional[dict]:
+    """读取钱包（快照 + 账本尾部折叠），命中缓存时不读盘。
+    返回缓存本体 {"state", "offset": 已折叠到的账本字节数, "since_snapshot"}；无账本返回 None。"""
+    snapshot, ledger = _ledger_paths(user_id)
+    stamp = (file_stamp(snapshot), file_stamp(ledger))
+    if stamp == (None, None):
+        return None
+
+    key = f"wallet:{user_id}"
+    entry = _cache.get(key, stamp)
+    if entry is not None:
+        return entry
+
+    state, offset = _empty_wallet_state(user_id), 0
+    if stamp[0] is not None:
+        async with aiofiles.open(snapshot, "r", encoding="utf-8") as f:
+            saved = json.loads(await f.read())
+        state, offset = saved["state"], saved["offset"]
+
+    folded = 0
+    if stamp[1] is not None:
+        async with aiofiles.open(ledger, "rb") as f:
+            await f.seek(offset)
+            tail = await f.read()
+        for raw in tail.splitlines(keepends=True):
+            if not raw.endswith(b"\n"):
+                break  # 崩溃时留下的半行：不折叠，下次追加前截掉
+            try:
+                event = json.loads(raw)
+            except json.JSONDecodeError:
+                break
+            offset += len(raw)
+            if event["seq"] < state["seq"]:
+                continue
+            _apply_wallet_event(state, event)
+            folded += 1
+
+    entry = {"state": state, "offset": offset, "since_snapshot": folded}
+    _cache.put(key, stamp, entry)
+    return entry
+
+
+def _append_wallet_event(user_id: str, entry: Optional[dict], event: dict) -> dict:
+    """同步追加一条事件并更新内存状态，返回新的缓存条目。
+    调用方在 await 读取 entry 之后直接调用（中间不再 await），同进程内不会交错。"""
+    snapshot, ledger = _ledger_paths(user_id)
+    if entry is None:
+        entry = {"state": _empty_wallet_state(user_id), "offset": 0, "since_snapshot": 0}
+    state = entry["state"]
+    event = {**event, "seq": state["seq"], "at": datetime.utcnow().isoformat()}
+    line = (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+
+    WALLET_LEDGER_DIR.mkdir(parents=True, exist_ok=True)
+    if ledger.exists() and os.path.getsize(ledger) > entry["offset"]:
+        os.truncate(ledger, entry["offset"])  # 截掉未折叠的半行，新记录从整行边界开始
+    with open(ledger, "ab") as f:
+        f.write(line)
+    _apply_wallet_event(state, event)
+    entry["offset"] += len(line)
+    entry["since_snapshot"] += 1
+
+    if entry["since_snapshot"] >= WALLET_SNAPSHOT_EVERY:
+        tmp = snapshot.with_name(snapshot.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"state": state, "offset": entry["offset"]}, f, ensure_ascii=False)
+        os.replace(tmp, snapshot)
+        entry["since_snapshot"] = 0
+
+    _cache.put(f"wallet:{user_id}", (file_stamp(snapshot), file_stamp(ledger)), entry)
+    return entry
+
+
+async def _ledger_has_order(user_id: str, order_id: str) -> bool:
+    """该用户账本里是否已有按 order_id 入账的事件（充值才会查，账本按字节先粗筛再逐行确认）。"""
+    ledger = _ledger_paths(user_id)[1]
+    if not ledger.exists():
+        return False
+    async with aiofiles.open(ledger, "rb") as f:
+        raw = await f.read()
+    needle = json.dumps(order_id, ensure_ascii=False).encode("utf-8")
+    if needle not in raw:
+        return False
+    for line in raw.splitlines():
+        if needle in line:
+            try:
+                if json.loads(line).get("order_id") == order_id:
+                    return True
+            except json.JSONDecodeError:
+                continue  # 崩溃留下的半行
+    return False
+
+
+async def _load_or_import_wallet_entry(user_id: str) -> Optional[dict]:
+    """读取钱包；账本不存在但旧版 wallets.json 里有该用户时，以一条 grant 事件导入。"""
+    entry = await _load_wallet_entry(user_id)
+    if entry is not None:
+        return entry
+    legacy = (await _read_json(WALLETS_FILE)).get(user_id)
+    if not legacy or _ledger_paths(user_id)[1].exists():
+        return await _load_wallet_entry(user_id)
+    return _append_wallet_event(user_id, None, {
+        "type": "grant",
+        "amount": legacy.get("balance", 0),
+        "owned_deck_ids": legacy.get("owned_deck_ids", []),
+        "active_deck_id": legacy.get("active_deck_id", "classic-rws"),
+        "reason": "import",
+    })
 
 
 class StoreStorage:
     """钱包与支付订单的持久化。"""
 
-    wallet_lock = _wallet_lock
-    order_lock = _order_lock
+    # 用法：async with StoreStorage.wallet_lock(user_id) / order_lock(order_id)
+    wallet_lock = _wallet_locks
+    order_lock = _order_locks
 
-    # ── 钱包 ───────────────────────────────────────────────
+    # ── 钱包（星尘账本） ─────────────────────────────────────
     @staticmethod
     async def get_wallet(user_id: str) -> Optional[Wallet]:
-        wallets = await _read_json(WALLETS_FILE)
-        data = wallets.get(user_id)
-        return Wallet(**data) if data else None
+        db = get_sqlite_backend()
+        if db:
+            state = await db.get_wallet_state(user_id)
+            return Wallet(**state["wallet"]) if state else None
+        entry = await _load_or_import_wallet_entry(user_id)
+        return Wallet(**entry["state"]["wallet"]) if entry else None
+
+    @staticmethod
+    async def append_wallet_event(user_id: str, event: dict) -> Tuple[Wallet, bool]:
+        """追加一条账本事件，返回 (最新钱包, 是否生效)。
+        带 order_id 且该订单已入账时不重复记账，返回 (当前钱包, False)。
+        调用方须持有 wallet_lock(user_id)。"""
+        order_id = event.get("order_id")
+        db = get_sqlite_backend()
+        if db:
+            # 读状态、查订单是否已入账、分配 seq、写入都在同一个写事务里
+            state, applied = await db.append_wallet_event(
+                user_id, {**event, "at": datetime.utcnow().isoformat()},
+                _apply_wallet_event, lambda: _empty_wallet_state(user_id),
+            )
+            return Wallet(**state["wallet"]), applied
+
+        if order_id and await _ledger_has_order(user_id, order_id):
+            entry = await _load_or_import_wallet_entry(user_id)
+            return Wallet(**entry["state"]["wallet"]), False
+        entry = await _load_or_import_wallet_entry(user_id)
+        entry = _append_wallet_event(user_id, entry, event)
+        return Wallet(**entry["state"]["wallet"]), True
 
     @staticmethod
-    async def save_wallet(wallet: Wallet):
-        wallets = await _read_json(WALLETS_FILE)
-        wallets[wallet.user_id] = wallet.model_dump()
-        await _write_json(WALLETS_FILE, wallets)
+    async def list_wallet_events(user_id: str, limit: int = 50) -> List[WalletLedgerEntry]:
+        """最近的账本事件，新的在前。"""
+        db = get_sqlite_backend()
+        if db:
+            return [WalletLedgerEntry(**e) for e in await db.list_wallet_events(user_id, limit)]
+        await _load_or_import_wallet_entry(user_id)
+        ledger = _ledger_paths(user_id)[1]
+        if not ledger.exists():
+            return []
+        async with aiofiles.open(ledger, "r", encoding="utf-8") as f:
+            lines = (await f.read()).splitlines()
+        events = []
+        for line in reversed(lines):
+            try:
+                events.append(WalletLedgerEntry(**json.loads(line)))
+            except (json.JSONDecodeError, ValueError):
+                continue
+            if len(events) >= limit:
+                break
+        return events
 
     # ── 支付订单 ────────────────────────────────────────────
     @staticmethod
     async def get_order(order_id: str) -> Optional[PaymentOrder]:
+        db = get_sqlite_backend()
+        if db:
+            data = await db.get_order(order_id)
+            return PaymentOrder(**data) if data else None
         orders = await _read_json(PAYMENT_ORDERS_FILE)
         data = orders.get(order_id)
         return PaymentOrder(**data) if data else None
 
     @staticmethod
     async def get_order_by_out_trade_no(out_trade_no: str) -> Optional[PaymentOrder]:
+        db = get_sqlite_backend()
+        if db:
+            data = await db.get_order_by_out_trade_no(out_trade_no)
+            return PaymentOrder(**data) if data else None
         orders = await _read_json(PAYMENT_ORDERS_FILE)
-        for data in orders.values():
-            if data.get("out_trade_no") == out_trade_no:
-                return PaymentOrder(**data)
-        return None
+        order_id = _order_index.sync(orders).by_out_trade_no.get(out_trade_no)
+        data = orders.get(order_id) if order_id else None
+        if not data or data.get("out_trade_no") != out_trade_no:
+            return None
+        return PaymentOrder(**data)
 
     @staticmethod
-    async def save_order(order: PaymentOrder):
+    async def list_user_orders(user_id: str) -> List[PaymentOrder]:
+        """该用户的全部订单，按创建时间倒序。"""
+        db = get_sqlite_backend()
+        if db:
+            return [PaymentOrder(**data) for data in await db.list_user_orders(user_id)]
         orders = await _read_json(PAYMENT_ORDERS_FILE)
-        orders[order.order_id] = order.model_dump()
-        await _write_json(PAYMENT_ORDERS_FILE, orders)
+        order_ids = _order_index.sync(orders).by_user.get(user_id, [])
+        user_orders = [PaymentOrder(**orders[oid]) for oid in order_ids if oid in orders]
+        user_orders.sort(key=lambda o: o.created_at, reverse=True)
+        return user_orders
+
+    @staticmethod
+    async def save_order(order: PaymentOrder):
+        db = get_sqlite_backend()
+        if db:
+            await db.save_order(order.model_dump())
+            return
+        async with _orders_file_lock:
+            orders = await _read_json(PAYMENT_ORDERS_FILE)
+            _order_index.sync(orders)
+            data = order.model_dump()
+            orders[order.order_id] = data
+            await _write_json(PAYMENT_ORDERS_FILE, orders)
+            _order_index.add(data)
@@ -1,11 +1,15 @@
 """钱包业务逻辑：初始发放、用星尘解锁牌组、应用牌组、充值入账。
 
 货币模型：人民币 —充值→ 星尘（✦）—解锁→ 牌组。
-所有「读-改-写」均在 StoreStorage.wallet_lock 下进行，保证扣款/入账原子。
+每次变动都是星尘账本里的一条事件（见 StoreStorage.append_wallet_event）。
+所有「读-判断-记账」均在该用户的 StoreStorage.wallet_lock(user_id) 下进行，保证扣款/入账原子；
+不同用户之间互不阻塞。
 """
 from __future__ import annotations
 
-from store_models import Wallet
+from typing import List, Optional
+
+from store_models import Wallet, WalletLedgerEntry
 from store_catalog import get_deck
 from services.store_storage import StoreStorage
 
@@ -20,28 +24,36 @@ NON_PURCHASABLE_STATES = {"coming-soon"}
 
 class WalletService:
     @staticmethod
-    def _seed_wallet(user_id: str) -> Wallet:
-        return Wallet(
-            user_id=user_id,
-            balance=SEED_BALANCE,
-            owned_deck_ids=list(SEED_OWNED),
-            active_deck_id=SEED_ACTIVE,
-        )
+    async def _load_or_seed(user_id: str) -> Wallet:
+        """读取钱包；尚无账本则记一笔种子发放。调用方须持有 wallet_lock(user_id)。"""
+        wallet = await StoreStorage.get_wallet(user_id)
+        if wallet is None:
+            wallet, applied = await StoreStorage.append_wallet_event(user_id, {
+                "type": "grant",
+                "amount": SEED_BALANCE,
+                "owned_deck_ids": list(SEED_OWNED),
+                "active_deck_id": SEED_ACTIVE,
+                "reason": "seed",
+            })
+            if not applied:
+                # 种子未记入账本：以账本里的当前状态为准
+                wallet = await StoreStorage.get_wallet(user_id) or wallet
+        return wallet
 
     @staticmethod
     async def get_or_create_wallet(user_id: str) -> Wallet:
         """获取钱包；不存在则按种子创建并持久化。"""
         wallet = await StoreStorage.get_wallet(user_id)
         if wallet is None:
-            wallet = WalletService._seed_wallet(user_id)
-            await StoreStorage.save_wallet(wallet)
+            async with StoreStorage.wallet_lock(user_id):
+                wallet = await WalletService._load_or_seed(user_id)
         return wallet
 
     @staticmethod
     async def purchase_deck(user_id: str, deck_id: str) -> tuple[bool, str | None, Wallet]:
         """用星尘解锁牌组。返回 (成功?, 失败原因, 最新钱包)。
 
-        失败原因：unknown_deck / not_purchasable / insufficient_balance。
+        失败原因：unknown_deck / not_purchasable / insufficient_balance / not_recorded（账本未记入该笔扣款）。
         已拥有则幂等返回成功。价格以服务端目录为准（绝不信任前端）。
         """
         deck = get_deck(deck_id)
@@ -49,8 +61,8 @@ class WalletService:
             wallet = await WalletService.get_or_create_wallet(user_id)
             return False, "unknown_deck", wallet
 
-        async with StoreStorage.wallet_lock:
-            wallet = await StoreStorage.get_wallet(user_id) or WalletService._seed_wallet(user_id)
+        async with StoreStorage.wallet_lock(user_id):
+            wallet = await WalletService._load_or_seed(user_id)
 
             if deck_id in wallet.owned_deck_ids:
                 return True, None, wallet  # 幂等
@@ -61,30 +73,44 @@ class WalletService:
             if wallet.balance < deck.price:
                 return False, "insufficient_balance", wallet
 
-            wallet.balance -= deck.price
-            wallet.owned_deck_ids.append(deck_id)
-            wallet.touch()
-            await StoreStorage.save_wallet(wallet)
+            wallet, applied = await StoreStorage.append_wallet_event(user_id, {
+                "type": "purchase", "amount": -deck.price, "deck_id": deck_id,
+            })
+            if not applied:
+                return False, "not_recorded", wallet
             return True, None, wallet
 
     @staticmethod
     async def set_active_deck(user_id: str, deck_id: str) -> tuple[bool, str | None, Wallet]:
-        """应用牌组到实际占卜。必须已拥有。返回 (成功?, 失败原因, 钱包)。"""
-        async with StoreStorage.wallet_lock:
-            wallet = await StoreStorage.get_wallet(user_id) or WalletService._seed_wallet(user_id)
+        """应用牌组到实际占卜。必须已拥有。返回 (成功?, 失败原因, 钱包)。
+
+        失败原因：not_owned / not_recorded（账本未记入该次切换）。
+        """
+        async with StoreStorage.wallet_lock(user_id):
+            wallet = await WalletService._load_or_seed(user_id)
             if deck_id not in wallet.owned_deck_ids:
                 return False, "not_owned", wallet
-            wallet.active_deck_id = deck_id
-            wallet.touch()
-            await StoreStorage.save_wallet(wallet)
+            if wallet.active_deck_id != deck_id:
+                wallet, applied = await StoreStorage.append_wallet_event(user_id, {
+                    "type": "set_active", "deck_id": deck_id,
+                })
+                if not applied:
+                    return False, "not_recorded", wallet
             return True, None, wallet
 
     @staticmethod
-    async def credit_stardust(user_id: str, amount: int) -> Wallet:
-        """给钱包入账星尘（充值成功后调用）。"""
-        async with StoreStorage.wallet_lock:
-            wallet = await StoreStorage.get_wallet(user_id) or WalletService._seed_wallet(user_id)
-            wallet.balance += amount
-            wallet.touch()
-            await StoreStorage.save_wallet(wallet)
+    async def credit_stardust(user_id: str, amount: int, order_id: Optional[str] = None) -> Wallet:
+        """给钱包入账星尘（充值成功后调用）。带 order_id 时按订单幂等，重复调用只入账一次。"""
+        async with StoreStorage.wallet_lock(user_id):
+            await WalletService._load_or_seed(user_id)
+            wallet, applied = await StoreStorage.append_wallet_event(user_id, {
+                "type": "credit", "amount": amount, "order_id": order_id,
+            })
+            if not applied:
+                print(f"[Wallet] 订单已入账，跳过: {order_id}")
             return wallet
+
+    @staticmethod
+    async def get_ledger(user_id: str, limit: int = 50) -> List[WalletLedgerEntry]:
+        """最近的星尘流水（新的在前）。"""
+        return await StoreStorage.list_wallet_events(user_id, limit)
@@ -21,6 +21,16 @@ class Wallet(BaseModel):
         self.updated_at = datetime.utcnow().isoformat()
 
 
+class WalletLedgerEntry(BaseModel):
+    """星尘账本中的一条事件（只追加，不修改）。"""
+    seq: int
+    type: str                      # grant | purchase | credit | set_active
+    amount: int = 0                # 星尘变动（购买为负）
+    deck_id: Optional[str] = None
+    order_id: Optional[str] = None  # 充值入账按订单号幂等
+    at: str
+
+
 # ── 支付 ────────────────────────────────────────────────────────────────────
 class PaymentProviderName(str, Enum):
     ALIPAY = "alipay"
@@ -2,3 +2,24 @@ import sys
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pytest
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    """StorageService 的全部文件指向 tmp_path，并换上空缓存；返回 tmp_path。"""
+    import services.storage_service as storage_module
+    from services.json_file_cache import JsonFileCache
+
+    monkeypatch.setattr(storage_module, "USERS_FILE", tmp_path / "users.json")
+    monkeypatch.setattr(storage_module, "USERNAME_INDEX_FILE", tmp_path / "username_index.json")
+    monkeypatch.setattr(storage_module, "_username_index_ready", False)
+    monkeypatch.setattr(storage_module, "CONVERSATIONS_FILE", tmp_path / "conversations.json")
+    monkeypatch.setattr(storage_module, "CONVERSATIONS_DIR", tmp_path / "conversations")
+    monkeypatch.setattr(storage_module, "CONVERSATION_INDEX_DIR", tmp_path / "conversation_index")
+    monkeypatch.setattr(storage_module, "_legacy_migrated", False)
+    monkeypatch.setattr(storage_module, "_index_ready", False)
+    monkeypatch.setattr(storage_module, "_cache", JsonFileCache())
+    monkeypatch.setattr(storage_module, "_conversation_cache", JsonFileCache())
+    return tmp_path
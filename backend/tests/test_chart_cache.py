@@ -0,0 +1,86 @@
+"""本命盘缓存：key 规范化、命中不再调星盘 API、落盘后重启仍命中、失败不缓存。"""
+import asyncio
+
+import pytest
+
+import config
+from services.astrology_service import AstrologyService
+from services.chart_cache import ChartCache, make_chart_key
+from services.sqlite_backend import close_sqlite_backend
+
+BIRTH = dict(birth_year=1995, birth_month=6, birth_day=1, birth_hour=8, birth_minute=30)
+CHART = {"planet": [{"code_name": "0", "sign": {"sign_chinese": "双子", "deg": 10, "min": 5}, "house_id": 11}],
+         "house": [{"house_id": 1, "sign": {"sign_chinese": "巨蟹", "deg": 2, "min": 0}}]}
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def api_calls(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "CHART_CACHE_DIR", tmp_path / "natal_charts")
+    ChartCache.clear_memory()
+    calls = []
+
+    async def fake_request(params, city):
+        calls.append(params["birthday"])
+        return None if params["birthday"].startswith("1900") else CHART
+
+    monkeypatch.setattr(AstrologyService, "_request_chart", staticmethod(fake_request))
+    yield calls
+    ChartCache.clear_memory()
+
+
+def test_key_normalisation():
+    params = AstrologyService._build_chart_params(city="上海", **BIRTH)
+    same = dict(params, latitude=float(params["latitude"]), access_token="other",
+                planets=list(reversed(params["planets"])), h_sys="a")
+    assert make_chart_key(params) == make_chart_key(same)
+    moved = dict(params, birthday="1995-06-01 08:31:00")
+    assert make_chart_key(params) != make_chart_key(moved)
+    assert make_chart_key(params) != make_chart_key(dict(params, h_sys="P"))
+
+
+def test_second_request_hits_cache(api_calls):
+    chart_data, text = run(AstrologyService.get_natal_chart_text(city="上海", **BIRTH))
+    assert chart_data == CHART and "出生地点：上海" in text
+    again = run(AstrologyService.get_natal_chart_text(city="上海", **BIRTH))
+    assert again == (chart_data, text)
+    assert run(AstrologyService.fetch_natal_chart(city="上海", **BIRTH)) == CHART
+    assert len(api_calls) == 1
+
+
+def test_cache_survives_restart_and_texts_per_city(api_calls):
+    run(AstrologyService.get_natal_chart_text(city="上海", **BIRTH))
+    ChartCache.clear_memory()  # 模拟进程重启
+    _, text = run(AstrologyService.get_natal_chart_text(city="上海", **BIRTH))
+    # 同一城市的不同写法：与北京同 key，共用星盘数据，但文本按填写的城市名分别生成
+    run(AstrologyService.get_natal_chart_text(city="北京", **BIRTH))
+    _, other = run(AstrologyService.get_natal_chart_text(city="北京市", **BIRTH))
+    assert "出生地点：北京市" in other
+    assert len(api_calls) == 2
+
+
+def test_changed_profile_is_a_new_key_and_failures_are_not_cached(api_calls):
+    run(AstrologyService.get_natal_chart_text(city="上海", **BIRTH))
+    run(AstrologyService.get_natal_chart_text(city="上海", **dict(BIRTH, birth_hour=9)))
+    assert len(api_calls) == 2
+
+    failed = dict(BIRTH, birth_year=1900)
+    assert run(AstrologyService.get_natal_chart_text(city="上海", **failed)) is None
+    assert run(AstrologyService.get_natal_chart_text(city="上海", **failed)) is None
+    assert len(api_calls) == 4
+
+
+def test_sqlite_backend(api_calls, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "STORAGE_BACKEND", "sqlite")
+    monkeypatch.setattr(config, "SQLITE_DB_FILE", tmp_path / "tarot.db")
+    try:
+        run(AstrologyService.get_natal_chart_text(city="上海", **BIRTH))
+        ChartCache.clear_memory()
+        assert run(AstrologyService.get_natal_chart_text(city="上海", **BIRTH))[0] == CHART
+        assert len(api_calls) == 1
+        assert not (tmp_path / "natal_charts").exists()
+    finally:
+        close_sqlite_backend()
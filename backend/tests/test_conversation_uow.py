@@ -0,0 +1,113 @@
+"""请求级对话工作单元：一次 /message 请求只读一次对话、流结束时一次落盘。"""
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from models import MessageRole, SessionType, User, UserType
+from services.conversation_service import ConversationService, ConversationUnitOfWork
+from services.storage_service import StorageService
+
+USER = User(user_id="user_1", user_type=UserType.REGISTERED, username="alice")
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def conversation(storage):
+    conv = run(ConversationService.create_conversation("user_1", SessionType.TAROT))
+    run(ConversationService.add_message(conv.conversation_id, MessageRole.ASSISTANT, "欢迎"))
+    return conv.conversation_id
+
+
+@pytest.fixture
+def client():
+    from dependencies import get_current_user
+    from main import app
+    app.dependency_overrides[get_current_user] = lambda: USER
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+
+class TestUnitOfWork:
+    def test_changes_stay_in_memory_until_flush(self, conversation):
+        uow = run(ConversationUnitOfWork.load(conversation))
+        uow.add_message(MessageRole.USER, "我的事业运如何")
+        uow.mark_cards_drawn()
+        assert len(run(StorageService.get_conversation(conversation)).messages) == 1
+
+        run(uow.flush())
+        stored = run(StorageService.get_conversation(conversation))
+        assert [m.content for m in stored.messages] == ["欢迎", "我的事业运如何"]
+        assert stored.title == "我的事业运如何"
+        assert stored.has_drawn_cards
+        assert not uow.dirty
+
+    def test_flush_fields_only(self, conversation):
+        uow = run(ConversationUnitOfWork.load(conversation))
+        uow.mark_cards_drawn()
+        run(uow.flush())
+        assert run(StorageService.get_conversation(conversation)).has_drawn_cards
+
+    def test_cancelled_flush_keeps_pending_changes(self, conversation):
+        uow = run(ConversationUnitOfWork.load(conversation))
+        uow.add_message(MessageRole.USER, "我的事业运如何")
+
+        async def slow_append(*args, **kwargs):
+            await asyncio.sleep(10)
+
+        async def cancel_mid_write():
+            with patch.object(StorageService, "append_messages", slow_append):
+                with pytest.raises(asyncio.TimeoutError):
+                    await asyncio.wait_for(uow.flush(), 0.01)
+
+        run(cancel_mid_write())
+        assert uow.dirty
+        run(uow.flush())
+        stored = run(StorageService.get_conversation(conversation))
+        assert [m.content for m in stored.messages] == ["欢迎", "我的事业运如何"]
+        assert not uow.dirty
+
+    def test_shielded_flush_finishes_and_is_not_repeated(self, conversation):
+        uow = run(ConversationUnitOfWork.load(conversation))
+        uow.add_message(MessageRole.USER, "我的事业运如何")
+        appends = AsyncMock(wraps=StorageService.append_messages)
+
+        async def main():
+            with patch.object(StorageService, "append_messages", appends):
+                with pytest.raises(asyncio.TimeoutError):
+                    await asyncio.wait_for(asyncio.shield(uow.flush()), 0)
+                uow.add_message(MessageRole.ASSISTANT, "牌面显示")
+                await uow.flush()  # 等被 shield 的写入完成，只追加剩下的那条
+
+        run(main())
+        assert appends.await_count == 2
+        stored = run(StorageService.get_conversation(conversation))
+        assert [m.content for m in stored.messages] == ["欢迎", "我的事业运如何", "牌面显示"]
+
+
+class TestMessageRoute:
+    def test_single_read_and_single_append(self, conversation, client):
+        async def fake_stream(messages, user, **kwargs):
+            assert messages[-1].content == "请帮我看看"
+            yield {"content": "牌面显示"}
+            yield {"content": "一切顺利"}
+            yield {"done": True}
+
+        reads = AsyncMock(wraps=StorageService.get_conversation)
+        appends = AsyncMock(wraps=StorageService.append_messages)
+        with patch("routers.tarot.gemini_service.stream_response", fake_stream), \
+                patch("routers.tarot.RateLimitService.check_and_consume", AsyncMock()), \
+                patch.object(StorageService, "get_conversation", reads), \
+                patch.object(StorageService, "append_messages", appends):
+            resp = client.post("/api/tarot/message", json={"conversation_id": conversation, "content": "请帮我看看"})
+            assert resp.status_code == 200
+            assert "[DONE]" in resp.text
+
+        assert reads.await_count == 1
+        assert appends.await_count == 1
+        stored = run(StorageService.get_conversation(conversation))
+        assert [m.content for m in stored.messages] == ["欢迎", "请帮我看看", "牌面显示一切顺利"]
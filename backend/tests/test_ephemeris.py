@@ -0,0 +1,80 @@
+"""本地离线星历：与参考星盘比对精度，输出结构可直接交给 format_chart_data_to_text。"""
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+
+import services.astrology_service as astrology_module
+from services import ephemeris
+from services.astrology_service import AstrologyService
+from services.chart_cache import ChartCache
+
+REFERENCE = json.loads((Path(__file__).parent / "data" / "reference_charts.json").read_text(encoding="utf-8"))
+# 角度容差（度）：近似根数下木星/土星误差最大；宫头取决于恒星时，最准
+TOLERANCE = {"5": 0.25, "6": 0.25}
+DEFAULT_TOLERANCE = 0.12
+HOUSE_TOLERANCE = 0.05
+
+
+def angle_diff(a: float, b: float) -> float:
+    return abs((a - b + 180) % 360 - 180)
+
+
+def params_of(ref, h_sys):
+    return {
+        "birthday": ref["birthday"], "tz": ref["tz"], "latitude": ref["latitude"], "longitude": ref["longitude"],
+        "h_sys": h_sys, "planets": AstrologyService.STANDARD_PLANETS, "virtual": AstrologyService.VIRTUAL_POINTS,
+    }
+
+
+@pytest.mark.parametrize("ref", REFERENCE["charts"], ids=lambda r: r["birthday"])
+def test_matches_reference_charts(ref):
+    for h_sys in ("P", "A"):
+        chart = ephemeris.natal_chart(params_of(ref, h_sys))
+        lons = {str(p["code_name"]): p["longitude"] for p in chart["planet"]}
+        for code, expected in ref["bodies"].items():
+            assert angle_diff(lons[code], expected) < TOLERANCE.get(code, DEFAULT_TOLERANCE), (h_sys, code)
+        cusps = [h["longitude"] for h in chart["house"]]
+        for got, expected in zip(cusps, ref["houses"][h_sys]):
+            assert angle_diff(got, expected) < HOUSE_TOLERANCE, h_sys
+        assert lons["10"] == cusps[0]
+
+
+def test_batch_equals_single():
+    params = [params_of(ref, "A") for ref in REFERENCE["charts"]]
+    assert ephemeris.natal_charts(params) == [ephemeris.natal_chart(p) for p in params]
+
+
+def test_chart_shape_is_drop_in():
+    ref = REFERENCE["charts"][0]
+    chart = ephemeris.natal_chart(params_of(ref, "A"))
+    sun = chart["planet"][0]
+    assert sun["code_name"] == 0 and sun["planet_chinese"] == "太阳"
+    assert set(sun["sign"]) >= {"sign_chinese", "deg", "min"} and 1 <= sun["house_id"] <= 12
+    assert [str(v["code_name"]) for v in chart["virtual"]] == ["10", "21"]
+    # 婚神星无离线根数，不返回
+    assert "H" not in [str(p["code_name"]) for p in chart["planet"]]
+
+    text = AstrologyService.format_chart_data_to_text(chart, {
+        "birth_year": 1949, "birth_month": 10, "birth_day": 1, "birth_hour": 15, "birth_minute": 0, "city": "北京",
+    })
+    for label in ("太阳：落在", "北交点：", "南交点：", "上升点：", "天顶 (MC)："):
+        assert label in text
+
+
+def test_local_provider_used_by_astrology_service(tmp_path, monkeypatch):
+    import config
+    monkeypatch.setattr(config, "CHART_CACHE_DIR", tmp_path / "natal_charts")
+    monkeypatch.setattr(astrology_module, "ASTROLOGY_PROVIDER", "local")
+    ChartCache.clear_memory()
+
+    async def no_http(*args, **kwargs):
+        raise AssertionError("本地星历模式不应调用星盘API")
+    monkeypatch.setattr(astrology_module.http_client, "post_json", no_http)
+
+    chart_data, text = asyncio.run(AstrologyService.get_natal_chart_text(
+        birth_year=1995, birth_month=6, birth_day=1, birth_hour=8, birth_minute=30, city="沈阳",
+    ))
+    assert "太阳：落在双子座" in text
+    ChartCache.clear_memory()
@@ -0,0 +1,101 @@
+"""内置城市库：名称/简称/拼音/海外城市解析、前缀补全排序、按出生日期的时区偏移、/cities 接口。"""
+import asyncio
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+from services.astrology_service import AstrologyService
+from services.gazetteer import gazetteer, normalise_key
+
+
+@pytest.mark.parametrize("text, label", [
+    ("北京", "北京市"),
+    ("北京市", "北京市"),
+    ("beijing", "北京市"),
+    ("北京朝阳", "北京市朝阳区"),
+    ("北京市朝阳区望京", "北京市朝阳区"),   # 取最长已知前缀
+    ("朝阳", "辽宁省朝阳市"),               # 同名取规模最大的
+    ("上海浦东", "上海市浦东新区"),
+    ("台北", "台湾台北"),
+    ("香港", "香港"),
+    ("东京", "Tokyo, JP"),
+    ("sao paulo", "São Paulo, BR"),
+    ("New York", "New York City, US"),
+    ("纽约", "New York City, US"),         # 中文译名（数据里是繁体「紐約」）
+    ("纽约市", "New York City, US"),
+    ("伦敦", "London, GB"),
+    ("臺北", "台湾台北"),                   # 繁体输入
+    ("臺北市", "台湾台北"),
+    ("华盛顿", "Washington, US"),           # zh_exonyms.tsv 补充的译名
+])
+def test_resolve(text, label):
+    assert gazetteer.resolve(text)["label"] == label
+
+
+def test_every_label_resolves_to_itself():
+    for i in range(0, len(gazetteer), 97):
+        label = gazetteer._labels[i]
+        assert gazetteer.resolve(label)["label"] == label
+
+
+def test_unknown_city_is_not_guessed():
+    assert gazetteer.resolve("不存在的地方") is None
+    # 拉丁字母短前缀不采用，避免误中拼音首字母简称
+    assert gazetteer.resolve("xyz不存在") is None
+    assert gazetteer.resolve("") is None
+
+
+def test_search_prefix_ordering():
+    labels = [c["label"] for c in gazetteer.search("北京", limit=5)]
+    assert labels[0] == "北京市" and len(labels) == 5
+    assert all("北京" in label for label in labels[1:])
+    # 拼音首字母、全角/大小写/空格不敏感
+    assert gazetteer.search("SZ")[0]["label"] == "广东省深圳市"
+    assert gazetteer.search("ｓｈａｎｇ ｈａｉ")[0]["label"] == "上海市"
+    assert gazetteer.search("") == []
+    assert gazetteer.search("qqqqqq") == []
+
+
+def test_normalise_key():
+    assert normalise_key(" São-Paulo ") == "saopaulo"
+    assert normalise_key("ＢＥＩＪＩＮＧ") == "beijing"
+    assert normalise_key("臺灣 紐約") == normalise_key("台湾纽约") == "台湾纽约"
+
+
+def test_offset_follows_birth_date():
+    beijing = gazetteer.resolve("北京")
+    # 1986–1991 年中国实行夏令时
+    assert gazetteer.utc_offset_hours(beijing, datetime(1988, 7, 1, 12)) == 9
+    assert gazetteer.utc_offset_hours(beijing, datetime(1995, 7, 1, 12)) == 8
+    new_york = gazetteer.resolve("New York")
+    assert gazetteer.utc_offset_hours(new_york, datetime(2000, 1, 1, 12)) == -5
+    assert gazetteer.utc_offset_hours(new_york, datetime(2000, 7, 1, 12)) == -4
+
+
+def test_chart_params_use_gazetteer():
+    params = AstrologyService._build_chart_params(1990, 1, 15, 8, 0, "Mumbai")
+    assert params["tz"] == "+5.5"
+    assert params["latitude"].startswith("19.") and params["longitude"].startswith("72.")
+    params = AstrologyService._build_chart_params(1990, 1, 15, 8, 0, "成都")
+    assert params["tz"] == "+8" and params["latitude"].startswith("30.")
+
+
+def test_unknown_city_fails_instead_of_falling_back(monkeypatch):
+    async def no_request(params, city):
+        raise AssertionError("无法识别的城市不应调用星盘API")
+
+    monkeypatch.setattr(AstrologyService, "_request_chart", staticmethod(no_request))
+    result = asyncio.run(AstrologyService.get_natal_chart_text(1990, 1, 15, 8, 0, city="不存在的地方"))
+    assert result is None
+
+
+def test_cities_endpoint():
+    from main import app
+    client = TestClient(app)
+    response = client.get("/api/astrology/cities", params={"prefix": "chengdu", "limit": 3})
+    assert response.status_code == 200
+    cities = response.json()["cities"]
+    assert cities[0]["label"] == "四川省成都市"
+    assert set(cities[0]) >= {"label", "name", "country", "latitude", "longitude", "tz"}
+    assert client.get("/api/astrology/cities", params={"prefix": ""}).status_code == 422
@@ -0,0 +1,172 @@
+"""GeminiService 真流式：文本块即到即转发、流中检测函数调用、记录 TTFT。"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import services.gemini_service as gemini_module
+from models import Message, MessageRole, SessionType
+from services.gemini_service import TTFT_METRIC, GeminiService
+from services.metrics import metrics
+from services.model_pool import ModelPool
+
+protos = gemini_module.genai.protos
+
+
+def text_chunk(text: str):
+    return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[protos.Part(text=text)]))])
+
+
+def call_chunk(name: str, args: dict):
+    part = protos.Part(function_call=protos.FunctionCall(name=name, args=args))
+    return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))])
+
+
+class FakeStream:
+    """按脚本产出 chunk；遇到 asyncio.Event 则等它被置位（用于验证调用方边收边转发）。"""
+
+    def __init__(self, items):
+        self.items = items
+
+    async def __aiter__(self):
+        for item in self.items:
+            if isinstance(item, asyncio.Event):
+                await asyncio.wait_for(item.wait(), timeout=1)
+            else:
+                yield item
+
+
+class FakeChat:
+    def __init__(self, turns):
+        self.turns = list(turns)
+        self.sent = []
+
+    async def send_message_async(self, content, stream=False):
+        assert stream is True
+        self.sent.append(content)
+        return FakeStream(self.turns.pop(0))
+
+
+@pytest.fixture
+def fake_chat(monkeypatch):
+    holder = {}
+
+    class FakeModel:
+        def __init__(self, **kwargs):
+            pass
+
+        def start_chat(self, history):
+            return holder["chat"]
+
+    monkeypatch.setattr(gemini_module.genai, "GenerativeModel", FakeModel)
+    monkeypatch.setattr(gemini_module, "model_pool", ModelPool())
+    metrics.reset()
+    return holder
+
+
+def collect(agen):
+    async def main():
+        return [event async for event in agen]
+    return asyncio.run(main())
+
+
+def test_text_is_forwarded_before_stream_ends(fake_chat):
+    async def main():
+        first_seen = asyncio.Event()
+        fake_chat["chat"] = FakeChat([[text_chunk("你好，"), first_seen, text_chunk("今天想问什么？")]])
+        events = []
+        async for event in GeminiService().stream_response([Message(role=MessageRole.USER, content="hi")]):
+            events.append(event)
+            if "content" in event:
+                first_seen.set()
+        return events
+
+    events = asyncio.run(main())
+    assert events == [{"content": "你好，"}, {"content": "今天想问什么？"}, {"done": True}]
+    assert metrics.get(TTFT_METRIC)["count"] == 1
+
+
+def test_function_call_detected_mid_stream_and_loop_continues(fake_chat):
+    chat = FakeChat([
+        [text_chunk("好的，"), call_chunk("draw_tarot_cards", {"card_count": 3})],
+        [text_chunk("第一张牌是星星。")],
+    ])
+    fake_chat["chat"] = chat
+    executed = []
+
+    async def executor(name, args):
+        executed.append((name, args))
+        return {"success": True}
+
+    events = collect(GeminiService().stream_response(
+        [Message(role=MessageRole.USER, content="抽牌")],
+        session_type=SessionType.TAROT, function_executor=executor,
+    ))
+    assert events == [
+        {"content": "好的，"},
+        {"function_call": {"name": "draw_tarot_cards", "args": {"card_count": 3}}},
+        {"content": "第一张牌是星星。"},
+        {"done": True},
+    ]
+    assert executed == [("draw_tarot_cards", {"card_count": 3})]
+    # 第二轮发回的是函数结果
+    assert chat.sent[1][0].function_response.name == "draw_tarot_cards"
+    assert metrics.get(TTFT_METRIC)["count"] == 2
+
+
+def test_continue_with_function_result_streams(fake_chat):
+    fake_chat["chat"] = FakeChat([[text_chunk("解读"), call_chunk("request_user_profile", {})]])
+    events = collect(GeminiService().continue_with_function_result(
+        [Message(role=MessageRole.USER, content="看星盘")],
+        function_name="get_astrology_chart", function_result={"success": True},
+    ))
+    assert events == [{"content": "解读"}, {"function_call": {"name": "request_user_profile", "args": {}}}]
+
+
+def test_multiple_function_calls_run_concurrently_in_one_round_trip(fake_chat):
+    chat = FakeChat([
+        [call_chunk("get_astrology_chart", {}), call_chunk("read_divination_notebook", {})],
+        [text_chunk("结合星盘与笔记……")],
+    ])
+    fake_chat["chat"] = chat
+    running, peak = [0], [0]
+
+    async def executor(name, args):
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+        await asyncio.sleep(0.02)
+        running[0] -= 1
+        return {"success": True, "tool": name}
+
+    events = collect(GeminiService().stream_response(
+        [Message(role=MessageRole.USER, content="看看星盘和以前的记录")], function_executor=executor,
+    ))
+    assert [e["function_call"]["name"] for e in events if "function_call" in e] == [
+        "get_astrology_chart", "read_divination_notebook",
+    ]
+    assert peak[0] == 2
+    # 两个结果在同一条消息里喂回，总共只有两次模型往返
+    assert len(chat.sent) == 2
+    assert [p.function_response.name for p in chat.sent[1]] == ["get_astrology_chart", "read_divination_notebook"]
+    assert events[-1] == {"done": True}
+
+
+def test_slow_tool_times_out_without_blocking_others(fake_chat, monkeypatch):
+    monkeypatch.setitem(GeminiService.TOOL_TIMEOUTS, "get_astrology_chart", 0.01)
+    chat = FakeChat([
+        [call_chunk("get_astrology_chart", {}), call_chunk("read_divination_notebook", {})],
+        [text_chunk("星盘暂时获取失败")],
+    ])
+    fake_chat["chat"] = chat
+
+    async def executor(name, args):
+        if name == "get_astrology_chart":
+            await asyncio.sleep(1)
+        return {"success": True}
+
+    collect(GeminiService().stream_response(
+        [Message(role=MessageRole.USER, content="看星盘")], function_executor=executor,
+    ))
+    chart, notebook = (p.function_response.response for p in chat.sent[1])
+    assert chart["success"] is False and "超时" in chart["error"]
+    assert notebook["success"] is True
@@ -0,0 +1,125 @@
+"""历史窗口：长对话按 token 预算裁剪，保留最近轮次与最新抽牌/星盘块，较早内容折叠为滚动摘要。"""
+import pytest
+
+import config
+import services.history_window as history_module
+from models import Message, MessageRole, TarotCard
+from services.gemini_service import GeminiService
+from services.history_window import HistoryWindower, estimate_tokens, message_tokens
+
+CHART = "[星盘数据]\n" + "太阳 白羊座 第10宫\n" * 200
+
+
+def long_conversation(turns: int, chart_at: int = 2, cards_at=(40, 120)):
+    messages = []
+    for t in range(turns):
+        messages.append(Message(role=MessageRole.USER, content=f"第{t}轮提问：" + "我最近的工作和感情怎么样" * 5,
+                                timestamp=f"t{t:04d}u"))
+        if t == chart_at:
+            messages.append(Message(role=MessageRole.SYSTEM, content=CHART, timestamp=f"t{t:04d}c"))
+        if t in cards_at:
+            messages.append(Message(
+                role=MessageRole.SYSTEM, content="", timestamp=f"t{t:04d}d",
+                tarot_cards=[TarotCard(card_id=t % 78, card_name=f"牌{t}", reversed=False)],
+            ))
+        messages.append(Message(role=MessageRole.ASSISTANT, content=f"第{t}轮解读：" + "星星指引你保持希望" * 20,
+                                timestamp=f"t{t:04d}a"))
+    return messages
+
+
+@pytest.fixture
+def windower(monkeypatch):
+    monkeypatch.setattr(config, "HISTORY_TOKEN_BUDGET", 4000)
+    monkeypatch.setattr(config, "HISTORY_RECENT_TURNS", 6)
+    monkeypatch.setattr(config, "HISTORY_SUMMARY_MAX_CHARS", 600)
+    monkeypatch.setattr(config, "HISTORY_SUMMARY_LINE_CHARS", 20)
+    return HistoryWindower()
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("你好世界") == 4
+    assert estimate_tokens("abcdefgh") == 2
+
+
+def test_short_conversation_is_untouched(windower):
+    messages = long_conversation(3, chart_at=-1, cards_at=())
+    kept, summary = windower.window(messages)
+    assert kept == messages and summary is None
+
+
+def test_long_conversation_fits_budget_and_keeps_blocks(windower):
+    messages = long_conversation(200)
+    kept, summary = windower.window(messages)
+
+    assert sum(message_tokens(m) for m in kept) <= config.HISTORY_TOKEN_BUDGET
+    # 最近 6 轮原样保留（末尾 12 条消息）
+    assert kept[-12:] == messages[-12:]
+    # 最新抽牌块（第 120 轮）与星盘块原样保留，旧抽牌块只进摘要
+    assert [m.content for m in kept if m.content.startswith("[星盘数据]")] == [CHART]
+    assert [m.tarot_cards[0].card_name for m in kept if m.tarot_cards] == ["牌120"]
+    assert "抽牌：牌40（正位）" not in summary  # 早期行已被滚动丢弃
+    assert len(summary) <= config.HISTORY_SUMMARY_MAX_CHARS
+    assert "第193轮" in summary  # 紧挨窗口之前的一轮在摘要末尾
+
+
+def test_recent_turns_shrink_when_budget_tight(windower, monkeypatch):
+    monkeypatch.setattr(config, "HISTORY_TOKEN_BUDGET", 400)
+    messages = long_conversation(50, chart_at=-1, cards_at=())
+    kept, summary = windower.window(messages)
+    assert kept == messages[-2:]  # 只剩最后一轮
+    assert summary
+
+
+def test_summary_is_rolled_incrementally(windower, monkeypatch):
+    calls = []
+    real_line = history_module._summary_line
+    monkeypatch.setattr(history_module, "_summary_line", lambda m, n: calls.append(m) or real_line(m, n))
+
+    messages = long_conversation(100, chart_at=-1, cards_at=())
+    windower.window(messages)
+    first = len(calls)
+    assert first == 2 * (100 - 6)
+
+    # 新增一轮后，只有新滑出窗口的一轮（2 条）需要摘要
+    messages += long_conversation(101, chart_at=-1, cards_at=())[-2:]
+    calls.clear()
+    windower.window(messages)
+    assert len(calls) == 2
+
+
+def test_summary_rebuilt_when_prefix_changes(windower):
+    messages = long_conversation(100, chart_at=-1, cards_at=())
+    _, before = windower.window(messages)
+    # 改动摘要覆盖范围内的最后一条消息 → 缓存失效重建
+    messages[2 * 94 - 1] = messages[2 * 94 - 1].model_copy(update={"content": "改过的解读"})
+    _, after = windower.window(messages)
+    assert after != before and after.endswith("占卜师：改过的解读")
+
+
+def test_summary_not_reused_across_edits_or_conversations(windower):
+    messages = long_conversation(100, chart_at=-1, cards_at=())
+    _, before = windower.window(messages)
+    # 改动摘要前缀中间的一条消息（首条、覆盖到的最后一条都没变）→ 不复用旧摘要
+    edited = 2 * 94 - 3
+    messages[edited] = messages[edited].model_copy(update={"content": "中间改过的解读"})
+    _, after = windower.window(messages)
+    assert "占卜师：中间改过的解读" in after and after != before
+
+    # 另一段对话开场白相同、后续不同：各自的摘要
+    other = long_conversation(100, chart_at=-1, cards_at=())
+    other[1:] = [m.model_copy(update={"content": "另一段对话" + m.content}) for m in other[1:]]
+    _, other_summary = windower.window(other)
+    assert "另一段对话" in other_summary
+    _, again = windower.window(messages)
+    assert again == after
+
+
+def test_formatted_messages_include_summary(monkeypatch):
+    monkeypatch.setattr(config, "HISTORY_TOKEN_BUDGET", 4000)
+    import services.gemini_service as gemini_module
+    monkeypatch.setattr(gemini_module, "history_windower", HistoryWindower())
+
+    formatted = GeminiService()._format_messages_for_gemini(long_conversation(200))
+    assert formatted[2]["parts"][0]["text"].startswith("[此前对话摘要]")
+    assert formatted[-1]["parts"][0]["text"].startswith("第199轮解读")
+    assert len(formatted) < 40
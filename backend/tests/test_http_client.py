@@ -0,0 +1,175 @@
+"""共享出站 HTTP 客户端：用本地桩服务器验证连接复用、5xx 重试与并发上限。"""
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+import config
+import services.astrology_service as astrology_module
+from services import http_client
+from services.astrology_service import AstrologyService
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class StubServer:
+    """记录每个请求来自哪个客户端端口（= 哪条 TCP 连接）的 keep-alive 桩服务器。"""
+
+    def __init__(self):
+        self.ports = []
+        self.failures = 0  # 先返回多少次 503
+        self.delay = 0.0
+        self.active = self.peak = 0
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with stub.lock:
+                    stub.ports.append(self.client_address[1])
+                    stub.active += 1
+                    stub.peak = max(stub.peak, stub.active)
+                    fail = stub.failures > 0
+                    stub.failures -= fail
+                time.sleep(stub.delay)
+                with stub.lock:
+                    stub.active -= 1
+                status = 503 if fail else 200
+                body = json.dumps({"code": 0, "data": {"planet": [], "house": []}}).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/natal"
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True,
+        )
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub():
+    with StubServer() as server:
+        yield server
+
+
+@pytest.fixture(autouse=True)
+def fast_retry(monkeypatch):
+    monkeypatch.setattr(config, "OUTBOUND_HTTP_RETRY_BACKOFF", 0.01)
+
+
+def test_shared_client_reuses_connection(stub):
+    async def scenario():
+        await http_client.start_http_client()
+        try:
+            for _ in range(5):
+                response = await http_client.post_json(stub.url, {"n": 1})
+                assert response.status_code == 200
+        finally:
+            await http_client.close_http_client()
+
+    run(scenario())
+    assert len(stub.ports) == 5
+    assert len(set(stub.ports)) == 1
+
+
+def test_client_per_request_opens_new_connections(stub):
+    # 对照：旧写法每次新建客户端，每个请求一条新连接
+    async def scenario():
+        for _ in range(3):
+            async with httpx.AsyncClient() as client:
+                await client.post(stub.url, json={"n": 1})
+
+    run(scenario())
+    assert len(set(stub.ports)) == 3
+
+
+def test_retries_server_errors(stub):
+    stub.failures = 2
+
+    async def scenario():
+        try:
+            return await http_client.post_json(stub.url, {}, retries=2)
+        finally:
+            await http_client.close_http_client()
+
+    assert run(scenario()).status_code == 200
+    assert len(stub.ports) == 3
+
+
+def test_gives_up_after_retries(stub):
+    stub.failures = 5
+
+    async def scenario():
+        try:
+            return await http_client.post_json(stub.url, {}, retries=1)
+        finally:
+            await http_client.close_http_client()
+
+    assert run(scenario()).status_code == 503
+    assert len(stub.ports) == 2
+
+
+
+def test_worst_case_covers_all_retries(monkeypatch):
+    from services.gemini_service import GeminiService
+    assert GeminiService.TOOL_TIMEOUTS["get_astrology_chart"] > http_client.worst_case_seconds()
+
+    monkeypatch.setattr(config, "OUTBOUND_HTTP_TIMEOUT", 30.0)
+    monkeypatch.setattr(config, "OUTBOUND_HTTP_RETRIES", 2)
+    monkeypatch.setattr(config, "OUTBOUND_HTTP_RETRY_BACKOFF", 0.5)
+    assert http_client.worst_case_seconds() == 30.0 * 3 + 0.5 + 1.0
+    assert http_client.worst_case_seconds(retries=0) == 30.0
+
+def test_concurrency_limit(stub, monkeypatch):
+    monkeypatch.setattr(config, "OUTBOUND_HTTP_MAX_CONCURRENCY", 2)
+    stub.delay = 0.05
+
+    async def scenario():
+        try:
+            await asyncio.gather(*(http_client.post_json(stub.url, {}) for _ in range(6)))
+        finally:
+            await http_client.close_http_client()
+
+    run(scenario())
+    assert len(stub.ports) == 6
+    assert stub.peak <= 2
+
+
+def test_astrology_request_uses_shared_client(stub, monkeypatch):
+    monkeypatch.setattr(astrology_module, "ASTROLOGY_PROVIDER", "remote")
+    monkeypatch.setattr(astrology_module, "ASTROLOGY_API_URL", stub.url)
+    params = AstrologyService._build_chart_params(1990, 5, 20, 14, 30, "北京")
+
+    async def scenario():
+        await http_client.start_http_client()
+        try:
+            return [await AstrologyService._request_chart(params, "北京") for _ in range(3)]
+        finally:
+            await http_client.close_http_client()
+
+    charts = run(scenario())
+    assert charts == [{"planet": [], "house": []}] * 3
+    assert len(set(stub.ports)) == 1
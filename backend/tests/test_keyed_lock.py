@@ -0,0 +1,48 @@
+"""KeyedLock：同 key 串行、不同 key 并发、无人持有后自动回收。"""
+import asyncio
+import gc
+
+from services.keyed_lock import KeyedLock
+
+
+def test_same_key_serialises_other_keys_do_not():
+    locks = KeyedLock()
+    events = []
+
+    async def worker(key: str, tag: str):
+        async with locks(key):
+            events.append(f"{tag}+")
+            await asyncio.sleep(0.01)
+            events.append(f"{tag}-")
+
+    async def main():
+        await asyncio.gather(worker("u1", "a"), worker("u1", "b"), worker("u2", "c"))
+
+    asyncio.run(main())
+    # 同一用户的 a、b 不交错；另一用户的 c 在 a 持锁期间就已进入
+    assert events.index("a-") < events.index("b+")
+    assert events.index("c+") < events.index("a-")
+
+
+def test_locks_are_released_when_unused():
+    locks = KeyedLock()
+
+    async def main():
+        for i in range(100):
+            async with locks(f"user_{i}"):
+                pass
+
+    asyncio.run(main())
+    gc.collect()
+    assert len(locks) == 0
+
+
+def test_waiters_share_the_same_lock():
+    locks = KeyedLock()
+
+    async def main():
+        lock = locks("u1")
+        async with lock:
+            assert locks("u1") is lock
+
+    asyncio.run(main())
@@ -0,0 +1,34 @@
+"""ModelPool：同参数复用同一实例，参数不同则分别构建。"""
+from services.gemini_service import GeminiService
+from services.model_pool import ModelPool
+from models import SessionType
+
+
+def test_same_key_returns_same_model():
+    pool = ModelPool()
+    service = GeminiService()
+    first = pool.get("gemini-test", service.tarot_tools, service.generation_config)
+    # 配置 dict 换一个等值副本、工具集换同名声明的另一份，仍命中同一实例
+    again = pool.get("gemini-test", GeminiService().astrology_tools, dict(service.generation_config))
+    assert first is again
+    assert len(pool) == 1
+
+
+def test_different_config_or_tools_builds_new_model():
+    pool = ModelPool()
+    service = GeminiService()
+    base = pool.get("gemini-test", service.tarot_tools, service.generation_config)
+    assert pool.get("gemini-test", None, service.generation_config) is not base
+    assert pool.get("gemini-test", service.tarot_tools, {**service.generation_config, "temperature": 0.1}) is not base
+    assert pool.get("gemini-other", service.tarot_tools, service.generation_config) is not base
+    assert len(pool) == 4
+
+
+def test_warm_up_shares_one_model_across_session_types(monkeypatch):
+    import services.gemini_service as gemini_module
+    pool = ModelPool()
+    monkeypatch.setattr(gemini_module, "model_pool", pool)
+    service = GeminiService()
+    service.warm_up()
+    assert len(pool) == 1
+    assert service._get_model(SessionType.TAROT) is service._get_model(SessionType.ASTROLOGY)
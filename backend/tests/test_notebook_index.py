@@ -0,0 +1,183 @@
+"""占卜笔记检索：二字组分词、BM25 排序、写笔记时增量更新索引、外部改动后重建、token 上限。"""
+import asyncio
+import json
+
+import pytest
+
+from models import Conversation, Message, MessageRole, SessionType
+from services.history_window import estimate_tokens
+from services.notebook_index import NotebookIndex, tokenize
+from services.notebook_service import NotebookEntry, NotebookService
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_tokenize_bigrams_and_latin_words():
+    assert tokenize("工作机会") == ["工作", "作机", "机会"]
+    assert tokenize("爱") == ["爱"]
+    assert tokenize("The Tower，塔") == ["the", "tower", "塔"]
+
+
+def test_bm25_ranks_relevant_entries_first():
+    index = NotebookIndex()
+    index.upsert("job", ["我应该换工作吗", "换工作的时机还没到", "宝剑八"])
+    index.upsert("love", ["他还爱我吗", "感情正在回暖", "恋人"])
+    index.upsert("job2", ["新的工作机会怎么样", "机会不错", "星币八"])
+    ranked = [doc_id for _, doc_id in index.search("最近想换工作", top_k=3)]
+    assert ranked[:2] == ["job", "job2"]
+    assert "love" not in ranked
+    assert index.search("完全无关的词语", top_k=3) == []
+
+
+def test_upsert_replaces_and_remove_forgets():
+    index = NotebookIndex()
+    index.upsert("a", ["工作"])
+    index.upsert("a", ["感情"])
+    assert len(index) == 1
+    assert index.search("工作", 5) == []
+    assert index.search("感情", 5)[0][1] == "a"
+    index.remove("a")
+    assert "a" not in index and index.search("感情", 5) == []
+    index.remove("a")  # 重复删除无副作用
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setattr(NotebookService, "NOTEBOOK_DIR", tmp_path)
+    svc = NotebookService()
+
+    async def fake_summary(conversation, user=None, fallback=True):
+        return f"关于「{conversation.messages[0].content}」的解读", ["愚者"]
+
+    monkeypatch.setattr(svc, "generate_summary", fake_summary)
+    return svc
+
+
+def _conversation(conversation_id: str, question: str) -> Conversation:
+    return Conversation(
+        conversation_id=conversation_id,
+        user_id="u1",
+        session_type=SessionType.TAROT,
+        messages=[Message(role=MessageRole.USER, content=question)],
+    )
+
+
+def test_save_entry_updates_index_incrementally(service, monkeypatch):
+    run(service.generate_and_save_entry("u1", _conversation("c1", "我应该换工作吗")))
+    entries, total = service.search_entries("u1", "工作")
+    assert total == 1 and entries[0].conversation_id == "c1"
+
+    # 索引已建立：之后写笔记只增量更新，不再从磁盘重建
+    loads = []
+    original_load = service._load_notebook
+    monkeypatch.setattr(service, "_load_notebook", lambda uid: loads.append(uid) or original_load(uid))
+    run(service.generate_and_save_entry("u1", _conversation("c2", "他还爱我吗")))
+    assert loads == ["u1"]  # 只有 generate_and_save_entry 自己读了一次
+    entries, total = service.search_entries("u1", "爱我")
+    assert total == 2 and entries[0].conversation_id == "c2"
+    assert loads == ["u1"]
+
+
+def test_index_rebuilt_after_external_change(service):
+    run(service.generate_and_save_entry("u1", _conversation("c1", "我应该换工作吗")))
+    service.search_entries("u1", "工作")
+
+    path = service._get_notebook_path("u1")
+    data = json.loads(path.read_text(encoding="utf-8"))
+    data.append(NotebookEntry("c9", "2024-01-01T00:00:00", "搬家去上海好吗", ["世界"], "适合出发").to_dict())
+    path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+
+    entries, total = service.search_entries("u1", "搬家")
+    assert total == 2 and entries[0].conversation_id == "c9"
+
+    service.delete_notebook("u1")
+    assert service.search_entries("u1", "搬家") == ([], 0)
+
+
+def test_read_for_tool_returns_top_k_under_token_cap(service):
+    entries = [
+        NotebookEntry(f"c{i}", f"2024-01-{i + 1:02d}T00:00:00", f"第{i}次问财运", ["星币十"], "财运平稳。" * 20)
+        for i in range(20)
+    ]
+    entries.append(NotebookEntry("love", "2023-12-01T00:00:00", "他还爱我吗", ["恋人"], "感情回暖"))
+    service._save_notebook("u1", entries)
+
+    result = service.read_for_tool("u1", "他还爱我吗", token_cap=400)
+    assert result["notebook_count"] == 21
+    assert "【记录 1】" in result["notebook_content"] and "问题：他还爱我吗" in result["notebook_content"]
+
+    result = service.read_for_tool("u1", "财运", token_cap=400)
+    assert 1 <= result["returned_count"] < 5
+    body = result["notebook_content"].split("\n\n", 1)[1]
+    assert estimate_tokens(body) <= 400
+
+    # 单条超出上限时截断该条
+    result = service.read_for_tool("u1", "财运", token_cap=30)
+    assert result["returned_count"] == 1
+    assert estimate_tokens(result["notebook_content"].split("\n\n", 1)[1]) <= 30
+
+
+def test_read_for_tool_falls_back_to_recent_entries(service):
+    assert service.read_for_tool("u1", "工作")["notebook_count"] == 0
+    service._save_notebook("u1", [
+        NotebookEntry("old", "2023-01-01T00:00:00", "旧问题", [], "旧记录"),
+        NotebookEntry("new", "2024-06-01T00:00:00", "新问题", [], "新记录"),
+    ])
+    result = service.read_for_tool("u1", "毫不相干")
+    assert result["returned_count"] == 2
+    assert result["notebook_content"].index("新问题") < result["notebook_content"].index("旧问题")
+
+
+def test_tool_query_combines_args_and_latest_user_message():
+    conversation = _conversation("c1", "最早的问题")
+    conversation.messages.append(Message(role=MessageRole.ASSISTANT, content="回答"))
+    conversation.messages.append(Message(role=MessageRole.USER, content="那工作呢"))
+    query = NotebookService.tool_query(conversation, {"reason": "回顾", "query": "宝剑八"})
+    assert "宝剑八" in query and "那工作呢" in query and "最早的问题" not in query
+    assert "回顾" not in query
+
+
+def test_generic_reason_does_not_change_ranking(service):
+    service._save_notebook("u1", [
+        NotebookEntry("job", "2024-01-01T00:00:00", "我应该换工作吗", ["宝剑八"], "换工作的时机还没到"),
+        NotebookEntry("review", "2024-02-01T00:00:00", "想回顾一下之前的占卜", ["隐士"], "回顾过去的占卜记录"),
+        NotebookEntry("love", "2024-03-01T00:00:00", "他还爱我吗", ["恋人"], "感情回暖"),
+    ])
+    conversation = _conversation("c1", "最近还是想换工作")
+    plain = NotebookService.tool_query(conversation, {})
+    with_reason = NotebookService.tool_query(conversation, {"reason": "用户想回顾之前的占卜记录"})
+    assert with_reason == plain
+    entries, _ = service.search_entries("u1", with_reason)
+    assert [e.conversation_id for e in entries] == ["job"]
+
+
+def test_concurrent_entries_for_one_user_are_all_saved(service, monkeypatch):
+    async def slow_summary(conversation, user=None, fallback=True):
+        await asyncio.sleep(0.01)
+        return f"关于「{conversation.messages[0].content}」的解读", ["愚者"]
+
+    monkeypatch.setattr(service, "generate_summary", slow_summary)
+
+    async def main():
+        await asyncio.gather(*(
+            service.generate_and_save_entry("u1", _conversation(f"c{i}", f"第{i}个问题")) for i in range(6)
+        ))
+
+    run(main())
+    assert sorted(e["conversation_id"] for e in service.get_notebook("u1")) == sorted(f"c{i}" for i in range(6))
+    entries, total = service.search_entries("u1", "问题")
+    assert total == 6
+
+
+def test_upsert_under_file_lock_from_many_threads(service):
+    """多个写者（模拟多进程，各自持文件锁）同时读-改-写同一用户的笔记本，条目一条不丢。"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    def write(i):
+        service._upsert_entry("u1", NotebookEntry(f"c{i}", "2024-01-01T00:00:00", f"问题{i}", [], "摘要"))
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(write, range(24)))
+    assert len(service.get_notebook("u1")) == 24
@@ -0,0 +1,487 @@
+"""笔记定时任务：按到期时间堆准时调度、worker 池并发处理、超时、失败退避重试与放弃、队列/吞吐指标、
+日志持久化与崩溃恢复、多进程租约认领。"""
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+from datetime import datetime, timedelta
+
+import pytest
+
+import services.notebook_task_scheduler as scheduler_module
+from services.metrics import metrics
+from services.notebook_task_scheduler import NotebookTask, NotebookTaskScheduler
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def scheduler(tmp_path, monkeypatch):
+    """全新的调度器实例（任务文件在 tmp_path），不影响全局单例。"""
+    monkeypatch.setattr(NotebookTaskScheduler, "_instance", None)
+    monkeypatch.setattr(scheduler_module, "DATA_DIR", tmp_path)
+    monkeypatch.setattr(scheduler_module, "NOTEBOOK_TASK_RETRY_BACKOFF", 0.0)
+    monkeypatch.setattr(scheduler_module, "NOTEBOOK_TASK_TIMEOUT_SECONDS", 1.0)
+    metrics.reset()
+    s = NotebookTaskScheduler()
+    s.concurrency = 4
+    return s
+
+
+def _due_task(conversation_id: str, attempts: int = 0, delay: timedelta = timedelta(minutes=-1)) -> NotebookTask:
+    scheduled = (datetime.utcnow() + delay).isoformat()
+    return NotebookTask(conversation_id, "u1", scheduled, scheduled, attempts)
+
+
+def _set_tasks(s: NotebookTaskScheduler, *tasks: NotebookTask):
+    s.tasks = {task.conversation_id: task for task in tasks}
+    s._rebuild_heap()
+
+
+async def _drain(s: NotebookTaskScheduler, timeout: float = 3.0):
+    """启动 worker，等到没有到期任务（处理完、或已改期到将来），然后停止。"""
+    await s.start_worker()
+    try:
+        deadline = time.monotonic() + timeout
+        while any(datetime.fromisoformat(t.scheduled_time) <= datetime.utcnow() for t in s.tasks.values()):
+            assert time.monotonic() < deadline, "到期任务未处理完"
+            await asyncio.sleep(0.005)
+    finally:
+        await s.stop_worker()
+
+
+def test_due_tasks_run_concurrently_up_to_limit(scheduler, monkeypatch):
+    state = {"running": 0, "peak": 0, "done": []}
+
+    async def process(task, fallback=True):
+        state["running"] += 1
+        state["peak"] = max(state["peak"], state["running"])
+        await asyncio.sleep(0.02)
+        state["running"] -= 1
+        state["done"].append(task.conversation_id)
+
+    monkeypatch.setattr(scheduler, "_process_task", process)
+    _set_tasks(scheduler, *(_due_task(f"c{i}") for i in range(10)), _due_task("later", delay=timedelta(hours=1)))
+
+    run(_drain(scheduler))
+
+    assert sorted(state["done"]) == sorted(f"c{i}" for i in range(10))
+    assert state["peak"] == 4
+    assert list(scheduler.tasks) == ["later"]
+    assert metrics.get_counter(scheduler_module.TASK_COMPLETED_METRIC)["count"] == 10
+    assert metrics.get(scheduler_module.TASK_DURATION_METRIC)["count"] == 10
+    snapshot = metrics.snapshot()
+    assert snapshot["notebook_tasks_pending"] == {"value": 1}
+    assert snapshot[scheduler_module.TASK_COMPLETED_METRIC]["per_min"] == 10
+
+
+def test_failed_task_retries_then_falls_back(scheduler, monkeypatch):
+    calls = []
+
+    async def process(task, fallback=True):
+        calls.append(fallback)
+        if not fallback:
+            raise RuntimeError("LLM 不可用")
+
+    monkeypatch.setattr(scheduler_module, "NOTEBOOK_TASK_MAX_ATTEMPTS", 3)
+    monkeypatch.setattr(scheduler, "_process_task", process)
+    _set_tasks(scheduler, _due_task("c1"))
+
+    run(_drain(scheduler))
+
+    # 前两次要求真实摘要（失败后重新排期），最后一次允许默认摘要并成功
+    assert calls == [False, False, True]
+    assert scheduler.tasks == {}
+    assert metrics.get_counter(scheduler_module.TASK_RETRIED_METRIC)["count"] == 2
+    assert metrics.get_counter(scheduler_module.TASK_COMPLETED_METRIC)["count"] == 1
+
+
+def test_retry_is_persisted_with_backoff(scheduler, monkeypatch):
+    async def process(task, fallback=True):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(scheduler_module, "NOTEBOOK_TASK_RETRY_BACKOFF", 60.0)
+    monkeypatch.setattr(scheduler, "_process_task", process)
+    _set_tasks(scheduler, _due_task("c1"))
+
+    run(_drain(scheduler))
+
+    task = scheduler.tasks["c1"]
+    assert task.attempts == 1
+    delay = datetime.fromisoformat(task.scheduled_time) - datetime.utcnow()
+    assert timedelta(seconds=50) < delay <= timedelta(seconds=60)
+    # 旧格式（没有 attempts 字段）的任务文件也能加载
+    scheduler._load_tasks()
+    assert scheduler.tasks["c1"].attempts == 1
+    assert NotebookTask.from_dict({"conversation_id": "x", "user_id": "u", "scheduled_time": "t", "created_at": "t"}).attempts == 0
+
+
+def test_timeout_counts_as_failure_and_gives_up(scheduler, monkeypatch):
+    async def hang(task, fallback=True):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(scheduler_module, "NOTEBOOK_TASK_TIMEOUT_SECONDS", 0.02)
+    monkeypatch.setattr(scheduler_module, "NOTEBOOK_TASK_MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(scheduler, "_process_task", hang)
+    _set_tasks(scheduler, _due_task("c1", attempts=1))
+
+    run(_drain(scheduler))
+
+    assert scheduler.tasks == {}
+    assert metrics.get_counter(scheduler_module.TASK_FAILED_METRIC)["count"] == 1
+
+
+def test_stop_keeps_in_flight_task_for_next_start(scheduler, monkeypatch):
+    async def main():
+        entered = asyncio.Event()
+
+        async def slow(task, fallback=True):
+            entered.set()
+            await asyncio.sleep(10)
+
+        monkeypatch.setattr(scheduler, "_process_task", slow)
+        _set_tasks(scheduler, _due_task("c1"))
+        await scheduler.start_worker()
+        await entered.wait()
+        await scheduler.stop_worker()
+
+    run(main())
+    assert list(scheduler.tasks) == ["c1"]
+    assert scheduler.tasks["c1"].attempts == 0
+
+
+def test_heap_claims_in_due_order_and_skips_removed(scheduler):
+    now = datetime.utcnow()
+    _set_tasks(scheduler, *(_due_task(f"c{i}", delay=timedelta(seconds=-i)) for i in range(5)))
+    run(scheduler.remove_task("c2"))
+    scheduler.tasks["c4"].scheduled_time = (now + timedelta(hours=1)).isoformat()
+    scheduler._schedule(scheduler.tasks["c4"])  # 改期：旧堆项失效
+
+    claimed = run(scheduler._claim_due(datetime.utcnow(), limit=10))
+    assert [t.conversation_id for t in claimed] == ["c3", "c1", "c0"]
+    assert all(t.lease_owner == scheduler.owner for t in claimed)
+    assert run(scheduler._claim_due(now, limit=10)) == []
+    # 下一个任务在 1 小时后：单次睡眠不超过上限
+    assert scheduler._seconds_until_next_due(now) == scheduler.MAX_SLEEP_SECONDS
+    assert scheduler._seconds_until_next_due(now + timedelta(hours=2)) == 0
+    assert "c4" in scheduler.tasks and "c2" not in scheduler.tasks
+
+
+def test_task_runs_on_time_and_earlier_task_wakes_loop(scheduler, monkeypatch):
+    done = {}
+
+    async def process(task, fallback=True):
+        done[task.conversation_id] = datetime.utcnow()
+
+    monkeypatch.setattr(scheduler, "_process_task", process)
+
+    async def main():
+        _set_tasks(scheduler, _due_task("later", delay=timedelta(hours=1)), _due_task("soon", delay=timedelta(milliseconds=50)))
+        await scheduler.start_worker()
+        await asyncio.sleep(0.2)
+        assert "soon" in done and "later" not in done
+
+        # 调度循环正睡向 1 小时后的任务；新增更早的任务应立即唤醒它
+        monkeypatch.setattr(NotebookTaskScheduler, "TASK_DELAY", timedelta(0))
+        assert await scheduler.add_task("now", "u1")
+        await asyncio.sleep(0.05)
+        await scheduler.stop_worker()
+
+    run(main())
+    assert "now" in done
+    assert list(scheduler.tasks) == ["later"]
+    assert run(scheduler.add_task("later", "u1")) is False
+
+
+def _reload() -> NotebookTaskScheduler:
+    """模拟重启：同一数据目录上新建调度器实例"""
+    NotebookTaskScheduler._instance = None
+    return NotebookTaskScheduler()
+
+
+def test_add_and_remove_only_append_journal(scheduler):
+    run(scheduler.add_task("c1", "u1"))
+    run(scheduler.add_task("c2", "u1"))
+    run(scheduler.remove_task("c1"))
+    run(scheduler.remove_task("missing"))
+
+    assert not scheduler.task_file.exists()
+    records = [json.loads(line) for line in scheduler.journal_file.read_text(encoding="utf-8").splitlines()]
+    assert [(r["seq"], r["op"]) for r in records] == [(0, "put"), (1, "put"), (2, "del")]
+
+    restarted = _reload()
+    assert list(restarted.tasks) == ["c2"]
+    # 启动时已把日志并入快照
+    assert not restarted.journal_file.exists()
+    assert json.loads(restarted.task_file.read_text(encoding="utf-8"))["seq"] == 3
+
+
+def test_journal_write_failure_is_reported_and_changes_nothing(scheduler, monkeypatch):
+    """写日志失败：add_task 返回 False 且任务表不变，认领失败时任务仍留在堆里；磁盘恢复后照常写入。"""
+    run(scheduler.add_task("c0", "u1"))
+
+    def disk_full(file, mode="r", *args, **kwargs):
+        if mode == "ab":
+            raise OSError(28, "No space left on device")
+        return open(file, mode, *args, **kwargs)
+
+    monkeypatch.setattr(scheduler_module, "open", disk_full, raising=False)
+
+    assert run(scheduler.add_task("c1", "u1")) is False
+    assert "c1" not in scheduler.tasks and "c1" not in scheduler._heap_entries
+    with pytest.raises(OSError):
+        run(scheduler.remove_task("c0"))
+    assert "c0" in scheduler.tasks
+    with pytest.raises(OSError):
+        run(scheduler._claim_due(datetime.utcnow() + timedelta(days=1), limit=1))
+    assert scheduler.tasks["c0"].lease_owner == "" and "c0" in scheduler._heap_entries
+
+    monkeypatch.delattr(scheduler_module, "open")
+    assert run(scheduler.add_task("c1", "u1"))
+    assert sorted(_reload().tasks) == ["c0", "c1"]
+
+
+def test_journal_compacts_periodically(scheduler, monkeypatch):
+    monkeypatch.setattr(scheduler_module, "NOTEBOOK_TASK_JOURNAL_COMPACT_EVERY", 4)
+    for i in range(10):
+        run(scheduler.add_task(f"c{i}", "u1"))
+    assert scheduler._journal_len == 2
+    snapshot = json.loads(scheduler.task_file.read_text(encoding="utf-8"))
+    assert snapshot["seq"] == 8 and len(snapshot["tasks"]) == 8
+    assert not scheduler.task_file.with_name(scheduler.task_file.name + ".tmp").exists()
+
+
+def test_recovery_skips_torn_line_and_folded_records(scheduler):
+    run(scheduler.add_task("c1", "u1"))
+    run(scheduler.add_task("c2", "u1"))
+    # 压实时在替换快照之后、清空日志之前崩溃：日志里只剩已并入快照的记录
+    journal = scheduler.journal_file.read_bytes()
+    scheduler._compact()
+    scheduler.journal_file.write_bytes(journal + b'{"op": "del", "conversation_id": "c1", "se')
+
+    restarted = _reload()
+    assert sorted(restarted.tasks) == ["c1", "c2"]
+    run(restarted.remove_task("c2"))
+    assert list(_reload().tasks) == ["c1"]
+
+
+def test_legacy_task_list_is_loaded(scheduler):
+    legacy = [_due_task("old", delay=timedelta(hours=1)).to_dict()]
+    del legacy[0]["attempts"]
+    scheduler.task_file.write_text(json.dumps(legacy, ensure_ascii=False, indent=2), encoding="utf-8")
+    restarted = _reload()
+    assert list(restarted.tasks) == ["old"]
+    run(restarted.add_task("new", "u1"))
+    assert list(_reload().tasks) == ["old", "new"]
+
+
+_WRITER = """
+import asyncio, sys
+from pathlib import Path
+import services.notebook_task_scheduler as m
+
+m.DATA_DIR = Path(sys.argv[1])
+m.NOTEBOOK_TASK_JOURNAL_COMPACT_EVERY = 7
+m.NotebookTaskScheduler._instance = None
+s = m.NotebookTaskScheduler()
+
+
+async def main():
+    i = int(sys.argv[2])
+    while True:
+        await s.add_task(f"c{i}", "u1")
+        if i % 3 == 0:
+            await s.remove_task(f"c{i}")
+        print("ack", i, flush=True)
+        i += 1
+
+asyncio.run(main())
+"""
+
+
+def test_killed_mid_write_loses_no_acknowledged_task(scheduler, tmp_path):
+    """子进程不停新增/移除任务（每 7 条压实一次），在随机时刻 SIGKILL；重启后已确认的操作都在，文件可读。"""
+    backend_dir = Path(__file__).resolve().parent.parent
+    next_id = 0
+    uncertain = set()  # 被杀时正在进行、未确认的操作
+    for round_no in range(5):
+        proc = subprocess.Popen(
+            [sys.executable, "-c", _WRITER, str(tmp_path), str(next_id)],
+            cwd=backend_dir, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+        )
+        acked = next_id - 1
+        target = next_id + 20 + round_no * 13
+        for line in proc.stdout:
+            if line.startswith("ack "):
+                acked = int(line.split()[1])
+                if acked >= target:
+                    break
+        os.kill(proc.pid, signal.SIGKILL)
+        for line in proc.stdout.read().splitlines():
+            if line.startswith("ack "):
+                acked = int(line.split()[1])
+        proc.wait()
+
+        restarted = _reload()
+        uncertain.add(acked + 1)
+        for i in set(range(acked + 1)) - uncertain:
+            assert (f"c{i}" in restarted.tasks) == (i % 3 != 0), f"round {round_no}: c{i}"
+        assert all(int(cid[1:]) <= acked + 1 for cid in restarted.tasks)
+        assert all(task.user_id == "u1" for task in restarted.tasks.values())
+        next_id = acked + 2
+
+
+def _seed_snapshot(s: NotebookTaskScheduler, count: int):
+    tasks = [_due_task(f"c{i}").to_dict() for i in range(count)]
+    s.task_file.write_text(json.dumps({"seq": 0, "tasks": tasks}), encoding="utf-8")
+
+
+def test_lease_blocks_other_process_until_expiry(scheduler):
+    _seed_snapshot(scheduler, 2)
+    a, b = _reload(), _reload()
+    assert a.owner != b.owner
+    now = datetime.utcnow()
+
+    assert sorted(t.conversation_id for t in run(a._claim_due(now, limit=10))) == ["c0", "c1"]
+    assert run(b._claim_due(now, limit=10)) == []
+    assert b.tasks["c0"].lease_owner == a.owner
+
+    # A 崩溃、不再续租：租约过期后 B 接手
+    later = now + timedelta(seconds=scheduler_module.NOTEBOOK_TASK_LEASE_SECONDS + 1)
+    assert len(run(b._claim_due(later, limit=10))) == 2
+
+    # A 恢复后的改期/放弃不会覆盖 B 的认领
+    run(a._retry_or_give_up(a.tasks["c0"], "旧租约"))
+    run(b._in_lock(lambda: None))
+    assert b.tasks["c0"].lease_owner == b.owner and b.tasks["c0"].attempts == 0
+
+
+def test_finished_task_is_kept_if_lease_was_taken_over(scheduler, monkeypatch):
+    """A 处理超过租约时长、任务已被 B 接手：A 处理完不删除任务，由 B 收尾。"""
+    _seed_snapshot(scheduler, 1)
+    a, b = _reload(), _reload()
+    now = datetime.utcnow()
+    [task] = run(a._claim_due(now, limit=1))
+    later = now + timedelta(seconds=scheduler_module.NOTEBOOK_TASK_LEASE_SECONDS + 1)
+    assert len(run(b._claim_due(later, limit=1))) == 1
+
+    async def process(task, fallback=True):
+        pass
+
+    monkeypatch.setattr(a, "_process_task", process)
+    run(a._run_task(task))
+    assert a.tasks["c0"].lease_owner == b.owner
+    assert "c0" in a._heap_entries  # 仍按 B 的租约排期，B 崩溃时可接手
+    run(b._in_lock(lambda: None))
+    assert "c0" in b.tasks
+    assert run(b.remove_task("c0", lease_owner=b.owner))
+    assert _reload().tasks == {}
+
+
+_HOLDER = """
+import fcntl, sys, time
+with open(sys.argv[1], "a") as f:
+    fcntl.flock(f, fcntl.LOCK_EX)
+    print("locked", flush=True)
+    time.sleep(float(sys.argv[2]))
+"""
+
+
+@pytest.mark.skipif(scheduler_module.fcntl is None, reason="需要 flock")
+def test_waiting_for_lock_does_not_stall_event_loop(scheduler):
+    """另一个进程持锁（如正在压实）时，add_task 等锁期间事件循环照常运行其他协程。"""
+    holder = subprocess.Popen(
+        [sys.executable, "-c", _HOLDER, str(scheduler.lock_file), "0.5"], stdout=subprocess.PIPE, text=True,
+    )
+    assert holder.stdout.readline().startswith("locked")
+
+    async def main():
+        ticks = []
+
+        async def heartbeat():
+            while True:
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+
+        beat = asyncio.create_task(heartbeat())
+        start = time.monotonic()
+        assert await scheduler.add_task("c1", "u1")
+        waited = time.monotonic() - start
+        beat.cancel()
+        await scheduler.stop_worker()
+        return waited, ticks
+
+    waited, ticks = run(main())
+    holder.wait(timeout=5)
+    assert waited >= 0.3  # 确实等到了子进程放锁
+    assert len(ticks) >= 20
+    assert max(b - a for a, b in zip(ticks, ticks[1:])) < 0.2
+    assert "c1" in _reload().tasks
+
+
+_WORKER = """
+import asyncio, os, sys, time
+from pathlib import Path
+import services.notebook_task_scheduler as m
+
+data_dir, out, go = Path(sys.argv[1]), Path(sys.argv[2]), Path(sys.argv[3])
+m.DATA_DIR = data_dir
+m.NotebookTaskScheduler._instance = None
+s = m.NotebookTaskScheduler()
+s.concurrency = 2
+
+
+async def process(task, fallback=True):
+    await asyncio.sleep(0.02)
+    with open(out, "a") as f:
+        f.write(f"{task.conversation_id} {os.getpid()}\\n")
+
+s._process_task = process
+
+
+async def main():
+    print("ready", flush=True)
+    while not go.exists():
+        await asyncio.sleep(0.01)
+    await s.start_worker()
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        if not await s._in_lock(lambda: bool(s.tasks)):
+            break
+        await asyncio.sleep(0.02)
+    await s.stop_worker()
+
+asyncio.run(main())
+"""
+
+
+def test_due_tasks_run_exactly_once_across_processes(scheduler, tmp_path):
+    """3 个进程共用同一任务文件：每个到期任务只被处理一次，且分散到多个进程。"""
+    _seed_snapshot(scheduler, 60)
+    out, go = tmp_path / "done.txt", tmp_path / "go"
+    backend_dir = Path(__file__).resolve().parent.parent
+    procs = [
+        subprocess.Popen(
+            [sys.executable, "-c", _WORKER, str(tmp_path), str(out), str(go)],
+            cwd=backend_dir, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+        )
+        for _ in range(3)
+    ]
+    for proc in procs:
+        assert any(line.startswith("ready") for line in iter(proc.stdout.readline, ""))  # 读到 ready 为止
+    go.touch()
+    for proc in procs:
+        proc.stdout.read()
+        assert proc.wait(timeout=20) == 0
+
+    lines = [line.split() for line in out.read_text().splitlines()]
+    done = sorted(cid for cid, _ in lines)
+    assert done == sorted(f"c{i}" for i in range(60))
+    assert len({pid for _, pid in lines}) > 1
+    assert _reload().tasks == {}
@@ -0,0 +1,115 @@
+"""按对话缓存已格式化的历史：只格式化新增消息，整体改写/删除对话后失效。"""
+import asyncio
+
+import pytest
+
+import services.gemini_service as gemini_module
+from models import Message, MessageRole, SessionType, TarotCard
+from services.conversation_service import ConversationService
+from services.gemini_service import GeminiService
+from services.prompt_cache import FormattedHistoryCache
+from services.storage_service import StorageService
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    fresh = FormattedHistoryCache()
+    monkeypatch.setattr(gemini_module, "formatted_history_cache", fresh)
+    import services.storage_service as storage_module
+    monkeypatch.setattr(storage_module, "formatted_history_cache", fresh)
+    return fresh
+
+
+@pytest.fixture
+def counting_service(monkeypatch):
+    service = GeminiService()
+    rendered = []
+    real = service._render_message
+    monkeypatch.setattr(service, "_render_message", lambda m: rendered.append(m) or real(m))
+    return service, rendered
+
+
+def make_conversation():
+    conv = run(ConversationService.create_conversation("user_1", SessionType.TAROT))
+    cid = conv.conversation_id
+    run(ConversationService.add_message(cid, MessageRole.ASSISTANT, "欢迎"))
+    run(ConversationService.add_message(cid, MessageRole.USER, "我的感情运势"))
+    run(ConversationService.add_message(
+        cid, MessageRole.SYSTEM, "", tarot_cards=[TarotCard(card_id=6, card_name="恋人", reversed=True)],
+    ))
+    run(ConversationService.add_message(cid, MessageRole.ASSISTANT, "恋人逆位提示……"))
+    return cid
+
+
+def test_only_new_messages_are_formatted(storage, cache, counting_service):
+    service, rendered = counting_service
+    cid = make_conversation()
+    messages = run(StorageService.get_conversation(cid)).messages
+
+    first = service._format_messages_for_gemini(messages, conversation_id=cid)
+    assert len(rendered) == 4
+    # 与不走缓存的全量格式化结果一致
+    assert first == GeminiService()._format_messages_for_gemini(messages)
+
+    run(ConversationService.add_message(cid, MessageRole.USER, "那我该怎么做"))
+    messages = run(StorageService.get_conversation(cid)).messages
+    rendered.clear()
+    second = service._format_messages_for_gemini(messages, conversation_id=cid)
+    assert rendered == [messages[-1]]
+    assert second[:len(first)] == first and second[-1]["parts"][0]["text"] == "那我该怎么做"
+
+
+def test_save_conversation_invalidates(storage, cache, counting_service):
+    service, rendered = counting_service
+    cid = make_conversation()
+    conversation = run(StorageService.get_conversation(cid))
+    service._format_messages_for_gemini(conversation.messages, conversation_id=cid)
+
+    # 改写最后一条消息（消息数不变）并整体保存：缓存失效，全量重新格式化
+    conversation.messages[-1] = conversation.messages[-1].model_copy(update={"content": "重新解读"})
+    run(StorageService.save_conversation(conversation))
+    rendered.clear()
+    formatted = service._format_messages_for_gemini(conversation.messages, conversation_id=cid)
+    assert len(rendered) == 4
+    assert formatted[-1]["parts"][0]["text"] == "重新解读"
+
+
+def test_delete_conversation_invalidates(storage, cache):
+    cid = make_conversation()
+    messages = run(StorageService.get_conversation(cid)).messages
+    GeminiService()._format_messages_for_gemini(messages, conversation_id=cid)
+    assert cid in cache._entries
+    run(ConversationService.delete_conversation(cid))
+    assert cid not in cache._entries
+
+
+def test_changed_prefix_detected_without_explicit_invalidation(cache, counting_service):
+    # 其他进程改了对话：前缀摘要不符 → 全量重建
+    service, rendered = counting_service
+    messages = [Message(role=MessageRole.USER, content="a"), Message(role=MessageRole.ASSISTANT, content="b")]
+    service._format_messages_for_gemini(messages, conversation_id="conv_x")
+    messages[-1] = messages[-1].model_copy(update={"content": "c"})
+    rendered.clear()
+    service._format_messages_for_gemini(messages, conversation_id="conv_x")
+    assert len(rendered) == 2
+
+
+def test_edit_before_last_cached_message_is_detected(cache, counting_service):
+    # 末条未变、更早的消息被改写：链式摘要覆盖整个前缀，同样全量重建
+    service, rendered = counting_service
+    messages = [
+        Message(role=MessageRole.USER, content="a"),
+        Message(role=MessageRole.ASSISTANT, content="b"),
+        Message(role=MessageRole.USER, content="c"),
+    ]
+    service._format_messages_for_gemini(messages, conversation_id="conv_y")
+    messages[0] = messages[0].model_copy(update={"content": "a2"})
+    messages.append(Message(role=MessageRole.ASSISTANT, content="d"))
+    rendered.clear()
+    formatted = service._format_messages_for_gemini(messages, conversation_id="conv_y")
+    assert len(rendered) == 4
+    assert formatted == GeminiService()._format_messages_for_gemini(messages)
@@ -0,0 +1,123 @@
+"""single-flight：同 key 并发只执行一次、失败传给所有等待者且不缓存；星盘获取按出生数据合并。"""
+import asyncio
+
+import pytest
+
+import config
+from services.astrology_service import AstrologyService, chart_fetch_flights
+from services.chart_cache import ChartCache
+from services.single_flight import SingleFlight
+
+BIRTH = dict(birth_year=1995, birth_month=6, birth_day=1, birth_hour=8, birth_minute=30)
+CHART = {"planet": [], "house": []}
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_concurrent_calls_share_one_execution():
+    flights = SingleFlight()
+    calls = []
+
+    async def fetch(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return f"result-{key}"
+
+    async def main():
+        return await asyncio.gather(*(flights.do(k, lambda k=k: fetch(k)) for k in ["a", "a", "a", "b"]))
+
+    assert run(main()) == ["result-a", "result-a", "result-a", "result-b"]
+    assert sorted(calls) == ["a", "b"]
+    assert len(flights) == 0
+
+
+def test_failure_propagates_to_all_and_is_not_cached():
+    flights = SingleFlight()
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("api down")
+
+    async def main():
+        results = await asyncio.gather(*(flights.do("k", failing) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+        # 失败后不留在途记录：下一次重新执行
+        with pytest.raises(RuntimeError):
+            await flights.do("k", failing)
+
+    run(main())
+    assert len(calls) == 2
+
+
+def test_cancelled_waiter_does_not_cancel_others():
+    flights = SingleFlight()
+
+    async def slow():
+        await asyncio.sleep(0.02)
+        return "ok"
+
+    async def main():
+        first = asyncio.create_task(flights.do("k", slow))
+        second = asyncio.create_task(flights.do("k", slow))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert run(main()) == "ok"
+
+
+@pytest.fixture
+def slow_api(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "CHART_CACHE_DIR", tmp_path / "natal_charts")
+    ChartCache.clear_memory()
+    state = {"calls": 0, "fail": False}
+
+    async def fake_request(params, city):
+        state["calls"] += 1
+        await asyncio.sleep(0.02)
+        return None if state["fail"] else CHART
+
+    monkeypatch.setattr(AstrologyService, "_request_chart", staticmethod(fake_request))
+    yield state
+    ChartCache.clear_memory()
+
+
+def test_duplicate_chart_requests_coalesce(slow_api):
+    async def main():
+        return await asyncio.gather(
+            AstrologyService.get_natal_chart_text(city="北京", **BIRTH),
+            AstrologyService.get_natal_chart_text(city="北京", **BIRTH),
+            AstrologyService.fetch_natal_chart(city="北京", **BIRTH),
+            # 同一城市的不同写法：同 key，同样合并，但文本按自己填写的城市名生成
+            AstrologyService.get_natal_chart_text(city="北京市", **BIRTH),
+        )
+
+    beijing, again, chart_data, other = run(main())
+    assert slow_api["calls"] == 1
+    assert beijing == again and chart_data == CHART
+    assert "出生地点：北京市" in other[1]
+    assert len(chart_fetch_flights) == 0
+
+    # 两个城市的文本都留在缓存里
+    ChartCache.clear_memory()
+    run(AstrologyService.get_natal_chart_text(city="北京", **BIRTH))
+    run(AstrologyService.get_natal_chart_text(city="北京市", **BIRTH))
+    assert slow_api["calls"] == 1
+
+
+def test_failed_chart_fetch_shared_but_not_cached(slow_api):
+    slow_api["fail"] = True
+
+    async def main():
+        return await asyncio.gather(*(AstrologyService.get_natal_chart_text(city="北京", **BIRTH) for _ in range(3)))
+
+    assert run(main()) == [None, None, None]
+    assert slow_api["calls"] == 1
+
+    slow_api["fail"] = False
+    assert run(AstrologyService.get_natal_chart_text(city="北京", **BIRTH)) is not None
+    assert slow_api["calls"] == 2
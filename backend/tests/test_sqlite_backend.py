@@ -0,0 +1,176 @@
+"""STORAGE_BACKEND=sqlite 时各 Service 的读写测试：数据库建在 tmp_path。"""
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import config
+from models import (
+    Conversation, DailyDrawRecord, Message, MessageRole, SessionType, TarotCard, User, UserType,
+)
+from services.daily_service import DailyService
+from services.rate_limit_service import RateLimitService
+from services.sqlite_backend import SqliteBackend, close_sqlite_backend
+from services.storage_service import StorageService
+from services.store_storage import StoreStorage
+from services.wallet_service import SEED_BALANCE, WalletService
+from store_models import PaymentOrder
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def sqlite_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "STORAGE_BACKEND", "sqlite")
+    monkeypatch.setattr(config, "SQLITE_DB_FILE", tmp_path / "tarot.db")
+    yield tmp_path / "tarot.db"
+    close_sqlite_backend()
+
+
+def make_conversation(conversation_id: str, user_id: str = "user_1", **kwargs) -> Conversation:
+    return Conversation(conversation_id=conversation_id, user_id=user_id, session_type=SessionType.TAROT, **kwargs)
+
+
+class TestSqliteStorageService:
+    def test_users(self, sqlite_db):
+        run(StorageService.save_user(User(user_id="user_1", user_type=UserType.REGISTERED, username="alice")))
+        assert run(StorageService.get_user("user_1")).username == "alice"
+        assert run(StorageService.get_user_by_username("alice")).user_id == "user_1"
+        run(StorageService.delete_user("user_1"))
+        assert run(StorageService.get_user("user_1")) is None
+        assert sqlite_db.exists()
+
+    def test_conversation_append_and_listing(self, sqlite_db):
+        run(StorageService.save_conversation(make_conversation("conv_a", updated_at="2026-01-01T00:00:00")))
+        run(StorageService.save_conversation(make_conversation("conv_b", updated_at="2026-01-02T00:00:00")))
+        run(StorageService.append_message(
+            "conv_a", Message(role=MessageRole.USER, content="你好"),
+            title="你好", updated_at="2026-01-03T00:00:00",
+        ))
+
+        conv = run(StorageService.get_conversation("conv_a"))
+        assert [m.content for m in conv.messages] == ["你好"]
+        assert conv.title == "你好"
+        listed = run(StorageService.get_user_conversations("user_1"))
+        assert [c.conversation_id for c in listed] == ["conv_a", "conv_b"]
+
+        # 整体保存（例如删掉最后一条消息）后以传入的消息列表为准
+        conv.messages = []
+        run(StorageService.save_conversation(conv))
+        assert run(StorageService.get_conversation("conv_a")).messages == []
+
+        run(StorageService.delete_user_conversations("user_1"))
+        assert run(StorageService.get_user_conversations("user_1")) == []
+
+    def test_summary_pagination(self, sqlite_db):
+        for i in range(3):
+            run(StorageService.save_conversation(
+                make_conversation(f"conv_{i}", updated_at=f"2026-01-0{i + 1}T00:00:00", title=f"t{i}")
+            ))
+        items, cursor = run(StorageService.list_user_conversation_summaries("user_1", limit=2))
+        assert [(s.conversation_id, s.title) for s in items] == [("conv_2", "t2"), ("conv_1", "t1")]
+        items, cursor = run(StorageService.list_user_conversation_summaries("user_1", limit=2, cursor=cursor))
+        assert [s.conversation_id for s in items] == ["conv_0"] and cursor is None
+
+    def test_append_to_missing_conversation_raises(self, sqlite_db):
+        with pytest.raises(ValueError):
+            run(StorageService.append_message("conv_missing", Message(role=MessageRole.USER, content="a")))
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_save_conversation_updates_edited_message(backend, storage, monkeypatch):
+    """整体保存时已有消息被改写（如编辑内容），两种后端读回来都应是新内容。"""
+    monkeypatch.setattr(config, "STORAGE_BACKEND", backend)
+    monkeypatch.setattr(config, "SQLITE_DB_FILE", storage / "tarot.db")
+    try:
+        conv = make_conversation("conv_e", updated_at="2026-01-01T00:00:00", messages=[
+            Message(role=MessageRole.USER, content="原问题"),
+            Message(role=MessageRole.ASSISTANT, content="原解读"),
+        ])
+        run(StorageService.save_conversation(conv))
+        conv.messages[0].content = "改过的问题"
+        conv.messages.append(Message(role=MessageRole.USER, content="追问"))
+        run(StorageService.save_conversation(conv))
+        loaded = run(StorageService.get_conversation("conv_e"))
+        assert [m.content for m in loaded.messages] == ["改过的问题", "原解读", "追问"]
+
+        conv.messages = conv.messages[:1]
+        conv.messages[0].content = "再改一次"
+        run(StorageService.save_conversation(conv))
+        assert [m.content for m in run(StorageService.get_conversation("conv_e")).messages] == ["再改一次"]
+    finally:
+        close_sqlite_backend()
+
+
+class TestSqliteOtherServices:
+    def test_wallet_and_orders(self, sqlite_db):
+        run(WalletService.credit_stardust("user_1", 30, order_id="ord_0"))
+        run(WalletService.credit_stardust("user_1", 30, order_id="ord_0"))
+        assert run(StoreStorage.get_wallet("user_1")).balance == SEED_BALANCE + 30
+        assert [e.type for e in run(WalletService.get_ledger("user_1"))] == ["credit", "grant"]
+
+        order = PaymentOrder(
+            order_id="ord_1", out_trade_no="T001", user_id="user_1", package_id="p1",
+            stardust=100, bonus=0, amount=600, provider="mock", method="qr",
+        )
+        run(StoreStorage.save_order(order))
+        assert run(StoreStorage.get_order("ord_1")).out_trade_no == "T001"
+        assert run(StoreStorage.get_order_by_out_trade_no("T001")).order_id == "ord_1"
+        assert run(StoreStorage.get_order_by_out_trade_no("T404")) is None
+        assert [o.order_id for o in run(StoreStorage.list_user_orders("user_1"))] == ["ord_1"]
+
+    def test_concurrent_wallet_writers_lose_no_event(self, sqlite_db):
+        """两个后端实例（相当于两个进程）同时给同一钱包记账：事件一条不丢，同一订单只入账一次。"""
+        from services.store_storage import _apply_wallet_event, _empty_wallet_state
+
+        backends = [SqliteBackend(sqlite_db), SqliteBackend(sqlite_db)]
+
+        async def credit(db, i, order_id=None):
+            _, applied = await db.append_wallet_event(
+                "user_1", {"type": "credit", "amount": 1, "order_id": order_id, "at": "2026-01-01T00:00:00"},
+                _apply_wallet_event, lambda: _empty_wallet_state("user_1"),
+            )
+            return applied
+
+        async def main():
+            plain = [credit(backends[i % 2], i) for i in range(40)]
+            dup = [credit(db, 0, order_id="ord_dup") for db in backends for _ in range(3)]
+            return await asyncio.gather(*plain, *dup)
+
+        try:
+            results = run(main())
+        finally:
+            for db in backends:
+                db.close()
+        assert all(results[:40]) and sum(results[40:]) == 1
+        state = run(StoreStorage.get_wallet("user_1"))
+        assert state.balance == 41
+        assert len(run(WalletService.get_ledger("user_1", limit=100))) == 41
+
+    def test_daily_records(self, sqlite_db):
+        record = DailyDrawRecord(
+            effective_date="2026-06-11",
+            card=TarotCard(card_id=17, card_name="星星 (The Star)", reversed=False),
+            conversation_id="conv_d",
+        )
+        run(DailyService.save_record("user_1", record))
+        assert set(run(DailyService.get_user_records("user_1"))) == {"2026-06-11"}
+
+        updated = run(DailyService.update_feedback("user_1", "2026-06-11", "hit", "准"))
+        assert updated.feedback.verdict == "hit"
+        assert run(DailyService.get_record("user_1", "2026-06-11")).feedback.note == "准"
+
+        run(DailyService.save_journey_cache("user_1", "2026-06-11", "旅程"))
+        assert run(DailyService.get_journey_cache("user_1"))["text"] == "旅程"
+
+    def test_rate_limit_counts_in_db(self, sqlite_db, monkeypatch):
+        import services.rate_limit_service as rate_limit_module
+        monkeypatch.setattr(rate_limit_module, "_limit_for", lambda user: 2)
+        user = User(user_id="guest_1", user_type=UserType.GUEST)
+        assert run(RateLimitService.check_and_consume(user))["used"] == 1
+        assert run(RateLimitService.check_and_consume(user))["used"] == 2
+        with pytest.raises(HTTPException) as exc:
+            run(RateLimitService.check_and_consume(user))
+        assert exc.value.status_code == 429
@@ -0,0 +1,284 @@
+"""StorageService 存储层测试：全部读写落在 tmp_path，不触碰 backend/data。"""
+import asyncio
+import json
+import os
+
+import pytest
+
+import services.storage_service as storage_module
+from models import Conversation, SessionType, User, UserType
+from services.storage_service import StorageService
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def make_user(user_id: str = "user_1", username: str = "alice") -> User:
+    return User(user_id=user_id, user_type=UserType.REGISTERED, username=username)
+
+
+class TestWriteThroughCache:
+    def test_round_trip(self, storage):
+        run(StorageService.save_user(make_user()))
+        user = run(StorageService.get_user("user_1"))
+        assert user is not None and user.username == "alice"
+        on_disk = json.loads((storage / "users.json").read_text(encoding="utf-8"))
+        assert on_disk["user_1"]["username"] == "alice"
+
+    def test_unchanged_file_is_not_reparsed(self, storage, monkeypatch):
+        run(StorageService.save_user(make_user()))
+        calls = []
+        real_loads = json.loads
+        monkeypatch.setattr(
+            "services.json_file_cache.json.loads",
+            lambda s: calls.append(1) or real_loads(s),
+        )
+        for _ in range(5):
+            assert run(StorageService.get_user("user_1")) is not None
+        assert calls == []
+
+    def test_external_change_is_reloaded(self, storage):
+        run(StorageService.save_user(make_user()))
+        assert run(StorageService.get_user("user_1")).username == "alice"
+
+        path = storage / "users.json"
+        data = json.loads(path.read_text(encoding="utf-8"))
+        data["user_1"]["username"] = "alice-renamed"
+        path.write_text(json.dumps(data), encoding="utf-8")
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+
+        assert run(StorageService.get_user("user_1")).username == "alice-renamed"
+
+    def test_deleted_file_reads_empty(self, storage):
+        run(StorageService.save_user(make_user()))
+        (storage / "users.json").unlink()
+        assert run(StorageService.get_user("user_1")) is None
+
+    def test_conversation_write_through(self, storage):
+        conv = Conversation(conversation_id="conv_1", user_id="user_1", session_type=SessionType.TAROT)
+        run(StorageService.save_conversation(conv))
+        conv.title = "改过的标题"
+        run(StorageService.save_conversation(conv))
+        assert run(StorageService.get_conversation("conv_1")).title == "改过的标题"
+        assert [c.conversation_id for c in run(StorageService.get_user_conversations("user_1"))] == ["conv_1"]
+
+
+class TestUsernameIndex:
+    def test_lookup_uses_index(self, storage):
+        run(StorageService.save_user(make_user("user_1", "alice")))
+        run(StorageService.save_user(make_user("user_2", "bob")))
+        index = json.loads((storage / "username_index.json").read_text(encoding="utf-8"))
+        assert index == {"alice": "user_1", "bob": "user_2"}
+        assert run(StorageService.get_user_by_username("bob")).user_id == "user_2"
+        assert run(StorageService.get_user_by_username("carol")) is None
+
+    def test_rename_and_delete_maintain_index(self, storage):
+        run(StorageService.save_user(make_user("user_1", "alice")))
+        run(StorageService.save_user(make_user("user_1", "alicia")))
+        assert run(StorageService.get_user_by_username("alice")) is None
+        assert run(StorageService.get_user_by_username("alicia")).user_id == "user_1"
+        run(StorageService.delete_user("user_1"))
+        assert run(StorageService.get_user_by_username("alicia")) is None
+
+    def test_missing_index_is_rebuilt(self, storage):
+        users = {"user_1": make_user("user_1", "alice").model_dump(mode="json")}
+        (storage / "users.json").write_text(json.dumps(users), encoding="utf-8")
+        assert run(StorageService.get_user_by_username("alice")).user_id == "user_1"
+        assert (storage / "username_index.json").exists()
+
+
+def make_conversation(conversation_id: str, user_id: str = "user_1", **kwargs) -> Conversation:
+    return Conversation(conversation_id=conversation_id, user_id=user_id, session_type=SessionType.TAROT, **kwargs)
+
+
+class TestShardedConversations:
+    def test_one_file_per_conversation(self, storage):
+        run(StorageService.save_conversation(make_conversation("conv_a")))
+        run(StorageService.save_conversation(make_conversation("conv_b")))
+        files = sorted(p.name for p in (storage / "conversations").glob("*/*.json"))
+        assert files == ["conv_a.json", "conv_b.json"]
+        assert not (storage / "conversations.json").exists()
+
+    def test_save_only_rewrites_own_shard(self, storage):
+        run(StorageService.save_conversation(make_conversation("conv_a")))
+        run(StorageService.save_conversation(make_conversation("conv_b")))
+        other = StorageService._conversation_path("conv_b")
+        before = os.stat(other).st_mtime_ns
+        run(StorageService.save_conversation(make_conversation("conv_a", title="新标题")))
+        assert os.stat(other).st_mtime_ns == before
+        assert run(StorageService.get_conversation("conv_a")).title == "新标题"
+
+    def test_user_listing_and_deletes(self, storage):
+        run(StorageService.save_conversation(make_conversation("conv_a", updated_at="2026-01-01T00:00:00")))
+        run(StorageService.save_conversation(make_conversation("conv_b", updated_at="2026-01-02T00:00:00")))
+        run(StorageService.save_conversation(make_conversation("conv_c", user_id="user_2")))
+        listed = run(StorageService.get_user_conversations("user_1"))
+        assert [c.conversation_id for c in listed] == ["conv_b", "conv_a"]
+
+        run(StorageService.delete_conversation("conv_b"))
+        assert run(StorageService.get_conversation("conv_b")) is None
+        run(StorageService.delete_user_conversations("user_1"))
+        assert run(StorageService.get_user_conversations("user_1")) == []
+        assert run(StorageService.get_conversation("conv_c")) is not None
+
+    def test_rejects_path_traversal_ids(self, storage):
+        assert StorageService._conversation_path("../users") is None
+        assert run(StorageService.get_conversation("../../users")) is None
+        with pytest.raises(ValueError):
+            run(StorageService.save_conversation(make_conversation("../evil")))
+
+    def test_migrates_legacy_single_file(self, storage):
+        legacy = {
+            cid: make_conversation(cid).model_dump()
+            for cid in ("conv_old1", "conv_old2")
+        }
+        (storage / "conversations.json").write_text(json.dumps(legacy), encoding="utf-8")
+
+        assert run(StorageService.migrate_legacy_conversations()) == 2
+        assert not (storage / "conversations.json").exists()
+        assert (storage / "conversations.json.migrated").exists()
+        assert run(StorageService.get_conversation("conv_old1")).user_id == "user_1"
+
+    def test_lazy_migration_on_first_access(self, storage):
+        legacy = {"conv_old": make_conversation("conv_old").model_dump()}
+        (storage / "conversations.json").write_text(json.dumps(legacy), encoding="utf-8")
+        assert run(StorageService.get_conversation("conv_old")) is not None
+
+
+class TestConversationJournal:
+    def _append(self, conversation_id: str, text: str, **fields):
+        from models import Message, MessageRole
+        run(StorageService.append_message(
+            conversation_id, Message(role=MessageRole.USER, content=text), **fields
+        ))
+
+    def test_append_writes_only_one_line(self, storage):
+        run(StorageService.save_conversation(make_conversation("conv_j")))
+        snapshot = StorageService._conversation_path("conv_j")
+        before = snapshot.read_bytes()
+
+        self._append("conv_j", "第一问", title="第一问", updated_at="2026-02-01T00:00:00")
+        self._append("conv_j", "第二问", updated_at="2026-02-02T00:00:00")
+
+        assert snapshot.read_bytes() == before
+        journal = StorageService._journal_path(snapshot)
+        assert len(journal.read_text(encoding="utf-8").splitlines()) == 2
+
+        conv = run(StorageService.get_conversation("conv_j"))
+        assert [m.content for m in conv.messages] == ["第一问", "第二问"]
+        assert conv.title == "第一问"
+        assert conv.updated_at == "2026-02-02T00:00:00"
+
+    def test_reads_fold_journal_from_disk(self, storage):
+        run(StorageService.save_conversation(make_conversation("conv_j")))
+        self._append("conv_j", "a")
+        self._append("conv_j", "b")
+        # 模拟进程重启：清空内存缓存后从快照 + 日志重新折叠
+        storage_module._conversation_cache.invalidate()
+        conv = run(StorageService.get_conversation("conv_j"))
+        assert [m.content for m in conv.messages] == ["a", "b"]
+
+    def test_compaction_folds_journal_into_snapshot(self, storage, monkeypatch):
+        monkeypatch.setattr(storage_module, "CONVERSATION_JOURNAL_COMPACT_EVERY", 3)
+        run(StorageService.save_conversation(make_conversation("conv_j")))
+        for i in range(4):
+            self._append("conv_j", f"m{i}")
+
+        snapshot = StorageService._conversation_path("conv_j")
+        on_disk = json.loads(snapshot.read_text(encoding="utf-8"))
+        assert [m["content"] for m in on_disk["messages"]] == ["m0", "m1", "m2"]
+        journal = StorageService._journal_path(snapshot)
+        assert len(journal.read_text(encoding="utf-8").splitlines()) == 1
+
+        storage_module._conversation_cache.invalidate()
+        conv = run(StorageService.get_conversation("conv_j"))
+        assert [m.content for m in conv.messages] == ["m0", "m1", "m2", "m3"]
+
+    def test_stale_records_and_torn_line_are_ignored(self, storage):
+        run(StorageService.save_conversation(make_conversation("conv_j")))
+        self._append("conv_j", "a")
+        # 模拟压实写完快照后、裁剪日志前崩溃：快照已含 "a"，日志里仍有 seq=0 的记录
+        run(StorageService.save_conversation(run(StorageService.get_conversation("conv_j"))))
+        snapshot = StorageService._conversation_path("conv_j")
+        journal = StorageService._journal_path(snapshot)
+        journal.write_text(
+            json.dumps({"seq": 0, "message": {"role": "user", "content": "a"}, "set": {}}) + "\n"
+            + '{"seq": 1, "message": {"ro',
+            encoding="utf-8",
+        )
+        storage_module._conversation_cache.invalidate()
+        conv = run(StorageService.get_conversation("conv_j"))
+        assert [m.content for m in conv.messages] == ["a"]
+
+    def test_delete_removes_journal(self, storage):
+        run(StorageService.save_conversation(make_conversation("conv_j")))
+        self._append("conv_j", "a")
+        journal = StorageService._journal_path(StorageService._conversation_path("conv_j"))
+        assert journal.exists()
+        run(StorageService.delete_conversation("conv_j"))
+        assert not journal.exists()
+        assert run(StorageService.get_conversation("conv_j")) is None
+
+    def test_append_to_missing_conversation_raises(self, storage):
+        with pytest.raises(ValueError):
+            self._append("conv_missing", "a")
+
+
+class TestConversationIndex:
+    def _append(self, conversation_id: str, text: str, **fields):
+        from models import Message, MessageRole
+        run(StorageService.append_message(
+            conversation_id, Message(role=MessageRole.USER, content=text), **fields
+        ))
+
+    def _page(self, user_id="user_1", limit=20, cursor=None):
+        return run(StorageService.list_user_conversation_summaries(user_id, limit=limit, cursor=cursor))
+
+    def test_cursor_pagination(self, storage):
+        for i in range(5):
+            run(StorageService.save_conversation(
+                make_conversation(f"conv_{i}", updated_at=f"2026-01-0{i + 1}T00:00:00")
+            ))
+        run(StorageService.save_conversation(make_conversation("conv_other", user_id="user_2")))
+
+        seen, cursor = [], None
+        while True:
+            items, cursor = self._page(limit=2, cursor=cursor)
+            seen += [s.conversation_id for s in items]
+            if cursor is None:
+                break
+        assert seen == ["conv_4", "conv_3", "conv_2", "conv_1", "conv_0"]
+
+    def test_summaries_do_not_load_messages(self, storage, monkeypatch):
+        run(StorageService.save_conversation(make_conversation("conv_a")))
+        self._append("conv_a", "第一问", title="第一问", updated_at="2026-03-01T00:00:00")
+        storage_module._conversation_cache.invalidate()
+
+        async def boom(*args, **kwargs):
+            raise AssertionError("列表不应加载对话")
+        monkeypatch.setattr(StorageService, "_load_conversation_entry", boom)
+        items, _ = self._page()
+        assert [(s.title, s.updated_at) for s in items] == [("第一问", "2026-03-01T00:00:00")]
+
+    def test_delete_updates_index(self, storage):
+        run(StorageService.save_conversation(make_conversation("conv_a")))
+        run(StorageService.save_conversation(make_conversation("conv_b")))
+        run(StorageService.delete_conversation("conv_a"))
+        assert [s.conversation_id for s in self._page()[0]] == ["conv_b"]
+        run(StorageService.delete_user_conversations("user_1"))
+        assert self._page()[0] == []
+
+    def test_missing_index_is_rebuilt(self, storage):
+        run(StorageService.save_conversation(make_conversation("conv_a")))
+        import shutil
+        shutil.rmtree(storage / "conversation_index")
+        storage_module._index_ready = False
+        storage_module._cache.invalidate()
+        assert [s.conversation_id for s in self._page()[0]] == ["conv_a"]
+        assert [c.conversation_id for c in run(StorageService.get_user_conversations("user_1"))] == ["conv_a"]
+
+    def test_invalid_cursor(self, storage):
+        with pytest.raises(ValueError):
+            self._page(cursor="not-a-cursor")
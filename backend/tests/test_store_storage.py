@@ -0,0 +1,53 @@
+"""StoreStorage 订单索引测试：全部读写落在 tmp_path。"""
+import asyncio
+import json
+
+import pytest
+
+import services.store_storage as store_module
+from services.json_file_cache import JsonFileCache
+from services.store_storage import StoreStorage
+from store_models import PaymentOrder
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(store_module, "WALLETS_FILE", tmp_path / "wallets.json")
+    monkeypatch.setattr(store_module, "PAYMENT_ORDERS_FILE", tmp_path / "payment_orders.json")
+    monkeypatch.setattr(store_module, "_cache", JsonFileCache())
+    monkeypatch.setattr(store_module, "_order_index", store_module._OrderIndex())
+    return tmp_path
+
+
+def make_order(order_id: str, user_id: str = "user_1", created_at: str = "2026-01-01T00:00:00") -> PaymentOrder:
+    return PaymentOrder(
+        order_id=order_id, out_trade_no=f"T{order_id}", user_id=user_id, package_id="p1",
+        stardust=100, bonus=0, amount=600, provider="mock", method="qr", created_at=created_at,
+    )
+
+
+class TestOrderIndexes:
+    def test_lookup_by_out_trade_no(self, store):
+        run(StoreStorage.save_order(make_order("o1")))
+        run(StoreStorage.save_order(make_order("o2", user_id="user_2")))
+        assert run(StoreStorage.get_order_by_out_trade_no("To2")).order_id == "o2"
+        assert run(StoreStorage.get_order_by_out_trade_no("T404")) is None
+
+    def test_list_user_orders_newest_first(self, store):
+        run(StoreStorage.save_order(make_order("o1", created_at="2026-01-01T00:00:00")))
+        run(StoreStorage.save_order(make_order("o2", created_at="2026-01-02T00:00:00")))
+        run(StoreStorage.save_order(make_order("o3", user_id="user_2")))
+        assert [o.order_id for o in run(StoreStorage.list_user_orders("user_1"))] == ["o2", "o1"]
+        assert run(StoreStorage.list_user_orders("user_3")) == []
+
+    def test_index_rebuilt_after_external_change(self, store):
+        run(StoreStorage.save_order(make_order("o1")))
+        path = store / "payment_orders.json"
+        orders = json.loads(path.read_text(encoding="utf-8"))
+        orders["o9"] = make_order("o9").model_dump(mode="json")
+        path.write_text(json.dumps(orders), encoding="utf-8")
+        assert run(StoreStorage.get_order_by_out_trade_no("To9")).order_id == "o9"
@@ -0,0 +1,125 @@
+"""星尘账本测试：钱包变动只追加一行、快照 + 尾部重建、按订单幂等入账。"""
+import asyncio
+import json
+
+import pytest
+
+import services.store_storage as store_module
+from services.json_file_cache import JsonFileCache
+from services.payment_service import PaymentService
+from services.store_storage import StoreStorage, _ledger_paths
+from services.wallet_service import SEED_BALANCE, WalletService
+from store_catalog import get_deck
+from store_models import PaymentOrder
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(store_module, "WALLETS_FILE", tmp_path / "wallets.json")
+    monkeypatch.setattr(store_module, "WALLET_LEDGER_DIR", tmp_path / "wallet_ledgers")
+    monkeypatch.setattr(store_module, "PAYMENT_ORDERS_FILE", tmp_path / "payment_orders.json")
+    monkeypatch.setattr(store_module, "_cache", JsonFileCache())
+    monkeypatch.setattr(store_module, "_order_index", store_module._OrderIndex())
+    return tmp_path
+
+
+def ledger_lines(user_id: str = "user_1"):
+    return _ledger_paths(user_id)[1].read_text(encoding="utf-8").splitlines()
+
+
+def reload_wallet(user_id: str = "user_1"):
+    """模拟进程重启：丢掉内存缓存，从快照 + 账本重新折叠"""
+    store_module._cache.invalidate()
+    return run(StoreStorage.get_wallet(user_id))
+
+
+class TestWalletLedger:
+    def test_each_change_appends_one_line(self, store):
+        price = get_deck("lunar-mirage").price
+        run(WalletService.get_or_create_wallet("user_1"))
+        ok, _, wallet = run(WalletService.purchase_deck("user_1", "lunar-mirage"))
+        assert ok and wallet.balance == SEED_BALANCE - price
+        run(WalletService.set_active_deck("user_1", "lunar-mirage"))
+        run(WalletService.credit_stardust("user_1", 100))
+
+        assert [json.loads(line)["type"] for line in ledger_lines()] == ["grant", "purchase", "set_active", "credit"]
+        wallet = reload_wallet()
+        assert wallet.balance == SEED_BALANCE - price + 100
+        assert wallet.active_deck_id == "lunar-mirage"
+        assert "lunar-mirage" in wallet.owned_deck_ids
+
+    def test_snapshot_plus_tail(self, store, monkeypatch):
+        monkeypatch.setattr(store_module, "WALLET_SNAPSHOT_EVERY", 3)
+        for _ in range(4):
+            run(WalletService.credit_stardust("user_1", 1))
+        # grant + 4 次入账：第 3 条时写快照，其后 2 条留在尾部
+        snapshot = json.loads(_ledger_paths("user_1")[0].read_text(encoding="utf-8"))
+        assert snapshot["state"]["seq"] == 3
+        # 账本本身从不裁剪，是完整的流水
+        assert len(ledger_lines()) == 5
+        assert reload_wallet().balance == SEED_BALANCE + 4
+        assert len(run(WalletService.get_ledger("user_1", limit=4))) == 4
+
+    def test_credit_is_idempotent_by_order_id(self, store):
+        run(WalletService.credit_stardust("user_1", 500, order_id="order_a"))
+        run(WalletService.credit_stardust("user_1", 500, order_id="order_a"))
+        assert reload_wallet().balance == SEED_BALANCE + 500
+
+    def test_order_idempotency_uses_ledger_not_snapshot(self, store, monkeypatch):
+        monkeypatch.setattr(store_module, "WALLET_SNAPSHOT_EVERY", 2)
+        for i in range(3):
+            run(WalletService.credit_stardust("user_1", 10, order_id=f"order_{i}"))
+        snapshot = json.loads(_ledger_paths("user_1")[0].read_text(encoding="utf-8"))
+        assert "credited_orders" not in snapshot["state"]  # 快照不再随已入账订单增长
+        # 订单已被快照折叠、进程重启后仍按账本去重
+        reload_wallet()
+        run(WalletService.credit_stardust("user_1", 10, order_id="order_0"))
+        assert reload_wallet().balance == SEED_BALANCE + 30
+
+    def test_mark_paid_credits_once(self, store):
+        order = PaymentOrder(
+            order_id="order_x", out_trade_no="TX", user_id="user_1", package_id="starter",
+            stardust=1000, bonus=0, amount=600, provider="mock", method="qr",
+        )
+        run(StoreStorage.save_order(order))
+
+        async def pay_twice():
+            await asyncio.gather(PaymentService.mark_paid("order_x"), PaymentService.mark_paid("order_x"))
+        run(pay_twice())
+        assert reload_wallet().balance == SEED_BALANCE + 1000
+        assert run(StoreStorage.get_order("order_x")).credited
+
+    def test_torn_tail_is_ignored_and_overwritten(self, store):
+        run(WalletService.credit_stardust("user_1", 10))
+        with open(_ledger_paths("user_1")[1], "a", encoding="utf-8") as f:
+            f.write('{"seq": 2, "type": "cre')
+        assert reload_wallet().balance == SEED_BALANCE + 10
+        run(WalletService.credit_stardust("user_1", 5))
+        assert len(ledger_lines()) == 3
+        assert reload_wallet().balance == SEED_BALANCE + 15
+
+    def test_imports_legacy_wallets_file(self, store):
+        legacy = {"user_1": {"user_id": "user_1", "balance": 42, "owned_deck_ids": ["classic-rws", "gilded-ember"],
+                             "active_deck_id": "gilded-ember"}}
+        (store / "wallets.json").write_text(json.dumps(legacy), encoding="utf-8")
+        wallet = run(WalletService.get_or_create_wallet("user_1"))
+        assert (wallet.balance, wallet.active_deck_id) == (42, "gilded-ember")
+        assert [json.loads(line)["reason"] for line in ledger_lines()] == ["import"]
+
+    def test_unrecorded_event_is_reported_as_failure(self, store, monkeypatch):
+        run(WalletService.get_or_create_wallet("user_1"))
+        before = run(StoreStorage.get_wallet("user_1"))
+
+        async def not_applied(user_id, event):
+            return before, False
+
+        monkeypatch.setattr(StoreStorage, "append_wallet_event", not_applied)
+        ok, reason, wallet = run(WalletService.purchase_deck("user_1", "lunar-mirage"))
+        assert (ok, reason) == (False, "not_recorded")
+        assert "lunar-mirage" not in wallet.owned_deck_ids
+        ok, reason, _ = run(WalletService.set_active_deck("user_1", "classic-rws"))
+        assert ok  # 已是当前牌组，无需记账